@@ -0,0 +1,342 @@
+"""
+Inter-rater agreement over the consolidated annotations (see consolidate_annotations.py).
+
+For every annotation field of a role it reports:
+- Fleiss' kappa and percent agreement over all raters (images rated at least twice).
+- Cohen's kappa and percent agreement for every pair of raters, over the images both rated.
+- Weighted kappa (quadratic weights by default) for the ordinal fields in ORDINAL_FIELDS.
+
+Ratings are encoded once as small integer codes (one column per rater, -1 where a rater did
+not rate the image). Every statistic is then a function of the column sums of a per-image
+feature matrix: one-hot contingency cells for a rater pair, per-category counts for Fleiss'
+kappa. The point estimate uses plain sums; a bootstrap replicate resamples images and uses
+weighted sums, so a whole chunk of replicates is one matrix product. Chunks run in parallel
+in a process pool.
+
+Usage:
+    python agreement.py out/annotations_consolidated --role Clinician --bootstrap 1000
+    python agreement.py out/annotations_consolidated --role "Data Scientist" --csv ds_agreement.csv
+"""
+import argparse
+import os
+from concurrent.futures import ProcessPoolExecutor
+from functools import partial
+from itertools import combinations
+
+import numpy as np
+import pandas as pd
+import pyarrow.compute as pc
+import pyarrow.dataset as ds
+
+from field_registry import ROLE_FIELDS
+
+# Fields whose options are ordered, scored with weighted kappa as well.
+ORDINAL_FIELDS = ("ARDS_Likelihood_Score",)
+
+_CHUNK = 50         # bootstrap replicates per task
+
+
+# --- Loading and encoding ---
+
+def load_ratings(consolidated_dir, role):
+    """
+    Read one role's ratings from the consolidated dataset.
+
+    The consolidated table repeats a record for every annotator of the other role, so the
+    ratings are deduplicated per (image_path, rater).
+
+    Returns:
+    A DataFrame with image_path, rater and the role's annotation columns.
+    """
+    username_col = ROLE_FIELDS[role].username_col
+    dataset = ds.dataset(consolidated_dir, format="parquet", partitioning="hive")
+    table = dataset.to_table(
+        columns=["image_path", username_col, *ROLE_FIELDS[role].columns], filter=pc.field(username_col).is_valid()
+    )
+    df = table.to_pandas().drop_duplicates(["image_path", username_col])
+    return df.rename(columns={username_col: "rater"}).reset_index(drop=True)
+
+
+def encode_ratings(ratings, role):
+    """
+    Encode ratings as an (images x raters) code matrix per field.
+
+    Parameters:
+    - ratings: DataFrame with image_path, rater and the role's annotation columns.
+    - role: "Clinician" or "Data Scientist".
+
+    Returns:
+    A tuple (raters, {field: int8 matrix}); -1 marks a missing rating (no rating, or a value
+    that is not one of the field's options).
+    """
+    items, _ = pd.factorize(ratings["image_path"], sort=False)
+    rater_codes, raters = pd.factorize(ratings["rater"], sort=True)
+    shape = (int(items.max()) + 1 if len(items) else 0, len(raters))
+    matrices = {}
+    for column, options in ROLE_FIELDS[role].column_options:
+        # Typed (categorical) columns are recoded without decoding the strings
+        codes = pd.Categorical(ratings[column], categories=options).codes.astype(np.int8)
+        matrix = np.full(shape, -1, dtype=np.int8)
+        matrix[items, rater_codes] = codes
+        matrices[column] = matrix
+    return list(raters), matrices
+
+
+# --- Statistics from column sums ---
+# Each measure maps sums of shape (..., d) to estimates of shape (...).
+
+def _tables(sums):
+    k = int(round(np.sqrt(sums.shape[-1])))
+    return sums.reshape(sums.shape[:-1] + (k, k))
+
+
+def _kappa_from_tables(tables, weights):
+    n = tables.sum(axis=(-2, -1))
+    with np.errstate(invalid="ignore", divide="ignore"):
+        p = tables / n[..., None, None]
+        rows, cols = p.sum(axis=-1), p.sum(axis=-2)
+        observed = (weights * p).sum(axis=(-2, -1))
+        expected = (weights * rows[..., :, None] * cols[..., None, :]).sum(axis=(-2, -1))
+        return (observed - expected) / (1.0 - expected)
+
+
+def _agreement_weights(k, kind):
+    """
+    Agreement weights of a k x k table: identity for Cohen's kappa, 1 - |i - j| / (k - 1)
+    for linear and 1 - ((i - j) / (k - 1))^2 for quadratic weighted kappa.
+    """
+    if kind == "nominal" or k < 2:
+        return np.eye(k)
+    distance = np.abs(np.subtract.outer(np.arange(k), np.arange(k))) / (k - 1)
+    return 1.0 - (distance if kind == "linear" else distance ** 2)
+
+
+def _percent_agreement(sums):
+    tables = _tables(sums)
+    with np.errstate(invalid="ignore", divide="ignore"):
+        return np.trace(tables, axis1=-2, axis2=-1) / tables.sum(axis=(-2, -1))
+
+
+def _cohen_kappa(sums):
+    tables = _tables(sums)
+    return _kappa_from_tables(tables, _agreement_weights(tables.shape[-1], "nominal"))
+
+
+def _weighted_kappa(sums, kind="quadratic"):
+    tables = _tables(sums)
+    return _kappa_from_tables(tables, _agreement_weights(tables.shape[-1], kind))
+
+
+def _fleiss_kappa(sums):
+    # columns: sum of P_i, number of items, per-category counts, number of ratings
+    with np.errstate(invalid="ignore", divide="ignore"):
+        mean_p = sums[..., 0] / sums[..., 1]
+        p_j = sums[..., 2:-1] / sums[..., -1:]
+        expected = (p_j ** 2).sum(axis=-1)
+        return (mean_p - expected) / (1.0 - expected)
+
+
+def _fleiss_agreement(sums):
+    with np.errstate(invalid="ignore", divide="ignore"):
+        return sums[..., 0] / sums[..., 1]
+
+
+# --- Statistic specs ---
+
+class _Spec:
+    """
+    One statistic: the images it uses, their feature rows and the measures computed from
+    the feature sums.
+    """
+    __slots__ = ("field", "rater_a", "rater_b", "items", "features", "measures")
+
+    def __init__(self, field, rater_a, rater_b, items, features, measures):
+        self.field = field
+        self.rater_a = rater_a
+        self.rater_b = rater_b
+        self.items = items
+        self.features = features
+        self.measures = measures
+
+
+def _pair_spec(field, matrix, k, a, b, raters, weights):
+    both = np.flatnonzero((matrix[:, a] >= 0) & (matrix[:, b] >= 0))
+    cells = matrix[both, a].astype(np.int64) * k + matrix[both, b]
+    features = np.zeros((len(both), k * k), dtype=np.float32)
+    features[np.arange(len(both)), cells] = 1.0
+    measures = {"percent_agreement": _percent_agreement, "cohen_kappa": _cohen_kappa}
+    if field in ORDINAL_FIELDS:
+        measures["weighted_kappa"] = partial(_weighted_kappa, kind=weights)
+    return _Spec(field, raters[a], raters[b], both, features, measures)
+
+
+def _fleiss_spec(field, matrix, k):
+    rated = matrix >= 0
+    m = rated.sum(axis=1)
+    items = np.flatnonzero(m >= 2)
+    sub, m = matrix[items], m[items].astype(np.float64)
+    rows = np.repeat(np.arange(len(items)), sub.shape[1])
+    codes = sub.ravel()
+    keep = codes >= 0
+    counts = np.bincount(rows[keep] * k + codes[keep], minlength=len(items) * k).reshape(len(items), k)
+    with np.errstate(invalid="ignore", divide="ignore"):
+        p_i = ((counts ** 2).sum(axis=1) - m) / (m * (m - 1))
+    features = np.column_stack([p_i, np.ones(len(items)), counts, m]).astype(np.float32)
+    measures = {"percent_agreement": _fleiss_agreement, "fleiss_kappa": _fleiss_kappa}
+    return _Spec(field, None, None, items, features, measures)
+
+
+def build_specs(raters, matrices, role, weights="quadratic"):
+    """
+    Build the statistic specs of every field: one over all raters, one per rater pair.
+    """
+    options = dict(ROLE_FIELDS[role].column_options)
+    specs = []
+    for field, matrix in matrices.items():
+        k = len(options[field])
+        specs.append(_fleiss_spec(field, matrix, k))
+        for a, b in combinations(range(len(raters)), 2):
+            spec = _pair_spec(field, matrix, k, a, b, raters, weights)
+            if len(spec.items):
+                specs.append(spec)
+    return specs
+
+
+# --- Bootstrap ---
+
+_worker_specs = None
+_worker_items = 0
+
+
+def _init_worker(specs, n_items):
+    global _worker_specs, _worker_items
+    _worker_specs, _worker_items = specs, n_items
+
+
+def _bootstrap_chunk(seed, replicates, specs=None, n_items=None):
+    """
+    Compute `replicates` bootstrap replicates of every measure of every spec. Images are
+    resampled with replacement; a replicate's sums are the features weighted by how often
+    each image was drawn.
+
+    Returns:
+    A list (one entry per spec) of dicts measure -> array of `replicates` estimates.
+    """
+    specs = _worker_specs if specs is None else specs
+    n_items = _worker_items if n_items is None else n_items
+    rng = np.random.default_rng(seed)
+    weights = np.empty((replicates, n_items), dtype=np.float32)
+    for r in range(replicates):
+        weights[r] = np.bincount(rng.integers(0, n_items, n_items), minlength=n_items)
+
+    # Selecting the weights of a spec's images costs more than the product itself, so it
+    # is done once per distinct image set (every field of a rater pair usually shares one).
+    groups = {}
+    for i, spec in enumerate(specs):
+        groups.setdefault(spec.items.tobytes(), []).append(i)
+    results = [None] * len(specs)
+    for members in groups.values():
+        selected = weights[:, specs[members[0]].items]
+        for i in members:
+            sums = (selected @ specs[i].features).astype(np.float64)
+            results[i] = {name: measure(sums) for name, measure in specs[i].measures.items()}
+    return results
+
+
+def bootstrap(specs, n_items, replicates=1000, workers=None, seed=0):
+    """
+    Run the bootstrap in chunks of _CHUNK replicates, in a process pool when `workers` > 1.
+
+    Returns:
+    A list (one entry per spec) of dicts measure -> array of `replicates` estimates.
+    """
+    if replicates <= 0 or n_items == 0:
+        return [{name: np.array([]) for name in spec.measures} for spec in specs]
+    sizes = [min(_CHUNK, replicates - start) for start in range(0, replicates, _CHUNK)]
+    seeds = np.random.SeedSequence(seed).spawn(len(sizes))
+    if workers is None:
+        workers = os.cpu_count() or 1
+    if workers > 1 and len(sizes) > 1:
+        with ProcessPoolExecutor(max_workers=min(workers, len(sizes)), initializer=_init_worker,
+                                 initargs=(specs, n_items)) as executor:
+            chunks = list(executor.map(_bootstrap_chunk, seeds, sizes))
+    else:
+        chunks = [_bootstrap_chunk(s, size, specs, n_items) for s, size in zip(seeds, sizes)]
+    return [
+        {name: np.concatenate([chunk[i][name] for chunk in chunks]) for name in spec.measures}
+        for i, spec in enumerate(specs)
+    ]
+
+
+# --- Report ---
+
+def agreement_table(ratings, role, replicates=1000, confidence=0.95, weights="quadratic", workers=None, seed=0):
+    """
+    Compute every agreement measure of a role's fields.
+
+    Parameters:
+    - ratings: DataFrame with image_path, rater and the role's annotation columns
+      (see `load_ratings`).
+    - role: "Clinician" or "Data Scientist".
+    - replicates: Bootstrap replicates for the confidence intervals (0 to skip).
+    - confidence: Confidence level of the percentile intervals.
+    - weights: "quadratic" or "linear" weights for the weighted kappa.
+    - workers: Bootstrap processes (default: one per CPU; 1 runs inline).
+    - seed: Seed of the bootstrap.
+
+    Returns:
+    A DataFrame with one row per field, rater pair (None for all raters) and measure:
+    field, rater_a, rater_b, measure, n_images, estimate, ci_low, ci_high.
+    """
+    raters, matrices = encode_ratings(ratings, role)
+    specs = build_specs(raters, matrices, role, weights)
+    n_items = next(iter(matrices.values())).shape[0] if matrices else 0
+    replicas = bootstrap(specs, n_items, replicates, workers, seed)
+    tail = (1.0 - confidence) / 2 * 100
+    rows = []
+    for spec, boot in zip(specs, replicas):
+        totals = spec.features.sum(axis=0, dtype=np.float64)
+        for name, measure in spec.measures.items():
+            samples = boot[name][np.isfinite(boot[name])]
+            low, high = np.percentile(samples, [tail, 100 - tail]) if len(samples) else (np.nan, np.nan)
+            rows.append({
+                "field": spec.field,
+                "rater_a": spec.rater_a,
+                "rater_b": spec.rater_b,
+                "measure": name,
+                "n_images": len(spec.items),
+                "estimate": float(measure(totals)) if len(spec.items) else np.nan,
+                "ci_low": low,
+                "ci_high": high,
+            })
+    return pd.DataFrame(rows, columns=["field", "rater_a", "rater_b", "measure", "n_images", "estimate", "ci_low", "ci_high"])
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("consolidated_dir", help="Output directory of consolidate_annotations.py.")
+    parser.add_argument("--role", choices=list(ROLE_FIELDS), default="Clinician")
+    parser.add_argument("--bootstrap", type=int, default=1000, help="Bootstrap replicates (0 to skip the intervals).")
+    parser.add_argument("--confidence", type=float, default=0.95)
+    parser.add_argument("--weights", choices=["quadratic", "linear"], default="quadratic")
+    parser.add_argument("--workers", type=int, default=None, help="Bootstrap processes (default: one per CPU).")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--csv", default=None, help="Also write the table to this CSV file.")
+    args = parser.parse_args(argv)
+
+    ratings = load_ratings(args.consolidated_dir, args.role)
+    table = agreement_table(ratings, args.role, args.bootstrap, args.confidence, args.weights, args.workers, args.seed)
+    if args.csv:
+        table.to_csv(args.csv, index=False)
+    overall = table[table["rater_a"].isna()]
+    with pd.option_context("display.width", 200, "display.max_rows", None):
+        print(f"\n--- {args.role} agreement ({len(ratings)} ratings by {ratings['rater'].nunique()} raters) ---")
+        print(overall.drop(columns=["rater_a", "rater_b"]).to_string(index=False, float_format="%.3f"))
+        pairs = table[table["rater_a"].notna()]
+        if not pairs.empty:
+            print("\nPer rater pair:")
+            print(pairs.to_string(index=False, float_format="%.3f"))
+
+
+if __name__ == "__main__":
+    main()
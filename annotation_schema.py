@@ -0,0 +1,280 @@
+"""
+Typed schema of the annotation files, derived from the field registry (field_registry).
+
+- Radio fields are categoricals whose categories are the field's options in display order
+  (int8 codes in memory and in Arrow tables read with `read_table`, dictionary-encoded
+  columns in parquet). Reading a value still gives the option string, so the UI needs no
+  change.
+- Timestamps are real timestamps (datetime64 in memory, timestamp[ms] on disk), so the
+  "latest record" sorts compare integers instead of ISO strings.
+- Key columns (image_path, study_icn, dicom_id, username, role) are categoricals in
+  memory and dictionary-encoded on disk, so the per-image and per-user filters compare
+  integer codes.
+- Version is int32.
+- Files are written with parquet dictionary encoding and zstd compression.
+
+Parquet always reads dictionary indices back as int32; `to_frame` and `read_table` turn
+the field columns back into int8 codes.
+
+Files written before this schema (plain strings) are converted on read, so old and new
+files can be mixed. Values that are not one of a field's options are kept as extra
+categories after the options, never dropped.
+"""
+from functools import lru_cache
+
+import pandas as pd
+import pyarrow as pa
+import pyarrow.compute as pc
+import pyarrow.parquet as pq
+
+from field_registry import ROLE_FIELDS
+
+VERSION_COL = "Version"
+COMPRESSION = "zstd"
+CODE_TYPE = pa.int8()
+TIMESTAMP_TYPE = pa.timestamp("ms")
+KEY_TYPE = pa.dictionary(pa.int32(), pa.string())     # the index type parquet restores
+
+# Columns filtered on, held as categoricals in memory.
+KEY_COLUMNS = ("image_path", "study_icn", "dicom_id")
+
+
+def role_fields(role):
+    """
+    Return the annotation fields of a role as a tuple of (column, options).
+    """
+    return ROLE_FIELDS[role].column_options
+
+
+def _key_columns(roles):
+    """
+    Return the key columns of records of these roles.
+    """
+    keys = list(KEY_COLUMNS)
+    for role in roles:
+        keys += [ROLE_FIELDS[role].username_col, ROLE_FIELDS[role].user_role_col]
+    return keys
+
+
+def roles_of(columns):
+    """
+    Return the roles whose records have these columns (both for a consolidated table).
+    """
+    return [role for role, fields in ROLE_FIELDS.items() if fields.username_col in columns]
+
+
+@lru_cache(maxsize=None)
+def arrow_types(role):
+    """
+    Return the Arrow type of every typed column of a role's annotation files (columns
+    not listed, such as AnnotationID or image_path, are strings).
+    """
+    fields = ROLE_FIELDS[role]
+    types = {
+        fields.timestamp_col: TIMESTAMP_TYPE,
+        fields.elapsed_col: pa.float64(),
+        VERSION_COL: pa.int32(),
+    }
+    for column in fields.columns:
+        types[column] = pa.dictionary(CODE_TYPE, pa.string())
+    return types
+
+
+def file_types(columns):
+    """
+    Return the on-disk Arrow type of every typed column among `columns` (typed fields and
+    key columns of every role the columns belong to).
+    """
+    roles = roles_of(columns)
+    types = {column: KEY_TYPE for column in _key_columns(roles)}
+    for role in roles:
+        types.update(arrow_types(role))
+    return types
+
+
+def _as_category(series, options):
+    """
+    Convert a column to a categorical whose categories start with `options`.
+    """
+    options = list(options)
+    if isinstance(series.dtype, pd.CategoricalDtype):
+        present = list(series.cat.categories)
+        if present[:len(options)] == options:
+            return series
+        extra = sorted(str(c) for c in present if c not in options)
+        return series.cat.set_categories(options + extra)
+    values = series.astype(object).where(series.notna(), None)
+    values = values.map(lambda v: v.strip() if isinstance(v, str) else v)
+    extra = sorted({str(v) for v in values.dropna().unique()} - set(options))
+    return pd.Series(pd.Categorical(values, categories=options + extra), index=series.index, name=series.name)
+
+
+def to_typed(df, roles=None):
+    """
+    Convert an annotation frame to the typed in-memory form. Columns that are already typed
+    are left as they are; the input is never modified.
+
+    Parameters:
+    - df: Annotation records (typed or plain strings).
+    - roles: Roles whose columns to convert (default: inferred from the columns).
+
+    Returns:
+    The typed frame.
+    """
+    roles = roles_of(df.columns) if roles is None else roles
+    if not roles or df.empty:
+        return df
+    out = df.copy(deep=False)
+    for role in roles:
+        timestamp_col = ROLE_FIELDS[role].timestamp_col
+        if timestamp_col in out.columns and not pd.api.types.is_datetime64_any_dtype(out[timestamp_col]):
+            out[timestamp_col] = pd.to_datetime(out[timestamp_col], errors="coerce", format="ISO8601")
+        for column, options in role_fields(role):
+            if column in out.columns:
+                out[column] = _as_category(out[column], options)
+    for column in _key_columns(roles):
+        if column in out.columns and not isinstance(out[column].dtype, pd.CategoricalDtype):
+            out[column] = out[column].astype("category")
+    if VERSION_COL in out.columns and out[VERSION_COL].dtype != "Int32":
+        out[VERSION_COL] = out[VERSION_COL].astype("Int32")
+    return out
+
+
+def concat_typed(frames):
+    """
+    Concatenate typed annotation frames. Categorical columns stay categorical: their
+    categories are aligned first (pandas falls back to object columns when they differ).
+    """
+    frames = [f.copy(deep=False) for f in frames if not f.empty]
+    if len(frames) <= 1:
+        return frames[0] if frames else pd.DataFrame()
+    for column in frames[0].columns:
+        dtypes = [f[column].dtype for f in frames if column in f.columns]
+        if len(dtypes) < len(frames) or not all(isinstance(d, pd.CategoricalDtype) for d in dtypes):
+            continue
+        if all(d == dtypes[0] for d in dtypes[1:]):
+            continue
+        categories = list(dtypes[0].categories)
+        seen = set(categories)
+        for dtype in dtypes[1:]:
+            extra = [c for c in dtype.categories if c not in seen]
+            categories += extra
+            seen.update(extra)
+        for f in frames:
+            f[column] = f[column].cat.set_categories(categories)
+    return pd.concat(frames, ignore_index=True)
+
+
+def read_table(path, columns, role):
+    """
+    Read columns of an annotation file as an Arrow table with the typed schema. Columns
+    the file does not have are filled with nulls.
+
+    Raises:
+    - OSError / pyarrow.ArrowInvalid: if the file cannot be read.
+    """
+    types = arrow_types(role)
+    schema = pa.schema([(c, types.get(c, pa.string())) for c in columns])
+    names = set(pq.read_schema(path).names)
+    table = pq.read_table(path, columns=[c for c in columns if c in names])
+    for field in schema:
+        if field.name not in names:
+            table = table.append_column(field, pa.nulls(len(table), field.type))
+    table = table.select(columns)
+    try:
+        return table.cast(schema)
+    except pa.ArrowInvalid:
+        # Written before the typed schema, with timestamps Arrow does not parse
+        return pa.Table.from_pandas(to_typed(table.to_pandas(), [role]), preserve_index=False).cast(schema, safe=False)
+
+
+def conform(table):
+    """
+    Cast an Arrow table of annotation records to the on-disk schema.
+
+    Raises:
+    - pyarrow.ArrowInvalid: if a column cannot be cast in Arrow (timestamps of files
+      written before the typed schema carry microseconds; convert those with `to_typed`).
+    """
+    types = file_types(table.schema.names)
+    if not types:
+        return table
+    schema = pa.schema(
+        [pa.field(f.name, types.get(f.name, f.type)) for f in table.schema], metadata=table.schema.metadata
+    )
+    return table.cast(schema, safe=False)
+
+
+def to_table(df):
+    """
+    Convert an annotation frame to an Arrow table with the on-disk schema. The frame may be
+    typed or hold option strings and pandas timestamps (as built by the app); plain
+    string timestamps need `to_typed` first.
+    """
+    return conform(pa.Table.from_pandas(df, preserve_index=False))
+
+
+def to_frame(table):
+    """
+    Convert an Arrow table of annotation records to the typed in-memory form.
+    """
+    # Parquet keeps only the options in use, so the field dictionaries are remapped to the
+    # options in display order here: in Arrow, on the dictionaries and integer codes only.
+    table = table.unify_dictionaries()
+    for role in roles_of(table.column_names):
+        for column, options in role_fields(role):
+            if column not in table.column_names:
+                continue
+            values = table[column]
+            if not pa.types.is_dictionary(values.type):     # written before the typed schema
+                values = pc.dictionary_encode(values)
+            values = values.combine_chunks()
+            present = pc.utf8_trim_whitespace(values.dictionary.cast(pa.string()))
+            extra = sorted(set(present.drop_null().to_pylist()) - set(options))
+            dictionary = pa.array(list(options) + extra, pa.string())
+            codes = pc.take(pc.index_in(present, value_set=dictionary).cast(CODE_TYPE), values.indices)
+            table = table.set_column(
+                table.schema.get_field_index(column), column, pa.DictionaryArray.from_arrays(codes, dictionary)
+            )
+    return to_typed(table.to_pandas())
+
+
+def read_file_table(path):
+    """
+    Read a whole annotation file as an Arrow table with the on-disk schema, converting
+    files written before the typed schema.
+
+    Raises:
+    - FileNotFoundError: if the file does not exist.
+    """
+    table = pq.read_table(path)
+    try:
+        return conform(table)
+    except pa.ArrowInvalid:
+        return to_table(to_typed(table.to_pandas()))
+
+
+def read_annotations(path, columns=None):
+    """
+    Read an annotation file in the typed form.
+
+    Raises:
+    - FileNotFoundError: if the file does not exist.
+    """
+    return to_frame(pq.read_table(path, columns=columns))
+
+
+def write_table(table, path):
+    """
+    Write an Arrow table of annotation records (see `to_table`) with dictionary encoding
+    and zstd.
+    """
+    pq.write_table(table, path, compression=COMPRESSION, use_dictionary=True,
+                   coerce_timestamps="ms", allow_truncated_timestamps=True)
+
+
+def write_annotations(df, path):
+    """
+    Write an annotation frame with the typed schema, dictionary encoding and zstd.
+    """
+    write_table(to_table(to_typed(df)), path)
@@ -0,0 +1,270 @@
+"""
+Versioned annotation store with compare-and-swap writes.
+
+Every record (one per image and user in a daily annotation file) carries a `Version`
+number. A writer says which version each of its records was based on; the write goes
+through only if those are still the stored versions, so an edit made in another tab is
+never silently overwritten, and the conflict is reported to the caller instead.
+
+The expensive part of a write (reading the file, merging, writing the new parquet file)
+happens without any lock, and in Arrow: the records stay in the on-disk schema of
+annotation_schema and are never converted to pandas on the way (callers convert the
+returned table when they need a frame, see `annotation_schema.to_frame`). A short
+exclusive lock (an O_EXCL lock file next to the data file) is held only to check that the
+file is still the one that was read and to rename the new file over it. If another writer
+replaced the file in between, the write is re-validated against the new contents and
+merged again.
+"""
+import os
+import time
+import uuid
+from contextlib import contextmanager
+from glob import glob
+
+import pandas as pd
+import pyarrow as pa
+import pyarrow.compute as pc
+
+from annotation_schema import VERSION_COL, read_annotations, read_file_table, to_table, write_table
+from config import ANNOTATION_DIR, ANNOTATION_LOCK_TIMEOUT
+
+LOCK_SUFFIX = ".lock"
+LOCK_STALE_SECONDS = 30.0       # a lock file older than this was left by a crashed writer
+
+
+class StoreBusy(RuntimeError):
+    """Raised when the annotation file's lock could not be taken in time."""
+
+
+def annotation_files(username, role, annotation_dir=ANNOTATION_DIR):
+    """
+    Return every daily annotation file of a user for a role, oldest first.
+    Pass username="*" for the files of every user.
+    """
+    pattern = os.path.join(annotation_dir, f"ardsquest_annotations_{username}_{role}_*.parquet")
+    return sorted(glob(pattern))
+
+
+def _signature(path):
+    """
+    Identify the current contents of a file: (mtime_ns, size, inode), or None if missing.
+    Every successful write renames a new file into place, so the signature changes.
+    """
+    try:
+        st = os.stat(path)
+    except FileNotFoundError:
+        return None
+    return st.st_mtime_ns, st.st_size, st.st_ino
+
+
+@contextmanager
+def exclusive(path, timeout=ANNOTATION_LOCK_TIMEOUT):
+    """
+    Hold the lock file of `path` for the duration of the block.
+
+    The lock is created with O_CREAT | O_EXCL, which is atomic on every platform and
+    filesystem the app runs on (no msvcrt / fcntl). Lock files older than
+    LOCK_STALE_SECONDS are broken (see `_break_stale_lock`).
+
+    Raises:
+    - StoreBusy: if the lock is still held by someone else after `timeout` seconds.
+    """
+    lock_path = path + LOCK_SUFFIX
+    deadline = time.monotonic() + timeout
+    delay = 0.002
+    while True:
+        try:
+            fd = os.open(lock_path, os.O_CREAT | os.O_EXCL | os.O_WRONLY)
+            break
+        except FileExistsError:
+            try:
+                st = os.stat(lock_path)
+            except FileNotFoundError:
+                continue
+            if time.time() - st.st_mtime > LOCK_STALE_SECONDS:
+                _break_stale_lock(lock_path, st)
+                continue
+            if time.monotonic() >= deadline:
+                raise StoreBusy(f"{os.path.basename(path)} is locked by another writer")
+            time.sleep(delay)
+            delay = min(delay * 2, 0.05)
+    own = os.fstat(fd)
+    try:
+        yield
+    finally:
+        os.close(fd)
+        # Only remove the lock if it is still ours (it may have been broken as stale)
+        try:
+            if _same_file(os.stat(lock_path), own):
+                os.remove(lock_path)
+        except FileNotFoundError:
+            pass
+
+
+def _same_file(a, b):
+    return (a.st_ino, a.st_mtime_ns, a.st_size) == (b.st_ino, b.st_mtime_ns, b.st_size)
+
+
+def _break_stale_lock(lock_path, stale):
+    """
+    Remove a stale lock file, without ever removing a fresh lock that replaced it.
+
+    The lock is first renamed to a unique name, which only one waiter can do. If the file
+    that was moved is not the one found stale (another writer broke it and took a new lock
+    in between), it is linked back into place instead of being removed.
+
+    Parameters:
+    - lock_path: Path of the lock file.
+    - stale: `os.stat` result of the lock file that was found stale.
+    """
+    moved = f"{lock_path}.{uuid.uuid4().hex}.stale"
+    try:
+        os.rename(lock_path, moved)
+    except FileNotFoundError:
+        return
+    try:
+        if not _same_file(os.stat(moved), stale):
+            try:
+                os.link(moved, lock_path)
+            except FileExistsError:
+                pass
+    finally:
+        os.remove(moved)
+
+
+def read_records(path):
+    """
+    Read an annotation file in the typed form (see annotation_schema), or return an empty
+    DataFrame if it does not exist yet.
+    """
+    try:
+        return read_annotations(path)
+    except FileNotFoundError:
+        return pd.DataFrame()
+
+
+def record_versions(df, username_col, username, image_paths=None):
+    """
+    Return the stored version of each of a user's records.
+
+    Records written before versioning have no Version and count as version 1.
+
+    Parameters:
+    - df: Contents of an annotation file.
+    - username_col: "Username_cl" or "Username_ds".
+    - username: Annotator.
+    - image_paths: Restrict to these images (default: all of the user's images).
+
+    Returns:
+    A dict image_path -> version; images without a record are absent (version 0).
+    """
+    if df.empty or username_col not in df.columns:
+        return {}
+    mine = df[df[username_col] == username]
+    if image_paths is not None:
+        mine = mine[mine["image_path"].isin(list(image_paths))]
+    if mine.empty:
+        return {}
+    if VERSION_COL in mine.columns:
+        versions = mine[VERSION_COL].fillna(1).astype("int64")
+    else:
+        versions = pd.Series(1, index=mine.index, dtype="int64")
+    return versions.groupby(mine["image_path"], observed=True).max().to_dict()
+
+
+def _read_table(path):
+    """
+    Read an annotation file as an Arrow table, or None if it does not exist yet.
+    """
+    try:
+        return read_file_table(path)
+    except FileNotFoundError:
+        return None
+
+
+def user_rows(table, username_col, username, image_paths):
+    """
+    Boolean mask of a user's records of the given images in an Arrow table (never null).
+    """
+    mine = pc.fill_null(pc.equal(table[username_col], username), False)
+    return pc.and_(mine, pc.is_in(table["image_path"], value_set=pa.array(image_paths, pa.string())))
+
+
+def _table_versions(table, username_col, username, image_paths):
+    """
+    `record_versions` of an Arrow table, evaluated on the user's matching records only.
+    """
+    if table is None or username_col not in table.column_names:
+        return {}
+    mine = table.filter(user_rows(table, username_col, username, image_paths))
+    paths = mine["image_path"].to_pylist()
+    if VERSION_COL in mine.column_names:
+        stored = mine[VERSION_COL].to_pylist()
+    else:
+        stored = [None] * len(paths)
+    versions = {}
+    for path, version in zip(paths, stored):
+        # Records written before versioning count as version 1
+        versions[path] = max(versions.get(path, 0), 1 if version is None else version)
+    return versions
+
+
+def compare_and_swap(path, df_new, username_col, username, expected, max_attempts=8, lock_timeout=ANNOTATION_LOCK_TIMEOUT):
+    """
+    Replace a user's records in an annotation file if nobody changed them meanwhile.
+
+    Parameters:
+    - path: Annotation file.
+    - df_new: New records, one per image_path (without Version).
+    - username_col: "Username_cl" or "Username_ds".
+    - username: Annotator.
+    - expected: Dict image_path -> version the edit was based on (0 or absent: no record;
+      None: not known for this file, so the image is not checked).
+    - max_attempts: Merges to try while other writers keep replacing the file.
+    - lock_timeout: Seconds to wait for the lock on each attempt.
+
+    Returns:
+    A dict with
+    - saved: True if the records were written.
+    - conflicts: Image paths whose stored version differs from `expected` (nothing is
+      written if there are any).
+    - versions: The stored versions of the records after the call.
+    - table: The file contents after the call, as an Arrow table (None if there is no file).
+    - attempts: Number of merges performed.
+
+    Raises:
+    - StoreBusy: if the lock could not be taken.
+    """
+    paths = list(df_new["image_path"])
+    directory = os.path.dirname(path) or "."
+    for attempt in range(1, max_attempts + 1):
+        signature = _signature(path)
+        existing = _read_table(path)
+        current = _table_versions(existing, username_col, username, paths)
+        conflicts = [
+            p for p in paths if expected.get(p, 0) is not None and current.get(p, 0) != expected.get(p, 0)
+        ]
+        if conflicts:
+            return {"saved": False, "conflicts": conflicts, "versions": current, "table": existing, "attempts": attempt}
+
+        new = df_new.copy()
+        versions = [current.get(p, 0) + 1 for p in paths]
+        new[VERSION_COL] = versions
+        merged = to_table(new)
+        if existing is not None:
+            existing = existing.filter(pc.invert(user_rows(existing, username_col, username, paths)))
+            merged = pa.concat_tables([existing, merged], promote_options="permissive")
+
+        tmp_path = os.path.join(directory, f".{os.path.basename(path)}.{uuid.uuid4().hex}.tmp")
+        write_table(merged, tmp_path)
+        try:
+            with exclusive(path, lock_timeout):
+                if _signature(path) == signature:
+                    os.replace(tmp_path, path)
+                    return {"saved": True, "conflicts": [], "versions": dict(zip(paths, versions)),
+                            "table": merged, "attempts": attempt}
+        finally:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+        # Another writer replaced the file after we read it: validate again on its contents.
+    return {"saved": False, "conflicts": [], "versions": {}, "table": _read_table(path), "attempts": max_attempts}
@@ -0,0 +1,278 @@
+"""
+Benchmark of the DICOM index on the rerun path: per-rerun time and per-session memory.
+
+Compares the two ways the app has held the index:
+- before: `@st.cache_data load_dicom_index`. Every cache hit unpickles a fresh copy of the
+  frame (which is what st.cache_data does to protect its cached value), the session keeps
+  that copy in st.session_state.dicom_df, and the study grouping is recomputed with boolean
+  masks and `unique()` on every rerun.
+- after: the process-wide read-only DicomIndex (dicom_index.py). A rerun costs one stat of
+  the parquet file plus lookups into the precomputed study groups, and the session keeps
+  only its cursor.
+
+It also times the login-time resume lookup (resume.py) against --annotated of the index
+already annotated by the user, spread over --files daily annotation files, written as plain
+strings and with the typed schema (annotation_schema.py). Finally it compares one
+annotation file of --records records in both formats: file and frame size, read time, and
+the filter-and-sort lookup done when an image is opened.
+
+Both variants run the same per-rerun work the main script and the role interface do for
+the given role. Session memory is what --sessions fresh sessions still hold (tracemalloc)
+after one rerun each, divided by the number of sessions.
+
+Usage:
+    python bench_index.py --images 100000 --sessions 20 --reruns 50 --role Clinician --annotated 0.8
+"""
+import argparse
+import gc
+import os
+import pickle
+import shutil
+import tempfile
+import time
+import tracemalloc
+
+import numpy as np
+import pandas as pd
+
+from bench_save_path import make_synthetic_index, pct_line
+
+
+def _rerun_before(cached_bytes, session, role):
+    dicom_df = pickle.loads(cached_bytes)       # st.cache_data hit
+    session["dicom_df"] = dicom_df
+    if role == "Clinician":
+        if "current_patient_group" not in session:
+            session["current_patient_group"] = dicom_df["study_icn"].unique()[0]
+        patient_df = dicom_df[dicom_df["study_icn"] == session["current_patient_group"]]
+        patient_df = patient_df.reset_index(drop=True)
+        selected_row = patient_df.iloc[session.setdefault("view_idx", 0)]
+        session["selected_row"] = selected_row
+        patients = dicom_df["study_icn"].unique()
+        list(patients).index(session["current_patient_group"])
+        list(dicom_df.loc[dicom_df["study_icn"] == session["current_patient_group"], "image_path"])
+        len(dicom_df[dicom_df["study_icn"] == session["current_patient_group"]])
+    else:
+        selected_row = dicom_df.iloc[session.setdefault("ds_idx", 0)]
+        session["selected_row"] = selected_row
+        len(dicom_df)
+    return selected_row
+
+
+def _rerun_after(get_index, session, role):
+    index = get_index()
+    if role == "Clinician":
+        if "current_patient_group" not in session:
+            session["current_patient_group"] = index.studies[0]
+        rows = index.study_rows(session["current_patient_group"])
+        selected_row = index.row(rows[session.setdefault("view_idx", 0)])
+        index.study_position(session["current_patient_group"])
+        index.study_paths(session["current_patient_group"])
+    else:
+        selected_row = index.row(session.setdefault("ds_idx", 0))
+        len(index)
+    return selected_row
+
+
+def _measure(rerun, sessions, reruns, pick_start):
+    """
+    Run `reruns` reruns for each of `sessions` sessions, then measure what a fresh set of
+    sessions holds after one rerun each (tracemalloc slows allocation, so it is kept out of
+    the timed pass).
+
+    Returns:
+    A tuple (per-rerun latencies in seconds, bytes held per session).
+    """
+    latencies = []
+    for s in range(sessions):
+        session = pick_start(s)
+        for _ in range(reruns):
+            t = time.perf_counter()
+            rerun(session)
+            latencies.append(time.perf_counter() - t)
+
+    gc.collect()
+    tracemalloc.start()
+    base = tracemalloc.get_traced_memory()[0]
+    held_sessions = []
+    for s in range(sessions):
+        session = pick_start(s)
+        rerun(session)
+        held_sessions.append(session)
+    gc.collect()
+    held = tracemalloc.get_traced_memory()[0] - base
+    tracemalloc.stop()
+    del held_sessions
+    return latencies, held / max(sessions, 1)
+
+
+def _write_annotations(annotation_dir, dicom_df, username, role, fraction, files, typed=True):
+    """
+    Write daily annotation files marking the first `fraction` of the index as complete,
+    with the typed schema (annotation_schema) or, if not `typed`, as plain strings like
+    files written before it.
+
+    Returns:
+    The number of annotated images.
+    """
+    from annotation_schema import write_annotations
+    from field_registry import ROLE_FIELDS
+
+    fields = ROLE_FIELDS[role]
+    done = dicom_df.iloc[: int(len(dicom_df) * fraction)]
+    for day, chunk in enumerate(np.array_split(np.arange(len(done)), max(files, 1))):
+        part = done.iloc[chunk]
+        records = pd.DataFrame({
+            fields.timestamp_col: f"2025-01-{day + 1:02d}T12:00:00",
+            fields.username_col: username,
+            "study_icn": part["study_icn"].to_numpy(),
+            "dicom_id": part["dicom_id"].to_numpy(),
+            "image_path": part["image_path"].to_numpy(),
+        })
+        for column, options in fields.column_options:
+            records[column] = options[0]
+        path = os.path.join(annotation_dir, f"ardsquest_annotations_{username}_{role}_202501{day + 1:02d}.parquet")
+        if typed:
+            write_annotations(records, path)
+        else:
+            records.to_parquet(path, index=False)
+    return len(done)
+
+
+def _annotation_formats(work_dir, dicom_df, role, rows, lookups=200, seed=0):
+    """
+    Compare one annotation file of `rows` records written as plain strings (before) and
+    with the typed schema (after): file size, read time, in-memory size, and the
+    filter-and-sort lookup `load_annotations_for_image` does.
+
+    Returns:
+    A dict variant -> dict of measurements.
+    """
+    from annotation_schema import read_annotations, write_annotations
+    from field_registry import ROLE_FIELDS
+
+    fields = ROLE_FIELDS[role]
+    rng = np.random.default_rng(seed)
+    part = dicom_df.iloc[rng.integers(0, len(dicom_df), rows)]
+    start = np.datetime64("2025-01-01T08:00:00")
+    records = pd.DataFrame({
+        fields.timestamp_col: (start + rng.integers(0, 36_000, rows).astype("timedelta64[s]")).astype(str),
+        fields.username_col: "bench_user",
+        fields.user_role_col: role,
+        "study_icn": part["study_icn"].to_numpy(),
+        "dicom_id": part["dicom_id"].to_numpy(),
+        "image_path": part["image_path"].to_numpy(),
+    })
+    for column, options in fields.column_options:
+        records[column] = np.array(options, dtype=object)[rng.integers(0, len(options), rows)]
+    targets = records["image_path"].to_numpy()[rng.integers(0, rows, lookups)]
+
+    results = {}
+    for variant in ("before", "after"):
+        path = os.path.join(work_dir, f"formats_{variant}.parquet")
+        if variant == "before":
+            records.to_parquet(path, index=False)
+        else:
+            write_annotations(records, path)
+        t = time.perf_counter()
+        df = pd.read_parquet(path) if variant == "before" else read_annotations(path)
+        read_s = time.perf_counter() - t
+        lookup = []
+        for image_path in targets:
+            t = time.perf_counter()
+            matches = df[(df["image_path"] == image_path) & (df[fields.username_col] == "bench_user")]
+            matches.sort_values(by=fields.timestamp_col, ascending=False).iloc[0]
+            lookup.append(time.perf_counter() - t)
+        t = time.perf_counter()
+        df.sort_values(fields.timestamp_col, kind="stable")
+        sort_s = time.perf_counter() - t
+        results[variant] = {
+            "file_bytes": os.path.getsize(path),
+            "frame_bytes": int(df.memory_usage(index=True, deep=True).sum()),
+            "read_s": read_s,
+            "sort_s": sort_s,
+            "lookup": lookup,
+        }
+    return results
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--images", type=int, default=100_000, help="Rows in the synthetic index.")
+    parser.add_argument("--sessions", type=int, default=20, help="Simulated sessions.")
+    parser.add_argument("--reruns", type=int, default=50, help="Reruns per session.")
+    parser.add_argument("--role", choices=["Data Scientist", "Clinician"], default="Clinician")
+    parser.add_argument("--annotated", type=float, default=0.8, help="Fraction already annotated, for the resume lookup.")
+    parser.add_argument("--files", type=int, default=30, help="Daily annotation files the annotations are spread over.")
+    parser.add_argument("--records", type=int, default=20_000, help="Records in the annotation file format comparison.")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args(argv)
+
+    work_dir = tempfile.mkdtemp(prefix="ardsquest_bench_index_")
+    try:
+        parquet_path = os.path.join(work_dir, "index.parquet")
+        dicom_df = make_synthetic_index(args.images, seed=args.seed)
+        dicom_df.to_parquet(parquet_path)
+        # dicom_index reads PARQUET_PATH from config at import time
+        os.environ["PARQUET_PATH"] = parquet_path
+        os.environ["ANNOTATION_DIR"] = work_dir
+        from dicom_index import get_dicom_index
+        from resume import resume_position
+
+        studies = dicom_df["study_icn"].unique()
+        rng = np.random.default_rng(args.seed)
+
+        def pick_start(_):
+            if args.role == "Clinician":
+                return {"current_patient_group": studies[rng.integers(len(studies))], "view_idx": 0}
+            return {"ds_idx": int(rng.integers(len(dicom_df)))}
+
+        cached_bytes = pickle.dumps(dicom_df, protocol=pickle.HIGHEST_PROTOCOL)
+        before, before_mem = _measure(
+            lambda session: _rerun_before(cached_bytes, session, args.role),
+            args.sessions, args.reruns, pick_start,
+        )
+        t = time.perf_counter()
+        index = get_dicom_index(parquet_path)
+        load_s = time.perf_counter() - t
+        after, after_mem = _measure(
+            lambda session: _rerun_after(lambda: get_dicom_index(parquet_path), session, args.role),
+            args.sessions, args.reruns, pick_start,
+        )
+
+        resume_times = {}
+        for typed in (False, True):
+            for name in os.listdir(work_dir):
+                if name.startswith("ardsquest_annotations_"):
+                    os.remove(os.path.join(work_dir, name))
+            annotated = _write_annotations(work_dir, dicom_df, "bench_user", args.role, args.annotated, args.files, typed)
+            resume_times[typed] = []
+            for _ in range(5):
+                t = time.perf_counter()
+                position = resume_position(index, "bench_user", args.role, work_dir)
+                resume_times[typed].append(time.perf_counter() - t)
+
+        formats = _annotation_formats(work_dir, dicom_df, args.role, args.records, seed=args.seed)
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+    print(f"\n--- DICOM index benchmark ({args.images} images, {index.num_studies} studies, "
+          f"{args.sessions} sessions x {args.reruns} reruns, {args.role}) ---")
+    print(f"Shared index       {index.nbytes() / 1e6:.1f} MB, loaded once in {load_s * 1000:.0f} ms")
+    print(pct_line("Rerun (before)", before))
+    print(pct_line("Rerun (after)", after))
+    print(f"Session memory     before {before_mem / 1e6:8.2f} MB   after {after_mem / 1e3:8.2f} KB")
+    print(pct_line("Resume (strings)", resume_times[False]))
+    print(pct_line("Resume (typed)", resume_times[True]))
+    print(f"Resume position    {position} ({annotated} images annotated in {args.files} files)")
+
+    print(f"\n--- Annotation file format ({args.records} records; before: plain strings, after: typed schema) ---")
+    for variant in ("before", "after"):
+        m = formats[variant]
+        print(f"{variant:<7} file {m['file_bytes'] / 1e3:8.1f} KB   frame {m['frame_bytes'] / 1e6:6.2f} MB   "
+              f"read {m['read_s'] * 1000:6.1f} ms   sort {m['sort_s'] * 1000:6.2f} ms")
+        print(pct_line(f"Lookup ({variant})", m["lookup"]))
+
+
+if __name__ == "__main__":
+    main()
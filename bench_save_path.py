@@ -0,0 +1,349 @@
+"""
+Benchmark and load-test harness for the annotation save path.
+
+This script drives the real save/load functions in annotation_utils and navigation
+headlessly (no Streamlit server) against a local annotation directory. Each simulated
+annotator runs in its own process with a DictSessionState bound as its session state and:
+- Clicks M radio buttons (each click goes through the same `_radio_changed` callback the UI uses).
+- Navigates to the next image/study once all fields of the current one are filled.
+
+Several annotators may share a username (e.g. two browser tabs of the same user), in which
+case they read-modify-write the same daily parquet file (through the versioned store in
+annotation_store.py). With --same-records they also edit the same images.
+
+Reported metrics:
+- Per-click save latency percentiles (radio clicks and navigations).
+- Retry counts: I/O retries plus merges redone because another writer replaced the file.
+- Conflicts: saves the versioned store rejected because another tab changed the record first.
+- Lost updates: records an annotator saved that are missing/different in the final file.
+- Annotation file sizes over the course of the run.
+
+Usage:
+    python bench_save_path.py --annotators 4 --clicks 200 --users 2 --role "Data Scientist"
+    python bench_save_path.py --annotators 4 --clicks 200 --users 2 --same-records
+"""
+import argparse
+import json
+import multiprocessing as mp
+import os
+import random
+import shutil
+import sys
+import tempfile
+import time
+from datetime import datetime
+
+import numpy as np
+import pandas as pd
+
+from field_registry import ROLE_FIELDS
+
+
+def make_synthetic_index(n_images, max_views=3, seed=0):
+    """
+    Build a synthetic DICOM index with the columns the save path relies on.
+
+    Parameters:
+    - n_images: Number of rows (images) in the index.
+    - max_views: Maximum number of views per study.
+    - seed: Random seed.
+
+    Returns:
+    A pandas DataFrame with study_icn, dicom_id and image_path columns.
+    """
+    rng = random.Random(seed)
+    rows = []
+    study = 0
+    while len(rows) < n_images:
+        for view in range(rng.randint(1, max_views)):
+            rows.append({
+                "study_icn": f"S{study:07d}",
+                "dicom_id": f"D{len(rows):08d}",
+                "image_path": os.path.join("bench", f"S{study:07d}", f"view{view}.dcm"),
+            })
+        study += 1
+    return pd.DataFrame(rows[:n_images])
+
+
+def _annotator(worker_id, username, role, dicom_df, start_pos, clicks, think_ms, t0, seed):
+    """
+    Simulate one annotator session. Runs in a child process.
+
+    Returns:
+    A dict with latency samples, retry counts, file size samples and the records written.
+    """
+    # Imported here so the child picks up ANNOTATION_DIR from the environment.
+    import annotation_utils
+    import navigation
+    from annotation_utils import _radio_changed
+    from dicom_index import set_shared_index
+    from state import DictSessionState, use_state
+
+    state = DictSessionState()
+    use_state(state)
+    rng = random.Random(seed)
+
+    fields = ROLE_FIELDS[role]
+    state.username = username
+    state.role = role
+    index = set_shared_index(dicom_df)
+    annotation_utils.load_session_copy("Clinician", username)
+    annotation_utils.load_session_copy("Data Scientist", username)
+    state.annotation_start_time = datetime.now()
+    annotation_utils.reset_annotation_fields()
+
+    if role == "Clinician":
+        state.current_patient_group = index.row(start_pos)["study_icn"]
+        state.view_idx = 0
+    else:
+        state.ds_idx = start_pos
+
+    def current_targets():
+        if role == "Clinician":
+            return index.study_paths(state.current_patient_group)
+        return [index.row(state.ds_idx)["image_path"]]
+
+    out_path = os.path.join(
+        annotation_utils.ANNOTATION_DIR,
+        f"ardsquest_annotations_{username}_{role}_{datetime.now().strftime('%Y%m%d')}.parquet",
+    )
+
+    result = {
+        "worker_id": worker_id,
+        "username": username,
+        "click_latency": [],
+        "nav_latency": [],
+        "retries": 0,
+        "failed_saves": 0,
+        "conflicts": 0,
+        "sizes": [],
+        "written": {},
+    }
+
+    while time.time() < t0:
+        time.sleep(0.001)
+
+    pending = list(fields.radios)
+    for _ in range(clicks):
+        if not pending:
+            # All fields of the current item are filled: move on like the UI's Next button.
+            # Navigation saves the current item first, which is an acknowledged write too.
+            targets = current_targets()
+            snapshot = fields.form_values(state)
+            state.annotation_saved = False
+            start = time.perf_counter()
+            action = "next_study" if role == "Clinician" else "next_image"
+            navigation.dispatch(action, navigation.nav_seq())
+            result["nav_latency"].append(time.perf_counter() - start)
+            if state.get("annotation_saved"):
+                for image_path in targets:
+                    result["written"][image_path] = (time.time(), snapshot)
+            state.annotation_saved = False
+            pending = list(fields.radios)
+
+        label, session_key, annotation_field, options, horizontal = pending.pop(rng.randrange(len(pending)))
+        state[session_key] = rng.choice(options)
+        state.last_save_attempts = 0
+
+        start = time.perf_counter()
+        _radio_changed(current_targets()[0], role, username)
+        result["click_latency"].append(time.perf_counter() - start)
+
+        attempts = state.get("last_save_attempts", 0)
+        result["retries"] += max(attempts - 1, 0)
+        saved = bool(state.get("annotation_saved"))
+        if state.get("annotation_conflict"):
+            # Rejected by the store: another writer changed the record first
+            result["conflicts"] += 1
+            state.annotation_conflict = None
+        elif not saved:
+            result["failed_saves"] += 1
+        state.annotation_saved = False
+
+        if saved:
+            snapshot = fields.form_values(state)
+            for image_path in current_targets():
+                result["written"][image_path] = (time.time(), snapshot)
+
+        try:
+            result["sizes"].append((time.time() - t0, os.path.getsize(out_path)))
+        except OSError:
+            pass
+
+        if think_ms:
+            time.sleep(think_ms / 1000.0)
+
+    return result
+
+
+def _run_annotator(kwargs):
+    return _annotator(**kwargs)
+
+
+def _same_value(stored, written):
+    """
+    Compare a stored value with the value written. An unanswered field is None in the app
+    and NaN in a categorical column of the file; both mean missing.
+    """
+    stored_missing = stored is None or (not isinstance(stored, str) and bool(pd.isna(stored)))
+    if stored_missing or written is None:
+        return stored_missing and written is None
+    return stored == written
+
+
+def count_lost_updates(results, annotation_dir, role):
+    """
+    Compare what each annotator last wrote per image against the final annotation files.
+
+    Parameters:
+    - results: List of per-annotator result dicts.
+    - annotation_dir: Directory holding the annotation parquet files.
+    - role: Annotator role.
+
+    Returns:
+    The number of (username, image_path) records whose final stored values differ from the
+    most recent write acknowledged by any annotator.
+    """
+    username_col = ROLE_FIELDS[role].username_col
+    timestamp_col = ROLE_FIELDS[role].timestamp_col
+
+    expected = {}
+    for res in results:
+        for image_path, (written_at, values) in res["written"].items():
+            key = (res["username"], image_path)
+            if key not in expected or written_at > expected[key][0]:
+                expected[key] = (written_at, values)
+
+    frames = []
+    for name in os.listdir(annotation_dir):
+        if name.startswith("ardsquest_annotations_") and name.endswith(".parquet"):
+            frames.append(pd.read_parquet(os.path.join(annotation_dir, name)))
+    final = pd.concat(frames, ignore_index=True) if frames else pd.DataFrame()
+
+    lost = 0
+    if final.empty:
+        return len(expected)
+    final = final.sort_values(timestamp_col).drop_duplicates([username_col, "image_path"], keep="last")
+    final = final.set_index([username_col, "image_path"])
+    for key, (_, values) in expected.items():
+        if key not in final.index:
+            lost += 1
+            continue
+        row = final.loc[key]
+        if any(not _same_value(row.get(col), val) for col, val in values.items()):
+            lost += 1
+    return lost
+
+
+def pct_line(name, samples):
+    """
+    Format latency percentiles (samples in seconds) as one report line.
+    """
+    if not samples:
+        return f"{name:<18} n=0"
+    ms = np.asarray(samples) * 1000.0
+    p50, p90, p99 = np.percentile(ms, [50, 90, 99])
+    return (f"{name:<18} n={len(ms):<6} p50={p50:8.2f} ms  p90={p90:8.2f} ms  "
+            f"p99={p99:8.2f} ms  max={ms.max():8.2f} ms")
+
+
+def summarize(results, lost, elapsed):
+    """
+    Print a human-readable report of the benchmark results.
+    """
+    clicks = [x for r in results for x in r["click_latency"]]
+    navs = [x for r in results for x in r["nav_latency"]]
+
+    print(f"\n--- Save path benchmark ({len(results)} annotators, {elapsed:.1f} s wall) ---")
+    print(pct_line("Radio click save", clicks))
+    print(pct_line("Navigation", navs))
+    print(f"Throughput         {len(clicks) / elapsed:.1f} clicks/s")
+    print(f"Retries            {sum(r['retries'] for r in results)}")
+    print(f"Failed saves       {sum(r['failed_saves'] for r in results)}")
+    print(f"Conflicts          {sum(r['conflicts'] for r in results)}")
+    print(f"Lost updates       {lost}")
+
+    print("\n--- Annotation file size over time ---")
+    by_user = {}
+    for r in results:
+        by_user.setdefault(r["username"], []).extend(r["sizes"])
+    for username, sizes in sorted(by_user.items()):
+        if not sizes:
+            continue
+        sizes.sort()
+        picks = np.linspace(0, len(sizes) - 1, num=min(10, len(sizes))).astype(int)
+        series = "  ".join(f"{sizes[i][0]:6.1f}s:{sizes[i][1] / 1024:8.1f}KB" for i in picks)
+        print(f"{username:<12} {series}")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--annotators", "-k", type=int, default=4, help="Concurrent simulated annotators (K).")
+    parser.add_argument("--clicks", "-m", type=int, default=100, help="Radio clicks per annotator (M).")
+    parser.add_argument("--users", type=int, default=None,
+                        help="Distinct usernames; fewer than --annotators simulates multiple tabs per user.")
+    parser.add_argument("--role", choices=["Data Scientist", "Clinician"], default="Data Scientist")
+    parser.add_argument("--think-ms", type=float, default=0.0, help="Pause between clicks in milliseconds.")
+    parser.add_argument("--out-dir", default=None, help="Annotation directory (default: fresh temp directory).")
+    parser.add_argument("--keep", action="store_true", help="Keep the annotation directory after the run.")
+    parser.add_argument("--json", dest="json_path", default=None, help="Write raw results to this JSON file.")
+    parser.add_argument("--same-records", action="store_true",
+                        help="Tabs of the same user edit the same images (exercises conflict detection).")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args(argv)
+
+    users = args.users or args.annotators
+    out_dir = args.out_dir or tempfile.mkdtemp(prefix="ardsquest_bench_")
+    os.makedirs(out_dir, exist_ok=True)
+
+    # Children import config, which reads these from the environment.
+    os.environ["ANNOTATION_DIR"] = out_dir
+    os.environ.setdefault("PARQUET_PATH", os.path.join(out_dir, "index.parquet"))
+
+    # Give each annotator a disjoint slice of the index so every record has a single writer,
+    # or, with --same-records, give the tabs of one user the same slice.
+    n_fields = len(ROLE_FIELDS[args.role].keys)
+    per_worker = args.clicks // n_fields + 2
+    dicom_df = make_synthetic_index(per_worker * args.annotators * 3, seed=args.seed)
+    slots = [w % users if args.same_records else w for w in range(args.annotators)]
+    if args.role == "Clinician":
+        studies = dicom_df["study_icn"].unique()
+        first_pos = dicom_df.reset_index().groupby("study_icn")["index"].min()
+        starts = [int(first_pos[studies[slot * per_worker]]) for slot in slots]
+    else:
+        starts = [slot * per_worker for slot in slots]
+
+    t0 = time.time() + 2.0
+    jobs = [
+        dict(
+            worker_id=w,
+            username=f"bench_user{w % users}",
+            role=args.role,
+            dicom_df=dicom_df,
+            start_pos=starts[w],
+            clicks=args.clicks,
+            think_ms=args.think_ms,
+            t0=t0,
+            seed=args.seed + w,
+        )
+        for w in range(args.annotators)
+    ]
+
+    with mp.Pool(processes=args.annotators) as pool:
+        results = pool.map(_run_annotator, jobs)
+    elapsed = time.time() - t0
+
+    lost = count_lost_updates(results, out_dir, args.role)
+    summarize(results, lost, elapsed)
+
+    if args.json_path:
+        with open(args.json_path, "w") as f:
+            json.dump({"args": vars(args), "lost_updates": lost, "results": results}, f, indent=2, default=str)
+
+    if not args.keep and args.out_dir is None:
+        shutil.rmtree(out_dir, ignore_errors=True)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,148 @@
+"""
+Benchmark for the DICOM -> display transform kernel.
+
+Compares the previous allocation-heavy implementation of digital_xray_from_dicom
+(rescale, np.clip and MONOCHROME1 inversion each producing a new full-size array) with
+the in-place kernel in dicom_utils, plus the 8-bit display quantization with reused
+buffers. Peak memory is measured with tracemalloc (NumPy reports its allocations to it)
+and excludes the DICOM decode itself, which both versions share.
+
+Usage:
+    python bench_transform.py                      # synthetic 3000x2500 MONOCHROME1/2 images
+    python bench_transform.py path/to/a.dcm ...    # real files
+"""
+import argparse
+import sys
+import time
+import tracemalloc
+
+import numpy as np
+import pydicom
+from pydicom.dataset import Dataset, FileMetaDataset
+from pydicom.uid import ExplicitVRLittleEndian
+
+from dicom_utils import digital_xray_from_dicom, window_to_uint8
+
+
+def legacy_digital_xray_from_dicom(dcmf):
+    """
+    The transform as it was before the in-place kernel, kept for comparison.
+    """
+    im = dcmf.pixel_array.astype(np.float32)
+    if hasattr(dcmf, 'RescaleSlope') and hasattr(dcmf, 'RescaleIntercept'):
+        im = im * dcmf.RescaleSlope + dcmf.RescaleIntercept
+    if hasattr(dcmf, 'SmallestImagePixelValue') and hasattr(dcmf, 'LargestImagePixelValue'):
+        min_val = dcmf.SmallestImagePixelValue
+        max_val = dcmf.LargestImagePixelValue
+    else:
+        min_val = np.min(im)
+        max_val = np.max(im)
+    if hasattr(dcmf, 'WindowCenter') and hasattr(dcmf, 'WindowWidth'):
+        wc = dcmf.WindowCenter
+        ww = dcmf.WindowWidth
+        if isinstance(wc, pydicom.multival.MultiValue):
+            wc = wc[0]
+        if isinstance(ww, pydicom.multival.MultiValue):
+            ww = ww[0]
+    else:
+        wc = (min_val + max_val) / 2.0
+        ww = (max_val - min_val)
+    lower = wc - (ww/2)
+    upper = wc + (ww/2)
+    im = np.clip(im, lower, upper)
+    if dcmf.PhotometricInterpretation == "MONOCHROME1":
+        im = np.max(im) - im
+    return im, ww, wc, lower, upper
+
+
+def legacy_display(im, lower, upper):
+    """
+    8-bit conversion as a naive implementation would do it (new temporaries every call).
+    """
+    return np.clip((im - lower) / (upper - lower) * 255, 0, 255).astype(np.uint8)
+
+
+def synthetic_dataset(rows=3000, cols=2500, photometric="MONOCHROME1", window=False, seed=0):
+    """
+    Build an in-memory 12-bit DICOM dataset with a random pixel matrix.
+    """
+    ds = Dataset()
+    ds.file_meta = FileMetaDataset()
+    ds.file_meta.TransferSyntaxUID = ExplicitVRLittleEndian
+    ds.Rows, ds.Columns = rows, cols
+    ds.BitsAllocated, ds.BitsStored, ds.HighBit = 16, 12, 11
+    ds.PixelRepresentation = 0
+    ds.SamplesPerPixel = 1
+    ds.PhotometricInterpretation = photometric
+    ds.RescaleSlope, ds.RescaleIntercept = 1, 0
+    if window:
+        ds.WindowCenter, ds.WindowWidth = 2048, 3000
+    rng = np.random.default_rng(seed)
+    ds.PixelData = rng.integers(0, 4096, size=(rows, cols), dtype=np.uint16).tobytes()
+    return ds
+
+
+def measure(fn, repeat):
+    """
+    Run `fn` `repeat` times and return (best seconds, peak traced bytes, last result).
+    """
+    result = fn()   # warm-up (also allocates the reusable buffers)
+    best = float("inf")
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = fn()
+        best = min(best, time.perf_counter() - start)
+    tracemalloc.start()
+    tracemalloc.reset_peak()
+    result = fn()
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return best, peak, result
+
+
+def bench_dataset(name, ds, repeat):
+    ds.pixel_array  # decode once; both versions reuse pydicom's cached array
+
+    t_old, m_old, (im_old, _, _, lower, upper) = measure(lambda: legacy_digital_xray_from_dicom(ds), repeat)
+    t_new, m_new, (im_new, *_) = measure(lambda: digital_xray_from_dicom(ds), repeat)
+    out = np.empty(ds.pixel_array.shape, dtype=np.float32)
+    t_out, m_out, _ = measure(lambda: digital_xray_from_dicom(ds, out=out), repeat)
+
+    t_d_old, m_d_old, u8_old = measure(lambda: legacy_display(im_new, lower, upper), repeat)
+    t_d_new, m_d_new, u8_new = measure(lambda: window_to_uint8(im_new, lower, upper), repeat)
+
+    max_diff = float(np.max(np.abs(im_old.astype(np.float64) - im_new)))
+    mb = 1024 * 1024
+    print(f"\n{name}  shape={ds.pixel_array.shape}  max |old-new| = {max_diff:.3g}  "
+          f"8-bit mismatches = {int(np.count_nonzero(u8_old.astype(int) - u8_new > 1))}")
+    print(f"  {'transform':<26}{'time (ms)':>12}{'peak (MB)':>12}")
+    print(f"  {'legacy':<26}{t_old * 1000:>12.1f}{m_old / mb:>12.1f}")
+    print(f"  {'in-place':<26}{t_new * 1000:>12.1f}{m_new / mb:>12.1f}")
+    print(f"  {'in-place, preallocated':<26}{t_out * 1000:>12.1f}{m_out / mb:>12.1f}")
+    print(f"  {'legacy 8-bit':<26}{t_d_old * 1000:>12.1f}{m_d_old / mb:>12.1f}")
+    print(f"  {'8-bit, reused buffers':<26}{t_d_new * 1000:>12.1f}{m_d_new / mb:>12.1f}")
+    print(f"  peak memory reduction: transform {1 - m_new / max(m_old, 1):.0%}, "
+          f"display {1 - m_d_new / max(m_d_old, 1):.0%}; "
+          f"speed-up {t_old / t_new:.2f}x / {t_d_old / t_d_new:.2f}x")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("paths", nargs="*", help="DICOM files (default: synthetic images)")
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args(argv)
+
+    if args.paths:
+        datasets = [(p, pydicom.dcmread(p)) for p in args.paths]
+    else:
+        datasets = [
+            ("synthetic MONOCHROME1, no window", synthetic_dataset(photometric="MONOCHROME1")),
+            ("synthetic MONOCHROME2, DICOM window", synthetic_dataset(photometric="MONOCHROME2", window=True)),
+        ]
+    for name, ds in datasets:
+        bench_dataset(name, ds, args.repeat)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -1,30 +1,71 @@
-import streamlit as st
-
-def update_wc_slider():
-    st.session_state.wc_val = st.session_state.wc_slider_val
-
-def update_ww_slider():
-    st.session_state.ww_val = st.session_state.ww_slider_val
-
-def reset_wc():
-    st.session_state.wc_val = st.session_state.native_center
-    st.session_state.wc_slider_val = st.session_state.native_center
-
-def reset_ww():
-    st.session_state.ww_val = st.session_state.native_width
-    st.session_state.ww_slider_val = st.session_state.native_width
-
-def update_window_range():
-    lower, upper = st.session_state.window_range_slider
-    st.session_state.wc_val = int((lower + upper) / 2)
-    st.session_state.ww_val = int(upper - lower)
-
-def reset_windowing():
-    center = st.session_state.native_center
-    width = st.session_state.native_width
-    lower = center - width // 2
-    upper = center + width // 2
-
-    st.session_state.window_range_slider = (lower, upper)
-    st.session_state.wc_val = center
-    st.session_state.ww_val = width
\ No newline at end of file
+from state import state
+from window_presets import preset_window
+
+def update_wc_slider():
+    state.wc_val = state.wc_slider_val
+
+def update_ww_slider():
+    state.ww_val = state.ww_slider_val
+
+def reset_wc():
+    state.wc_val = state.native_center
+    state.wc_slider_val = state.native_center
+
+def reset_ww():
+    state.ww_val = state.native_width
+    state.ww_slider_val = state.native_width
+
+def update_window_range():
+    lower, upper = state.window_range_slider
+    state.wc_val = int((lower + upper) / 2)
+    state.ww_val = int(upper - lower)
+
+def reset_windowing():
+    center = state.native_center
+    width = state.native_width
+    lower = center - width // 2
+    upper = center + width // 2
+
+    state.window_range_slider = (lower, upper)
+    state.wc_val = center
+    state.ww_val = width
+
+def apply_client_window(key="dicom_viewer", image_id=None):
+    """Persist a window/level change reported by a client-side viewer component."""
+    value = state.get(key)
+    expected_id = image_id if image_id is not None else state.get("last_loaded_image")
+    if not value or value.get("image_id") != expected_id:
+        return
+    lo = state.get("intensity_min", 0)
+    hi = state.get("intensity_max", 4095)
+    center = int(value["center"])
+    width = max(int(value["width"]), 1)
+    lower = max(lo, center - width // 2)
+    upper = min(hi, center + width // 2)
+
+    state.wc_val = center
+    state.ww_val = width
+    state.window_range_slider = (lower, max(lower, upper))
+    state.invert_display = bool(value.get("inverted", False))
+
+def apply_window_preset(preset):
+    """Set the window from a histogram-based preset for the current image."""
+    image_path = state.get("last_loaded_image")
+    if image_path is None:
+        return
+    frame = state.get("frame_idx", 0) if state.get("num_frames", 1) > 1 else 0
+    window = preset_window(image_path, preset, frame)
+    if window is None:
+        # Still decoding: the histogram arrives with the decoded image
+        return
+    center, width = window
+    lo = state.get("intensity_min", 0)
+    hi = state.get("intensity_max", 4095)
+    center = int(round(center))
+    width = max(int(round(width)), 1)
+    lower = max(lo, center - width // 2)
+    upper = min(hi, center + width // 2)
+
+    state.wc_val = center
+    state.ww_val = width
+    state.window_range_slider = (lower, max(lower, upper))
\ No newline at end of file
@@ -1,9 +1,56 @@
-from dotenv import load_dotenv
-import os
-
-load_dotenv()
-
-ANNOTATION_DIR = os.path.normpath(os.getenv("ANNOTATION_DIR"))
-PARQUET_PATH   = os.path.normpath(os.getenv("PARQUET_PATH"))
-DS_PATH        = os.path.join(ANNOTATION_DIR, "ds_annotations.parquet")
-CL_PATH        = os.path.join(ANNOTATION_DIR, "clinician_annotations.parquet")
\ No newline at end of file
+from dotenv import load_dotenv
+import os
+import tempfile
+
+load_dotenv()
+
+ANNOTATION_DIR = os.path.normpath(os.getenv("ANNOTATION_DIR"))
+PARQUET_PATH   = os.path.normpath(os.getenv("PARQUET_PATH"))
+DS_PATH        = os.path.join(ANNOTATION_DIR, "ds_annotations.parquet")
+CL_PATH        = os.path.join(ANNOTATION_DIR, "clinician_annotations.parquet")
+
+# --- Decoded image cache (shared by all sessions in the server process) ---
+DECODE_CACHE_BYTES = int(os.getenv("DECODE_CACHE_BYTES", 512 * 1024 * 1024))
+
+# --- On-disk cache of decoded pixel arrays (set DECODE_DISK_CACHE_DIR to "" to disable) ---
+DECODE_DISK_CACHE_DIR   = os.getenv("DECODE_DISK_CACHE_DIR", os.path.join(tempfile.gettempdir(), "ardsquest_decode_cache"))
+DECODE_DISK_CACHE_BYTES = int(os.getenv("DECODE_DISK_CACHE_BYTES", 10 * 1024 * 1024 * 1024))
+
+# --- Decode process pool (set DECODE_WORKERS to 0 to decode on the script thread) ---
+DECODE_WORKERS    = int(os.getenv("DECODE_WORKERS", os.getenv("STUDY_DECODE_WORKERS", min(4, os.cpu_count() or 1))))
+DECODE_QUEUE_SIZE = int(os.getenv("DECODE_QUEUE_SIZE", 32))     # queued + running decodes
+DECODE_TIMEOUT    = float(os.getenv("DECODE_TIMEOUT", 20))      # seconds per request
+SHARED_IMAGE_BYTES = int(os.getenv("SHARED_IMAGE_BYTES", 512 * 1024 * 1024))   # decoded images in shared memory
+
+# --- Image panel: apply window/level in the browser instead of on the server ---
+CLIENT_WINDOWING = os.getenv("CLIENT_WINDOWING", "1") == "1"
+
+# --- Progressive image panel: show the thumbnail at once, swap in the image when decoded ---
+PROGRESSIVE_IMAGE_PANEL = os.getenv("PROGRESSIVE_IMAGE_PANEL", "1") == "1"
+PROGRESSIVE_POLL_SECONDS = float(os.getenv("PROGRESSIVE_POLL_SECONDS", 0.5))
+
+# --- Show per-session rerun counters in the sidebar (instrumentation.py) ---
+RERUN_STATS = os.getenv("RERUN_STATS", "0") == "1"
+
+# --- Tiled deep-zoom viewer ---
+TILE_SERVER_HOST = os.getenv("TILE_SERVER_HOST", "127.0.0.1")   # loopback only; expose through TILE_SERVER_URL behind a proxy
+TILE_SERVER_PORT = int(os.getenv("TILE_SERVER_PORT", 8765))
+TILE_SERVER_URL  = os.getenv("TILE_SERVER_URL", "")     # public base URL if behind a proxy; default is same host as the app
+TILE_CACHE_BYTES = int(os.getenv("TILE_CACHE_BYTES", 256 * 1024 * 1024))
+TILE_ID_TTL      = float(os.getenv("TILE_ID_TTL", 60 * 60))   # seconds an image id stays valid after its last registration
+TILE_MAX_IMAGES  = int(os.getenv("TILE_MAX_IMAGES", 1024))    # registered image ids kept across all sessions
+TILE_ALLOWED_ORIGINS = {o.strip() for o in os.getenv("TILE_ALLOWED_ORIGINS", "").split(",") if o.strip()}   # besides the tile server's own host
+
+# --- Bounded decoding of very large / multi-frame images ---
+LARGE_DECODE_BYTES   = int(os.getenv("LARGE_DECODE_BYTES", 64 * 1024 * 1024))     # per frame
+LARGE_DECODE_SLOTS   = int(os.getenv("LARGE_DECODE_SLOTS", 2))
+LARGE_DECODE_TIMEOUT = float(os.getenv("LARGE_DECODE_TIMEOUT", 30))
+MAX_DECODE_BYTES     = int(os.getenv("MAX_DECODE_BYTES", 1024 * 1024 * 1024))
+
+# --- Per-session memory accounting and idle-session eviction (session_manager.py) ---
+SESSION_IDLE_TTL      = float(os.getenv("SESSION_IDLE_TTL", 15 * 60))   # seconds without a full run
+SESSION_SWEEP_SECONDS = float(os.getenv("SESSION_SWEEP_SECONDS", 60))   # at most one sweep per interval
+OPERATORS = {u.strip() for u in os.getenv("OPERATORS", "").split(",") if u.strip()}   # usernames shown the session table
+
+# --- Annotation store: seconds to wait for an annotation file's write lock ---
+ANNOTATION_LOCK_TIMEOUT = float(os.getenv("ANNOTATION_LOCK_TIMEOUT", 5))
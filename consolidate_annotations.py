@@ -0,0 +1,300 @@
+"""
+Consolidate every user's daily annotation files into one analysis-ready table.
+
+The output has one row per annotated image and annotator pair: the image's DICOM index
+columns, then the data scientist's latest record (Username_ds, Timestamp_ds and the DS
+fields), then the clinician's latest record (Username_cl, Timestamp_cl and the clinician
+fields). An image annotated by two clinicians and one data scientist gives two rows; an
+image annotated by one role only has nulls in the other role's columns.
+
+Memory stays bounded whatever the number of files:
+1. Every annotation file and the DICOM index are streamed batch by batch (pyarrow
+   datasets) and spilled to a scratch directory, partitioned by a hash of image_path.
+2. Each hash bucket is then loaded on its own: the latest record per (image_path, user,
+   role) is kept, the two roles are joined side by side and the index columns are added.
+   A bucket holds about --bucket-rows annotation records.
+3. Each bucket is written as out_dir/bucket=NNNN/part-0.parquet (hive partitioning), so
+   `pd.read_parquet(out_dir)` or `pyarrow.dataset.dataset(out_dir)` reads the whole table.
+
+The output directory is replaced only once every bucket has been written.
+
+Usage:
+    python consolidate_annotations.py out/annotations_consolidated
+    python consolidate_annotations.py out/all --all-images --bucket-rows 100000
+"""
+import argparse
+import math
+import os
+import shutil
+import tempfile
+import time
+
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pyarrow.dataset as ds
+import pyarrow.parquet as pq
+
+from annotation_schema import arrow_types, write_annotations
+from annotation_store import annotation_files
+from config import ANNOTATION_DIR, PARQUET_PATH
+from field_registry import ROLE_FIELDS
+
+ROLES = ("Data Scientist", "Clinician")
+BUCKET_COL = "bucket"
+_SEQ_COL = "_seq"           # global read order, breaks timestamp ties in favour of the newer file
+_ID_COLS = ("study_icn", "dicom_id")
+
+
+def _role_schema(role):
+    """
+    Columns read from a role's annotation files, with the typed schema (see
+    annotation_schema). Files written before a column existed read it as nulls, and files
+    written before the typed schema are cast to it.
+    """
+    fields = ROLE_FIELDS[role]
+    types = arrow_types(role)
+    columns = ["image_path", fields.username_col, fields.timestamp_col, fields.elapsed_col,
+               *_ID_COLS, *fields.columns]
+    return pa.schema([(c, types.get(c, pa.string())) for c in columns])
+
+
+def _bucket_of(values, buckets):
+    """
+    Hash bucket of each image path (stable across runs and processes).
+    """
+    values = np.asarray(values, dtype=object)
+    return (pd.util.hash_array(values, categorize=False) % np.uint64(buckets)).astype(np.int32)
+
+
+def _with_bucket(batch, buckets, first_seq=None):
+    """
+    Append the bucket column (and the read-order column) to a record batch.
+    """
+    arrays = list(batch.columns)
+    names = list(batch.schema.names)
+    paths = batch.column(names.index("image_path")).to_numpy(zero_copy_only=False)
+    if first_seq is not None:
+        arrays.append(pa.array(np.arange(first_seq, first_seq + len(batch), dtype=np.int64)))
+        names.append(_SEQ_COL)
+    arrays.append(pa.array(_bucket_of(paths, buckets)))
+    names.append(BUCKET_COL)
+    return pa.RecordBatch.from_arrays(arrays, names=names)
+
+
+def _spill(batches, schema, spill_dir):
+    """
+    Write a stream of record batches to `spill_dir`, one hive partition per bucket.
+    """
+    ds.write_dataset(
+        batches,
+        spill_dir,
+        schema=schema,
+        format="parquet",
+        partitioning=ds.partitioning(pa.schema([(BUCKET_COL, pa.int32())]), flavor="hive"),
+        existing_data_behavior="overwrite_or_ignore",
+        max_open_files=256,
+        max_rows_per_group=64 * 1024,
+    )
+
+
+def _spill_annotations(files, role, buckets, spill_dir, batch_size):
+    """
+    Stream a role's annotation files into bucketed scratch files.
+
+    Returns:
+    The number of records read.
+    """
+    schema = _role_schema(role)
+    dataset = ds.dataset(files, schema=schema, format="parquet")
+    spill_schema = schema.append(pa.field(_SEQ_COL, pa.int64())).append(pa.field(BUCKET_COL, pa.int32()))
+    count = [0]
+
+    def batches():
+        # Fragments come in `files` order (oldest first per user)
+        for fragment in dataset.get_fragments():
+            for batch in fragment.to_batches(schema=schema, columns=schema.names, batch_size=batch_size):
+                if len(batch):
+                    yield _with_bucket(batch, buckets, count[0])
+                    count[0] += len(batch)
+
+    _spill(batches(), spill_schema, spill_dir)
+    return count[0]
+
+
+def _spill_index(parquet_path, buckets, spill_dir, batch_size):
+    """
+    Stream the DICOM index into bucketed scratch files.
+    """
+    dataset = ds.dataset(parquet_path, format="parquet")
+    spill_schema = dataset.schema.remove_metadata().append(pa.field(BUCKET_COL, pa.int32()))
+    _spill(
+        (_with_bucket(batch, buckets) for batch in dataset.to_batches(batch_size=batch_size) if len(batch)),
+        spill_schema,
+        spill_dir,
+    )
+
+
+def _read_bucket(spill_dir, bucket):
+    """
+    Read one bucket of a spill as a DataFrame (None if the bucket is empty).
+    """
+    path = os.path.join(spill_dir, f"{BUCKET_COL}={bucket}")
+    if not os.path.isdir(path):
+        return None
+    return pq.read_table(path).to_pandas()
+
+
+def latest_records(df, role):
+    """
+    Keep the latest record per (image_path, user) of one role's annotations.
+
+    Records are ordered by timestamp; ties go to the record read last (newer file).
+
+    Returns:
+    The deduplicated records without the helper columns.
+    """
+    username_col, timestamp_col = ROLE_FIELDS[role].username_col, ROLE_FIELDS[role].timestamp_col
+    df = df.sort_values([timestamp_col, _SEQ_COL], kind="stable", na_position="first")
+    df = df.drop_duplicates(["image_path", username_col], keep="last")
+    return df.drop(columns=[_SEQ_COL, BUCKET_COL], errors="ignore")
+
+
+def consolidate_bucket(annotations, index, all_images=False):
+    """
+    Build the consolidated rows of one bucket.
+
+    Parameters:
+    - annotations: Dict role -> that role's records in the bucket (or None).
+    - index: The bucket's DICOM index rows (or None).
+    - all_images: Also emit index images nobody has annotated.
+
+    Returns:
+    A DataFrame with the index columns, then the DS columns, then the clinician columns.
+    """
+    ids = []
+    wide = None
+    for role in ROLES:
+        df = annotations.get(role)
+        if df is None or df.empty:
+            continue
+        df = latest_records(df, role)
+        ids.append(df[["image_path", *_ID_COLS]])
+        df = df.drop(columns=list(_ID_COLS))
+        wide = df if wide is None else wide.merge(df, on="image_path", how="outer")
+    if wide is None:
+        wide = pd.DataFrame({"image_path": pd.Series([], dtype=object)})
+    for role in ROLES:
+        for column in _role_schema(role).names:
+            if column not in wide.columns and column not in _ID_COLS:
+                wide[column] = None
+
+    if index is not None:
+        index = index.drop(columns=[BUCKET_COL], errors="ignore").drop_duplicates("image_path")
+    if index is None or index.empty:
+        index = pd.DataFrame({"image_path": pd.Series([], dtype=object)})
+    out = index.merge(wide, on="image_path", how="outer" if all_images else "right")
+
+    # Images that have left the index keep the identifiers recorded with their annotation
+    if ids:
+        recorded = pd.concat(ids, ignore_index=True).drop_duplicates("image_path", keep="last")
+        recorded = out[["image_path"]].merge(recorded, on="image_path", how="left")
+        for column in _ID_COLS:
+            if column in out.columns:
+                out[column] = out[column].where(out[column].notna(), recorded[column].to_numpy())
+            else:
+                out[column] = recorded[column].to_numpy()
+    return out.sort_values("image_path", kind="stable").reset_index(drop=True)
+
+
+def consolidate(out_dir, annotation_dir=ANNOTATION_DIR, parquet_path=PARQUET_PATH, buckets=None,
+                bucket_rows=250_000, batch_size=64 * 1024, all_images=False, scratch_dir=None):
+    """
+    Consolidate all annotation files into a hash-partitioned parquet dataset.
+
+    Parameters:
+    - out_dir: Output directory (replaced if it exists).
+    - annotation_dir: Directory holding the daily annotation files.
+    - parquet_path: DICOM index.
+    - buckets: Number of hash buckets (default: enough for `bucket_rows` records each).
+    - bucket_rows: Target number of annotation records per bucket.
+    - batch_size: Rows per streamed batch.
+    - all_images: Also emit index images nobody has annotated.
+    - scratch_dir: Where to spill (default: next to out_dir).
+
+    Returns:
+    A dict with files, records, buckets, rows and seconds.
+    """
+    start = time.perf_counter()
+    files = {role: annotation_files("*", role, annotation_dir) for role in ROLES}
+    records_on_disk = sum(pq.ParquetFile(p).metadata.num_rows for role in ROLES for p in files[role])
+    if buckets is None:
+        buckets = max(1, math.ceil(records_on_disk / max(bucket_rows, 1)))
+
+    out_dir = os.path.abspath(out_dir)
+    parent = os.path.dirname(out_dir)
+    os.makedirs(parent, exist_ok=True)
+    work_dir = tempfile.mkdtemp(prefix=".consolidate_", dir=scratch_dir or parent)
+    try:
+        spills = {}
+        records = 0
+        for role in ROLES:
+            if files[role]:
+                spills[role] = os.path.join(work_dir, f"spill_{role.replace(' ', '_')}")
+                records += _spill_annotations(files[role], role, buckets, spills[role], batch_size)
+        index_spill = os.path.join(work_dir, "spill_index")
+        _spill_index(parquet_path, buckets, index_spill, batch_size)
+
+        staged = os.path.join(work_dir, "out")
+        rows = 0
+        for bucket in range(buckets):
+            annotations = {role: _read_bucket(path, bucket) for role, path in spills.items()}
+            if not all_images and all(df is None for df in annotations.values()):
+                continue
+            table = consolidate_bucket(annotations, _read_bucket(index_spill, bucket), all_images)
+            if table.empty:
+                continue
+            os.makedirs(os.path.join(staged, f"{BUCKET_COL}={bucket:04d}"))
+            write_annotations(table, os.path.join(staged, f"{BUCKET_COL}={bucket:04d}", "part-0.parquet"))
+            rows += len(table)
+        os.makedirs(staged, exist_ok=True)
+
+        if os.path.exists(out_dir):
+            shutil.rmtree(out_dir)
+        os.replace(staged, out_dir)
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+    return {
+        "files": sum(len(f) for f in files.values()),
+        "records": records,
+        "buckets": buckets,
+        "rows": rows,
+        "seconds": time.perf_counter() - start,
+    }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("out_dir", help="Output directory (replaced if it exists).")
+    parser.add_argument("--annotation-dir", default=ANNOTATION_DIR)
+    parser.add_argument("--index", default=PARQUET_PATH, help="DICOM index parquet file.")
+    parser.add_argument("--buckets", type=int, default=None, help="Hash buckets (default: from --bucket-rows).")
+    parser.add_argument("--bucket-rows", type=int, default=250_000, help="Target annotation records per bucket.")
+    parser.add_argument("--batch-size", type=int, default=64 * 1024, help="Rows per streamed batch.")
+    parser.add_argument("--all-images", action="store_true", help="Include index images nobody has annotated.")
+    parser.add_argument("--scratch-dir", default=None, help="Directory for the spill files (default: next to out_dir).")
+    args = parser.parse_args(argv)
+
+    summary = consolidate(
+        args.out_dir, args.annotation_dir, args.index, buckets=args.buckets, bucket_rows=args.bucket_rows,
+        batch_size=args.batch_size, all_images=args.all_images, scratch_dir=args.scratch_dir,
+    )
+    print(
+        f"Consolidated {summary['records']} records from {summary['files']} files into "
+        f"{summary['rows']} rows ({summary['buckets']} buckets) in {summary['seconds']:.1f} s: {args.out_dir}"
+    )
+
+
+if __name__ == "__main__":
+    main()
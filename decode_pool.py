@@ -0,0 +1,297 @@
+import math
+import threading
+from concurrent.futures import CancelledError, ProcessPoolExecutor
+from concurrent.futures import TimeoutError as FutureTimeoutError
+from multiprocessing import shared_memory
+
+import numpy as np
+
+from config import DECODE_WORKERS, DECODE_QUEUE_SIZE, DECODE_TIMEOUT
+from image_cache import get_decode_cache
+from pixel_access import large_decode_slots, num_frames, read_header, use_large_decode_slots
+from shm_registry import get_image_registry, image_key
+from window_presets import histogram_key
+
+
+class DecodeQueueFull(RuntimeError):
+    """Raised when the bounded decode queue has no free slot."""
+
+
+class DecodeTimeout(TimeoutError):
+    """Raised when a decode did not finish within the per-request timeout."""
+
+
+def current_session_id():
+    """
+    Return the Streamlit session id of the calling script thread, or None outside Streamlit.
+    """
+    try:
+        from streamlit.runtime.scriptrunner import get_script_run_ctx
+    except ImportError:
+        return None
+    ctx = get_script_run_ctx(suppress_warning=True)
+    return ctx.session_id if ctx is not None else None
+
+
+def _attach(name):
+    """
+    Attach to an existing shared memory block without taking over its lifetime.
+
+    Pool workers share the app process's resource tracker, so attaching (which registers
+    the block again) does not make a worker unlink it on exit; the app process unlinks it.
+    """
+    try:
+        return shared_memory.SharedMemory(name=name, track=False)    # Python 3.13+
+    except TypeError:
+        return shared_memory.SharedMemory(name=name)
+
+
+def _decode_into_shm(filepath, downsample_factor, frame, shm_name, shape):
+    """
+    Worker entry point: decode one frame and write the downsampled image into shared memory.
+
+    Returns:
+    The window parameters and the full-resolution histogram (ww, wc, lower, upper, hist);
+    the pixels travel through shared memory.
+    """
+    from dicom_utils import decode_xray
+
+    arr, ww, wc, lower, upper, hist = decode_xray(filepath, frame, histogram=True)
+    shm = _attach(shm_name)
+    try:
+        out = np.ndarray(shape, dtype=np.float32, buffer=shm.buf)
+        out[...] = arr[::downsample_factor, ::downsample_factor]
+        del out
+    finally:
+        shm.close()
+    return float(ww), float(wc), float(lower), float(upper), hist
+
+
+class DecodeRequest:
+    """
+    Handle for one decode submitted to the pool.
+
+    The output block is allocated in the shared image registry before submitting, so the
+    worker never pickles pixel data back. Several sessions may wait on the same request.
+    A request is registered in the pool before its block and future exist (`submitted` is
+    set once they do, or once submitting failed), so identical requests join it instead of
+    decoding the image a second time.
+    """
+    def __init__(self, key, shm_name=None, future=None):
+        self.key = key
+        self.shm_name = shm_name
+        self.future = future
+        self.submitted = threading.Event()
+        self.owners = set()
+        self.cancelled = False
+        self._value = None
+        self._settled = False
+        self._lock = threading.Lock()
+
+    @property
+    def registry_key(self):
+        return image_key(*self.key)
+
+    def done(self):
+        return self.future.done()
+
+    def result(self, timeout=DECODE_TIMEOUT):
+        """
+        Wait for the decode and return (image, ww, wc, lower, upper).
+
+        The image is a read-only view over the shared memory block (no copy).
+
+        Raises:
+        - DecodeTimeout: if the decode is still running after `timeout` seconds (it keeps
+          running, so a later call can pick up the result).
+        - CancelledError: if the request was cancelled.
+        """
+        try:
+            self.future.result(timeout=timeout)
+        except FutureTimeoutError:
+            raise DecodeTimeout(f"Decoding {self.key[0]} took longer than {timeout} s")
+        value = self._settle()
+        if value is None:
+            raise CancelledError()
+        return value
+
+    def _settle(self):
+        """
+        Publish the finished block in the registry (or discard it), exactly once.
+        """
+        with self._lock:
+            if not self._settled:
+                self._settled = True
+                registry = get_image_registry()
+                future = self.future
+                if self.cancelled or future.cancelled() or future.exception() is not None:
+                    registry.discard(self.registry_key, self.shm_name)
+                else:
+                    *meta, hist = future.result()
+                    filepath, _, frame = self.key
+                    get_decode_cache().put(histogram_key(filepath, frame), hist)
+                    self._value = registry.publish(self.registry_key, self.shm_name, meta)
+            return self._value
+
+
+class DecodePool:
+    """
+    Dedicated process pool for DICOM decoding, isolated from the Streamlit script threads.
+
+    - At most `max_pending` decodes are queued or running; further submissions wait for a
+      slot (or fail with DecodeQueueFull).
+    - Identical requests (same file, frame and downsampling) from different sessions share
+      one decode.
+    - Each request records the sessions waiting for it; `cancel_stale` drops a session's
+      interest in images it has moved away from, cancelling decodes nobody needs anymore.
+    """
+    def __init__(self, workers=DECODE_WORKERS, max_pending=DECODE_QUEUE_SIZE):
+        self.workers = max(1, int(workers))
+        self._slots = threading.BoundedSemaphore(max(1, int(max_pending)))
+        self._executor = None
+        self._requests = {}
+        self._lock = threading.Lock()
+
+    def _get_executor(self):
+        if self._executor is None:
+            # Workers share the app's large-decode slots, so LARGE_DECODE_SLOTS bounds
+            # large decodes across all of them rather than per worker.
+            self._executor = ProcessPoolExecutor(
+                max_workers=self.workers,
+                initializer=use_large_decode_slots,
+                initargs=(large_decode_slots(),),
+            )
+        return self._executor
+
+    def pending(self, filepath, downsample_factor, frame=0):
+        """
+        Return the in-flight request for an image, or None. Cancelled requests (which may
+        still be running) and requests still being submitted count as absent.
+        """
+        with self._lock:
+            request = self._requests.get((filepath, downsample_factor, frame))
+        if request is None or request.cancelled or request.future is None:
+            return None
+        return request
+
+    def submit(self, filepath, downsample_factor, frame=0, owner=None, block=True, timeout=DECODE_TIMEOUT):
+        """
+        Queue a decode (or join an identical one already in flight).
+
+        Parameters:
+        - filepath: Path to the DICOM file.
+        - downsample_factor: Downsampling applied in the worker.
+        - frame: Frame index.
+        - owner: Session id interested in the result (default is the calling session).
+        - block: Wait for a queue slot if the queue is full.
+        - timeout: Maximum seconds to wait for a slot when blocking.
+
+        Returns:
+        A DecodeRequest.
+        """
+        key = (filepath, downsample_factor, frame)
+        owner = current_session_id() if owner is None else owner
+        while True:
+            # Reserve the key before any slow work, so concurrent callers join this request
+            # rather than creating a second block for the same image.
+            with self._lock:
+                request = self._requests.get(key)
+                if request is None or request.cancelled:
+                    request = self._requests[key] = DecodeRequest(key)
+                    request.owners.add(owner)
+                    break
+                request.owners.add(owner)
+            request.submitted.wait()
+            if request.future is not None:
+                return request
+            # Submitting it failed (e.g. a full queue for a non-blocking caller); try again.
+
+        try:
+            # The header is cheap to read and gives the output shape for the shared block.
+            ds = read_header(filepath)
+            if frame >= num_frames(ds):
+                raise IndexError(f"Frame {frame} out of range for {filepath}")
+            shape = (math.ceil(int(ds.Rows) / downsample_factor), math.ceil(int(ds.Columns) / downsample_factor))
+
+            if not self._slots.acquire(blocking=block, timeout=timeout if block else None):
+                raise DecodeQueueFull("The decode queue is full; please retry.")
+            registry = get_image_registry()
+            shm_name = registry.create(image_key(*key), shape, np.float32)
+            try:
+                future = self._get_executor().submit(
+                    _decode_into_shm, filepath, downsample_factor, frame, shm_name, shape
+                )
+            except Exception:
+                registry.discard(image_key(*key), shm_name)
+                self._slots.release()
+                raise
+        except BaseException:
+            with self._lock:
+                if self._requests.get(key) is request:
+                    del self._requests[key]
+            request.submitted.set()
+            raise
+
+        request.shm_name = shm_name
+        request.future = future
+        request.submitted.set()
+        if request.cancelled:
+            # cancel_stale ran while the request was being submitted
+            future.cancel()
+        future.add_done_callback(lambda f, request=request: self._finished(request))
+        return request
+
+    def _finished(self, request):
+        self._slots.release()
+        with self._lock:
+            if self._requests.get(request.key) is request:
+                del self._requests[request.key]
+        request._settle()
+
+    def cancel_stale(self, owner, keep=()):
+        """
+        Drop a session's interest in every image it is no longer looking at.
+
+        Requests with no interested session left are cancelled: queued ones never start, and
+        running ones have their result discarded.
+
+        Parameters:
+        - owner: Session id.
+        - keep: Iterable of file paths the session still needs.
+        """
+        keep = set(keep)
+        with self._lock:
+            requests = list(self._requests.values())
+        for request in requests:
+            if owner not in request.owners or request.key[0] in keep:
+                continue
+            request.owners.discard(owner)
+            if not request.owners:
+                request.cancelled = True
+                if request.future is not None:
+                    request.future.cancel()
+
+    def stats(self):
+        """
+        Return the number of in-flight requests and configured workers.
+        """
+        with self._lock:
+            return {"in_flight": len(self._requests), "workers": self.workers}
+
+
+_pool = None
+_pool_lock = threading.Lock()
+
+
+def get_decode_pool():
+    """
+    Return the process-wide DecodePool, or None if DECODE_WORKERS is 0 (decode inline).
+    """
+    global _pool
+    if DECODE_WORKERS <= 0:
+        return None
+    if _pool is None:
+        with _pool_lock:
+            if _pool is None:
+                _pool = DecodePool(DECODE_WORKERS, DECODE_QUEUE_SIZE)
+    return _pool
@@ -0,0 +1,255 @@
+import os
+import threading
+
+import numpy as np
+import pandas as pd
+
+from config import PARQUET_PATH
+
+
+def _freeze(df):
+    """
+    Rebuild a DataFrame over read-only column arrays, so no session can modify the shared copy.
+    """
+    columns = {}
+    for name in df.columns:
+        arr = np.array(df[name].to_numpy(), copy=True)
+        arr.setflags(write=False)
+        columns[name] = arr
+    return pd.DataFrame(columns, copy=False)
+
+
+# Columns the jump-to search looks up, in the order results are listed.
+SEARCH_COLUMNS = ("dicom_id", "study_icn", "subject_icn")
+
+# Sorts after every character, so [prefix, prefix + _MAX_CHAR) spans all keys with the prefix.
+_MAX_CHAR = "\U0010ffff"
+
+
+class _KeyIndex:
+    """
+    Lookup structures for one key column.
+
+    - A sorted key array (with the row of each key) for prefix search with `searchsorted`.
+    - A hash index from each key to its range in the sorted arrays, for exact lookup.
+
+    Rows sharing a key are contiguous in the sorted arrays, in index order.
+    """
+    def __init__(self, values):
+        values = np.asarray(values, dtype=object)
+        present = np.flatnonzero(pd.notna(values))
+        keys = np.array([str(v) for v in values[present]], dtype=object)
+        order = np.argsort(keys, kind="stable")
+        self.sorted_keys = keys[order]
+        self.sorted_rows = present[order]
+        self.sorted_keys.setflags(write=False)
+        self.sorted_rows.setflags(write=False)
+        unique, starts = np.unique(self.sorted_keys, return_index=True)
+        stops = np.append(starts[1:], len(self.sorted_keys))
+        self._ranges = dict(zip(unique.tolist(), zip(starts.tolist(), stops.tolist())))
+
+    def exact(self, key):
+        """
+        Return the rows with this key (ascending), or an empty array. O(1).
+        """
+        span = self._ranges.get(key)
+        return self.sorted_rows[span[0]:span[1]] if span else self.sorted_rows[:0]
+
+    def prefix(self, prefix, limit):
+        """
+        Return up to `limit` distinct keys starting with `prefix`, in sorted order, each with
+        its first row and number of rows. O(log n + limit).
+        """
+        lo = int(np.searchsorted(self.sorted_keys, prefix, side="left"))
+        hi = int(np.searchsorted(self.sorted_keys, prefix + _MAX_CHAR, side="left"))
+        matches = []
+        pos = lo
+        while pos < hi and len(matches) < limit:
+            key = self.sorted_keys[pos]
+            start, stop = self._ranges[key]
+            matches.append((key, int(self.sorted_rows[start]), stop - start))
+            pos = stop
+        return matches
+
+
+class DicomIndex:
+    """
+    Immutable, process-wide view of the DICOM index.
+
+    The frame is loaded once per server process and shared by every session; sessions keep
+    only a cursor into it (`current_patient_group` / `view_idx` for clinicians, `ds_idx`
+    for data scientists). Column arrays are read-only, and the study grouping the
+    navigation needs on every rerun is computed once at load time.
+
+    - `frame`: the index as a read-only DataFrame with a RangeIndex. Never modify it.
+    - `studies`: study_icn values in first-appearance order (the clinician's study order).
+    - `study_codes`: for each row, the position of its study in `studies`.
+    """
+    def __init__(self, df, source=None, mtime_ns=None):
+        df = df.reset_index(drop=True)
+        # pandas cannot measure object columns over read-only buffers, so measure first
+        self._nbytes = int(df.memory_usage(index=True, deep=True).sum())
+        self.frame = _freeze(df)
+        self.source = source
+        self.mtime_ns = mtime_ns
+
+        codes, studies = pd.factorize(self.frame["study_icn"], sort=False)
+        order = np.argsort(codes, kind="stable")
+        bounds = np.searchsorted(codes[order], np.arange(len(studies) + 1))
+        self.studies = np.asarray(studies, dtype=object)
+        self.studies.setflags(write=False)
+        self.study_codes = codes        # per row: position of its study in `studies`
+        self.study_codes.setflags(write=False)
+        self._study_pos = {study: i for i, study in enumerate(self.studies)}
+        self._study_rows = []
+        for i in range(len(studies)):
+            rows = order[bounds[i]:bounds[i + 1]]
+            rows.setflags(write=False)
+            self._study_rows.append(rows)
+        self._key_indexes = {}
+        self._key_lock = threading.Lock()
+
+    def __len__(self):
+        return len(self.frame)
+
+    @property
+    def num_studies(self):
+        return len(self.studies)
+
+    def row(self, pos):
+        """
+        Return the row at a position as a Series.
+        """
+        return self.frame.iloc[pos]
+
+    def has_study(self, study):
+        return study in self._study_pos
+
+    def study_position(self, study):
+        """
+        Return the position of a study in `studies` (ValueError if unknown).
+        """
+        try:
+            return self._study_pos[study]
+        except KeyError:
+            raise ValueError(f"Unknown study {study!r}")
+
+    def study_rows(self, study):
+        """
+        Return the row positions of a study's views, in index order (read-only array).
+        """
+        return self._study_rows[self.study_position(study)]
+
+    def study_frame(self, study):
+        """
+        Return a study's views as a DataFrame numbered from 0 (view index order).
+        """
+        return self.frame.iloc[self.study_rows(study)].reset_index(drop=True)
+
+    def study_paths(self, study):
+        """
+        Return the image paths of a study's views.
+        """
+        return list(self.frame["image_path"].to_numpy()[self.study_rows(study)])
+
+    def key_index(self, column):
+        """
+        Return the lookup structures of a key column (built on first use).
+        """
+        index = self._key_indexes.get(column)
+        if index is None:
+            with self._key_lock:
+                index = self._key_indexes.get(column)
+                if index is None:
+                    index = self._key_indexes[column] = _KeyIndex(self.frame[column].to_numpy())
+        return index
+
+    def search(self, text, limit=10):
+        """
+        Find rows by dicom_id, study_icn or subject_icn.
+
+        Exact matches come first (hash lookup), then keys starting with the text (prefix
+        search over the sorted keys), in SEARCH_COLUMNS order.
+
+        Parameters:
+        - text: Full key or prefix.
+        - limit: Maximum number of results.
+
+        Returns:
+        A list of (column, key, row position of the key's first row, number of rows).
+        """
+        text = str(text).strip()
+        if not text:
+            return []
+        columns = [c for c in SEARCH_COLUMNS if c in self.frame.columns]
+        results = []
+        for column in columns:
+            rows = self.key_index(column).exact(text)
+            if len(rows):
+                results.append((column, text, int(rows[0]), len(rows)))
+        for column in columns:
+            if len(results) >= limit:
+                break
+            for key, row, count in self.key_index(column).prefix(text, limit + 1):
+                if key != text and len(results) < limit:
+                    results.append((column, key, row, count))
+        return results
+
+    def nbytes(self):
+        """
+        Approximate memory held by the index, in bytes.
+        """
+        return self._nbytes
+
+
+_index = None
+_shared = False
+_index_lock = threading.Lock()
+
+
+def get_dicom_index(parquet_path=PARQUET_PATH):
+    """
+    Return the process-wide DicomIndex, loading it on first use.
+
+    The parquet file's modification time is checked on every call (one stat), and the index
+    is reloaded when the file changes. An index installed with `set_shared_index` is
+    returned as is.
+
+    Parameters:
+    - parquet_path: Path to the parquet file containing the DICOM index.
+
+    Returns:
+    A DicomIndex.
+    """
+    global _index
+    index = _index
+    if _shared:
+        return index
+    mtime_ns = os.stat(parquet_path).st_mtime_ns
+    if index is not None and index.source == parquet_path and index.mtime_ns == mtime_ns:
+        return index
+    with _index_lock:
+        index = _index
+        if index is None or index.source != parquet_path or index.mtime_ns != mtime_ns:
+            index = DicomIndex(pd.read_parquet(parquet_path), source=parquet_path, mtime_ns=mtime_ns)
+            _index = index
+    return index
+
+
+def set_shared_index(index):
+    """
+    Install an index for this process instead of reading PARQUET_PATH (benchmarks, workers,
+    scripts). Pass a DataFrame or a DicomIndex; pass None to go back to the parquet file.
+
+    Returns:
+    The installed DicomIndex (None when cleared).
+    """
+    global _index, _shared
+    with _index_lock:
+        if index is None:
+            _index, _shared = None, False
+            return None
+        if not isinstance(index, DicomIndex):
+            index = DicomIndex(index)
+        _index, _shared = index, True
+        return index
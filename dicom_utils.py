@@ -1,152 +1,365 @@
-import streamlit as st
-import pydicom
-import matplotlib.pyplot as plt
-import plotly.express as px
-import numpy as np
-from pydicom.multival import MultiValue
-
-def digital_xray_from_dicom(dcmf):
-    """
-    Convert a DICOM file to a digital X-ray image.
-
-    Parameters:
-    - dcmf: DICOM file object (pydicom.dataset.FileDataset).
-
-    Returns:
-    A processed numpy array representing the X-ray image.
-    """
-    im = dcmf.pixel_array.astype(np.float32)
-    
-    # Rescale using slope & intercept
-    if hasattr(dcmf, 'RescaleSlope') and hasattr(dcmf, 'RescaleIntercept'):
-        im = im * dcmf.RescaleSlope + dcmf.RescaleIntercept
-        
-    # Use the provided smallest and largest pixel values if available
-    if hasattr(dcmf, 'SmallestImagePixelValue') and hasattr(dcmf, 'LargestImagePixelValue'):
-        min_val = dcmf.SmallestImagePixelValue
-        max_val = dcmf.LargestImagePixelValue
-    else:
-        # Otherwise, compute from the pixel data itself
-        min_val = np.min(im)
-        max_val = np.max(im)
-    
-    # Apply windowing
-    if hasattr(dcmf, 'WindowCenter') and hasattr(dcmf, 'WindowWidth'):
-        wc = dcmf.WindowCenter
-        ww = dcmf.WindowWidth
-    
-        # Handle multiple values in Window Center/Window Width
-        if isinstance(wc, pydicom.multival.MultiValue):
-            wc = wc[0]
-        if isinstance(ww, pydicom.multival.MultiValue):
-            ww = ww[0]
-    else:
-        # Use dynamic range from smallest and largest pixel values
-        wc = (min_val + max_val) / 2.0
-        ww = (max_val - min_val)  
-         
-    lower = wc - (ww/2)
-    upper = wc + (ww/2)
-        
-    im = np.clip(im, lower, upper)    
-
-    if dcmf.PhotometricInterpretation == "MONOCHROME1":
-        im = np.max(im) - im  # Invert image    
-               
-    return im, ww, wc, lower, upper
-
-def get_first_element(value):
-    """
-    Extract the first element from a MultiValue object or convert a single value to float.
-
-    Parameters:
-    - value: A MultiValue or single value to convert.
-
-    Returns:
-    The first element as a float, or None if conversion fails.
-    """
-    if isinstance(value, MultiValue):
-        return float(value[0])
-    try:
-        return float(value)
-    except (TypeError, ValueError):
-        return None
-    
-def safe_float(val):
-    """
-    Safely convert a value to float, handling MultiValue and common containers.
-
-    Parameters:
-    - val: The value to convert, which may be a MultiValue, list, tuple, or single value.
-
-    Returns:
-    The converted float value, or None if conversion fails.
-    """
-    try:
-        if isinstance(val, MultiValue):
-            return float(val[0])
-        elif isinstance(val, (list, tuple)):
-            return float(val[0])
-        else:
-            return float(val)
-    except (TypeError, ValueError, IndexError):
-        return None
-    
-# --- Display a DICOM File ---
-def display_dicom(
-    filepath,
-    downsample_factor: int = 4,
-    window_center: float = None,
-    window_width: float = None
-):
-    """
-    Display a DICOM file in a Streamlit app, with optional downsampling and windowing.
-
-    Parameters:
-    - filepath: Path to the DICOM file.
-    - downsample_factor: Factor by which to downsample the image (default is 4).
-    - window_center: Custom window center for image display (default is None).
-    - window_width: Custom window width for image display (default is None).
-    """
-    try:
-        # 1. Read and rescale
-        ds = pydicom.dcmread(filepath)
-        arr, ww, wc, lower, upper = digital_xray_from_dicom(ds)
-
-        # 2. Downsample (if desired)
-        if downsample_factor > 1:
-            arr = arr[::downsample_factor, ::downsample_factor]
-
-        center = window_center or wc
-        width = window_width or ww
-
-        # 4. Compute zmin/zmax
-        zmin = (center - width / 2.0) or lower
-        zmax = (center + width / 2.0) or upper
-
-        # 5. Plot with Plotly (zmin/zmax do the windowing)
-        fig = px.imshow(
-            arr,
-            color_continuous_scale="gray",
-            aspect="equal",
-            zmin=zmin,
-            zmax=zmax,
-            origin="upper",
-            x=np.arange(arr.shape[1]),
-            y=np.arange(arr.shape[0])
-        )
-        fig.update_layout(
-            coloraxis_showscale=False,
-            margin=dict(l=0, r=0, t=0, b=0),
-            dragmode="pan",
-            autosize=True,
-            height=600,
-        )
-        fig.update_xaxes(showticklabels=False)
-        fig.update_yaxes(showticklabels=False)
-
-        st.plotly_chart(
-            fig, use_container_width=True, config={"displayModeBar": True, "modeBarButtonsToRemove": ["toImage"]}
-        )
-    except Exception as e:
+import streamlit as st
+import pydicom
+import matplotlib.pyplot as plt
+import plotly.express as px
+import numpy as np
+import threading
+from pydicom.multival import MultiValue
+from image_cache import get_decode_cache
+from disk_cache import get_disk_cache
+from pixel_access import read_header, read_frame, decode_slot
+from decode_pool import get_decode_pool, DecodeTimeout, DecodeQueueFull
+from shm_registry import get_image_registry, image_key
+from window_presets import compute_histogram, histogram_from_meta, histogram_key, histogram_to_meta
+from config import DECODE_TIMEOUT
+
+DEFAULT_DOWNSAMPLE = 4
+
+# Layout of the disk cache entries written by decode_xray. Entries written by an older
+# layout (e.g. arrays clipped to the header window, or without a histogram) are decoded
+# again and replaced.
+DISK_CACHE_FORMAT = 3
+
+# Per-thread scratch buffers keyed by (name, shape, dtype). Streamlit runs each session in
+# its own thread, so buffers are reused across reruns without locking.
+_scratch = threading.local()
+
+def get_buffer(name, shape, dtype):
+    """
+    Return a preallocated per-thread buffer for the given shape and dtype.
+
+    The same array is handed out again for the next image with the same shape, so callers
+    must not keep a reference to it beyond the current render.
+
+    Parameters:
+    - name: Name distinguishing buffers used for different purposes.
+    - shape: Array shape.
+    - dtype: NumPy dtype.
+
+    Returns:
+    An uninitialized numpy array.
+    """
+    pool = getattr(_scratch, "pool", None)
+    if pool is None:
+        pool = _scratch.pool = {}
+    key = (name, tuple(shape), np.dtype(dtype).str)
+    buf = pool.get(key)
+    if buf is None:
+        buf = pool[key] = np.empty(shape, dtype=dtype)
+    return buf
+
+def digital_xray_from_dicom(dcmf, pixels=None, out=None):
+    """
+    Convert a DICOM file to a digital X-ray image.
+
+    Rescale and MONOCHROME1 inversion are applied in place on a single float32 buffer, so
+    no full-size temporaries are allocated besides the decoded pixels. The image keeps its
+    full rescaled range; the header window (lower, upper) is only applied when it is
+    displayed, so any other window can be applied to the same array.
+
+    Parameters:
+    - dcmf: DICOM file object (pydicom.dataset.FileDataset).
+    - pixels: Already-decoded stored pixel values (default is dcmf.pixel_array).
+    - out: Optional preallocated float32 array of the image shape to write into.
+
+    Returns:
+    A processed numpy array representing the X-ray image.
+    """
+    raw = dcmf.pixel_array if pixels is None else pixels
+    im = np.empty(raw.shape, dtype=np.float32) if out is None else out
+
+    # Rescale using slope & intercept (the cast to float32 happens in the same pass)
+    slope, intercept = 1.0, 0.0
+    if hasattr(dcmf, 'RescaleSlope') and hasattr(dcmf, 'RescaleIntercept'):
+        slope, intercept = float(dcmf.RescaleSlope), float(dcmf.RescaleIntercept)
+    if slope != 1.0:
+        np.multiply(raw, np.float32(slope), out=im, dtype=np.float32)
+        if intercept != 0.0:
+            np.add(im, np.float32(intercept), out=im)
+    elif intercept != 0.0:
+        np.add(raw, np.float32(intercept), out=im, dtype=np.float32)
+    else:
+        np.copyto(im, raw, casting="unsafe")
+
+    # Use the provided smallest and largest pixel values if available
+    data_range = None
+    if hasattr(dcmf, 'SmallestImagePixelValue') and hasattr(dcmf, 'LargestImagePixelValue'):
+        min_val = dcmf.SmallestImagePixelValue
+        max_val = dcmf.LargestImagePixelValue
+    else:
+        # Otherwise, compute from the stored (integer) pixels, which is cheaper than
+        # scanning the float image, and map through the linear rescale
+        raw_min, raw_max = raw.min(), raw.max()
+        min_val, max_val = sorted((raw_min * slope + intercept, raw_max * slope + intercept))
+        min_val, max_val = np.float32(min_val), np.float32(max_val)
+        data_range = (min_val, max_val)
+
+    # Apply windowing
+    if hasattr(dcmf, 'WindowCenter') and hasattr(dcmf, 'WindowWidth'):
+        wc = dcmf.WindowCenter
+        ww = dcmf.WindowWidth
+
+        # Handle multiple values in Window Center/Window Width
+        if isinstance(wc, pydicom.multival.MultiValue):
+            wc = wc[0]
+        if isinstance(ww, pydicom.multival.MultiValue):
+            ww = ww[0]
+    else:
+        # Use dynamic range from smallest and largest pixel values
+        wc = (min_val + max_val) / 2.0
+        ww = (max_val - min_val)
+
+    lower = wc - (ww/2)
+    upper = wc + (ww/2)
+
+    if dcmf.PhotometricInterpretation == "MONOCHROME1":
+        # Invert around the data maximum clipped to the header window, so values inside
+        # the window display exactly as they would after clipping. A second scan is only
+        # needed when the range came from the header.
+        data_max = data_range[1] if data_range is not None else im.max()
+        peak = np.float32(min(max(data_max, lower), upper))
+        np.subtract(peak, im, out=im)
+
+    return im, ww, wc, lower, upper
+
+def window_to_uint8(im, lower, upper, out=None):
+    """
+    Quantize an image to 8 bits for display, mapping [lower, upper] to [0, 255].
+
+    Uses a per-thread float32 scratch buffer and writes into `out` (or a per-thread uint8
+    buffer for the image shape), so repeated renders allocate nothing.
+
+    Parameters:
+    - im: Image array.
+    - lower: Intensity mapped to 0.
+    - upper: Intensity mapped to 255.
+    - out: Optional uint8 output array of the image shape.
+
+    Returns:
+    The uint8 image.
+    """
+    work = get_buffer("window_work", im.shape, np.float32)
+    if out is None:
+        out = get_buffer("window_u8", im.shape, np.uint8)
+    span = float(upper - lower) or 1.0
+    np.subtract(im, np.float32(lower), out=work, dtype=np.float32)
+    np.multiply(work, np.float32(255.0 / span), out=work)
+    np.clip(work, 0, 255, out=work)
+    np.copyto(out, work, casting="unsafe")
+    return out
+
+def get_first_element(value):
+    """
+    Extract the first element from a MultiValue object or convert a single value to float.
+
+    Parameters:
+    - value: A MultiValue or single value to convert.
+
+    Returns:
+    The first element as a float, or None if conversion fails.
+    """
+    if isinstance(value, MultiValue):
+        return float(value[0])
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        return None
+    
+def safe_float(val):
+    """
+    Safely convert a value to float, handling MultiValue and common containers.
+
+    Parameters:
+    - val: The value to convert, which may be a MultiValue, list, tuple, or single value.
+
+    Returns:
+    The converted float value, or None if conversion fails.
+    """
+    try:
+        if isinstance(val, MultiValue):
+            return float(val[0])
+        elif isinstance(val, (list, tuple)):
+            return float(val[0])
+        else:
+            return float(val)
+    except (TypeError, ValueError, IndexError):
+        return None
+    
+def header_window(ds):
+    """
+    Estimate the display window from a DICOM header alone, before the pixels are decoded.
+
+    Parameters:
+    - ds: DICOM header (pixel data not required).
+
+    Returns:
+    A tuple (wc, ww, exact). `exact` is True when the header carries Window Center/Width,
+    which digital_xray_from_dicom uses as is; otherwise the window spans the stored bit
+    range and is refined once the image has been decoded.
+    """
+    wc = get_first_element(ds.get("WindowCenter"))
+    ww = get_first_element(ds.get("WindowWidth"))
+    if wc is not None and ww is not None:
+        return wc, ww, True
+    bits_stored = int(ds.get("BitsStored", 12))
+    if ds.get("PixelRepresentation", 0) == 1:
+        lo, hi = -2 ** (bits_stored - 1), 2 ** (bits_stored - 1) - 1
+    else:
+        lo, hi = 0, 2 ** bits_stored - 1
+    slope = safe_float(ds.get("RescaleSlope", 1)) or 1.0
+    intercept = safe_float(ds.get("RescaleIntercept", 0)) or 0.0
+    lo, hi = sorted((lo * slope + intercept, hi * slope + intercept))
+    return (lo + hi) / 2.0, hi - lo, False
+
+def decode_xray(filepath, frame: int = 0, histogram: bool = False):
+    """
+    Decode one frame of a DICOM X-ray at full resolution, going through the on-disk array cache.
+
+    On a disk-cache hit the pixels are returned as a read-only memory map and no DICOM
+    decoding takes place. Otherwise only the requested frame is decoded (see
+    pixel_access.read_frame), inside a bounded slot when the frame is very large. The
+    frame's intensity histogram (window_presets.compute_histogram) is computed from the
+    decoded, unclipped values and stored with it in the disk cache.
+
+    Parameters:
+    - filepath: Path to the DICOM file.
+    - frame: Zero-based frame index for multi-frame objects (default is 0).
+    - histogram: Also return the histogram.
+
+    Returns:
+    A tuple (image, ww, wc, lower, upper) as returned by digital_xray_from_dicom, with the
+    histogram appended if `histogram` is True.
+    """
+    disk = get_disk_cache()
+    if disk is not None:
+        hit = disk.get(filepath, frame=frame)
+        if hit is not None and hit[1].get("format") == DISK_CACHE_FORMAT:
+            arr, meta = hit
+            value = (arr, meta["ww"], meta["wc"], meta["lower"], meta["upper"])
+            return value + (histogram_from_meta(meta["hist"]),) if histogram else value
+
+    ds = read_header(filepath)
+    with decode_slot(ds):
+        pixels = read_frame(filepath, frame, ds=ds, bounded=False)
+        arr, ww, wc, lower, upper = digital_xray_from_dicom(ds, pixels=pixels)
+    ww, wc, lower, upper = float(ww), float(wc), float(lower), float(upper)
+    hist = compute_histogram(arr)
+    if disk is not None:
+        meta = {"format": DISK_CACHE_FORMAT, "ww": ww, "wc": wc, "lower": lower, "upper": upper,
+                "hist": histogram_to_meta(hist)}
+        disk.put(filepath, arr, meta, frame=frame)
+    value = (arr, ww, wc, lower, upper)
+    return value + (hist,) if histogram else value
+
+def load_xray(filepath, downsample_factor: int = DEFAULT_DOWNSAMPLE, frame: int = 0):
+    """
+    Decode (and optionally downsample) a DICOM X-ray through the shared decode cache.
+
+    Window parameters are computed on the full-resolution image before downsampling, so
+    they do not depend on `downsample_factor`. The returned array is read-only and shared
+    with every other session that views the same image. Decoding runs in the decode
+    process pool unless DECODE_WORKERS is 0, and the image is then a view over the shared
+    image registry; a decode slower than DECODE_TIMEOUT raises DecodeTimeout but keeps
+    running, so the next rerun picks up its result. The image's histogram, computed by the
+    same decode, is put in the decode cache (see window_presets.get_histogram).
+
+    Parameters:
+    - filepath: Path to the DICOM file.
+    - downsample_factor: Factor by which to downsample the image (default is 4).
+    - frame: Zero-based frame index for multi-frame objects (default is 0).
+
+    Returns:
+    A tuple (image, ww, wc, lower, upper) as returned by digital_xray_from_dicom.
+    """
+    pool = get_decode_pool()
+    if pool is not None:
+        # Decoded in a worker process straight into shared memory; the result is a
+        # zero-copy view, and the request is shared with any prefetch already running.
+        value = get_image_registry().get(image_key(filepath, downsample_factor, frame))
+        if value is None:
+            value = pool.submit(filepath, downsample_factor, frame).result(timeout=DECODE_TIMEOUT)
+        return value
+
+    def _decode():
+        arr, ww, wc, lower, upper, hist = decode_xray(filepath, frame, histogram=True)
+        get_decode_cache().put(histogram_key(filepath, frame), hist)
+        if downsample_factor > 1:
+            arr = np.ascontiguousarray(arr[::downsample_factor, ::downsample_factor])
+        return arr, ww, wc, lower, upper
+
+    return get_decode_cache().get_or_load(image_key(filepath, downsample_factor, frame), _decode)
+
+
+def peek_xray(filepath, downsample_factor: int = DEFAULT_DOWNSAMPLE, frame: int = 0):
+    """
+    Return the decoded image tuple if it is already resident, without decoding; otherwise None.
+    """
+    key = image_key(filepath, downsample_factor, frame)
+    if get_decode_pool() is not None:
+        return get_image_registry().get(key)
+    return get_decode_cache().get(key)
+
+# --- Display a DICOM File ---
+def display_dicom(
+    filepath,
+    downsample_factor: int = DEFAULT_DOWNSAMPLE,
+    window_center: float = None,
+    window_width: float = None,
+    frame: int = 0
+):
+    """
+    Display a DICOM file in a Streamlit app, with optional downsampling and windowing.
+
+    Parameters:
+    - filepath: Path to the DICOM file.
+    - downsample_factor: Factor by which to downsample the image (default is 4).
+    - window_center: Custom window center for image display (default is None).
+    - window_width: Custom window width for image display (default is None).
+    - frame: Frame to display for multi-frame objects (default is 0).
+    """
+    try:
+        # 1-2. Read, rescale and downsample (shared across sessions)
+        arr, ww, wc, lower, upper = load_xray(filepath, downsample_factor, frame)
+
+        center = window_center or wc
+        width = window_width or ww
+
+        # 4. Compute zmin/zmax
+        zmin = (center - width / 2.0) or lower
+        zmax = (center + width / 2.0) or upper
+
+        # 5. Window to 8 bits into a reused per-shape buffer (4x smaller payload than float32),
+        #    reading the shared image in place while it is pinned against eviction
+        with get_image_registry().pin(image_key(filepath, downsample_factor, frame)):
+            img8 = window_to_uint8(arr, zmin, zmax)
+        rows, cols = arr.shape
+        del arr
+
+        # 6. Plot with Plotly
+        fig = px.imshow(
+            img8,
+            color_continuous_scale="gray",
+            aspect="equal",
+            zmin=0,
+            zmax=255,
+            origin="upper",
+            x=np.arange(cols),
+            y=np.arange(rows)
+        )
+        fig.update_layout(
+            coloraxis_showscale=False,
+            margin=dict(l=0, r=0, t=0, b=0),
+            dragmode="pan",
+            autosize=True,
+            height=600,
+        )
+        fig.update_xaxes(showticklabels=False)
+        fig.update_yaxes(showticklabels=False)
+
+        st.plotly_chart(
+            fig, use_container_width=True, config={"displayModeBar": True, "modeBarButtonsToRemove": ["toImage"]}
+        )
+    except (DecodeTimeout, DecodeQueueFull) as e:
+        st.warning(f"{e} Please try again in a moment.")
+    except Exception as e:
         st.error(f"There was an error processing the DICOM file: {e}")
\ No newline at end of file
@@ -0,0 +1,168 @@
+import os
+
+import numpy as np
+import streamlit as st
+import streamlit.components.v1 as components
+
+from decode_pool import DecodeTimeout, DecodeQueueFull
+from dicom_utils import DEFAULT_DOWNSAMPLE, load_xray
+from pixel_access import DecodeBusyError
+from image_cache import get_decode_cache
+from config import TILE_SERVER_URL
+from tile_server import ensure_tile_server, image_info, register_image
+
+_COMPONENTS_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "components")
+_dicom_viewer = components.declare_component("dicom_viewer", path=os.path.join(_COMPONENTS_DIR, "dicom_viewer"))
+_tile_viewer = components.declare_component("tile_viewer", path=os.path.join(_COMPONENTS_DIR, "tile_viewer"))
+
+
+def pack_uint16(arr):
+    """
+    Pack a rescaled image into little-endian uint16 for transfer to the browser.
+
+    The image is not clipped to the header window (see digital_xray_from_dicom), so the
+    packed values span the full pixel range and the browser can widen or move the window
+    beyond the header window; the header window is only the initial one.
+
+    Parameters:
+    - arr: Decoded (rescaled) image as a float array.
+
+    Returns:
+    A dict with the packed bytes, shape and the (vmin, vmax) range mapped to 0..65535.
+    """
+    vmin = float(np.min(arr))
+    vmax = float(np.max(arr))
+    scale = 65535.0 / (vmax - vmin) if vmax > vmin else 0.0
+    packed = np.empty(arr.shape, dtype="<u2")
+    np.multiply(np.subtract(arr, vmin, dtype=np.float32), scale, out=packed, casting="unsafe")
+    return {
+        "data": packed.tobytes(),
+        "rows": int(arr.shape[0]),
+        "cols": int(arr.shape[1]),
+        "vmin": vmin,
+        "vmax": vmax,
+    }
+
+
+def viewer_image_id(filepath, frame=0):
+    """
+    Identifier the client-side viewer reports back with each window change.
+    """
+    return filepath if frame == 0 else f"{filepath}#frame={frame}"
+
+
+def dicom_viewer(
+    filepath,
+    window_center: float = None,
+    window_width: float = None,
+    downsample_factor: int = DEFAULT_DOWNSAMPLE,
+    frame: int = 0,
+    inverted: bool = False,
+    height: int = 600,
+    key: str = "dicom_viewer",
+    on_change=None,
+):
+    """
+    Display a DICOM file with window/level, inversion and zoom applied in the browser.
+
+    The image is sent once per image as a packed uint16 buffer (identical payloads are
+    deduplicated by Streamlit's message cache). Dragging the window does not rerun the
+    script; the component reports the new window only when a drag ends.
+
+    Parameters:
+    - filepath: Path to the DICOM file.
+    - window_center: Current window center (default is the DICOM/native value).
+    - window_width: Current window width (default is the DICOM/native value).
+    - downsample_factor: Factor by which to downsample the image (default is 4).
+    - frame: Frame to display for multi-frame objects (default is 0).
+    - inverted: Whether the display is inverted.
+    - height: Height of the viewer in pixels.
+    - key: Streamlit widget key; the last reported window is stored under it.
+    - on_change: Callback invoked when the user finishes a window change in the browser.
+
+    Returns:
+    The last value reported by the browser: a dict with image_id, center, width and
+    inverted, or None.
+    """
+    arr, ww, wc, lower, upper = load_xray(filepath, downsample_factor, frame)
+    packed = get_decode_cache().get_or_load(
+        (filepath, downsample_factor, "uint16", frame), lambda: pack_uint16(arr)
+    )
+
+    return _dicom_viewer(
+        image=packed["data"],
+        image_id=viewer_image_id(filepath, frame),
+        rows=packed["rows"],
+        cols=packed["cols"],
+        vmin=packed["vmin"],
+        vmax=packed["vmax"],
+        native_center=float(wc),
+        native_width=float(ww),
+        center=float(window_center if window_center is not None else wc),
+        width=float(window_width if window_width is not None else ww),
+        inverted=bool(inverted),
+        height=height,
+        key=key,
+        default=None,
+        on_change=on_change,
+    )
+
+
+def deep_zoom_viewer(
+    filepath,
+    window_center: float = None,
+    window_width: float = None,
+    inverted: bool = False,
+    height: int = 700,
+    key: str = "deep_zoom_viewer",
+    on_change=None,
+):
+    """
+    Display a DICOM file at full resolution through the tiled deep-zoom viewer.
+
+    The browser fetches only the 256x256 tiles visible at the current zoom from the local
+    tile server (tile_server.py), at the matching pyramid level. Tiles are generated lazily
+    and cached; window/level is applied in the browser as in `dicom_viewer`. The
+    full-resolution image is decoded in the decode pool; if that times out or the decoder
+    is busy, a warning is shown instead and the next rerun picks up the decode.
+
+    Parameters:
+    - filepath: Path to the DICOM file.
+    - window_center: Current window center (default is the DICOM/native value).
+    - window_width: Current window width (default is the DICOM/native value).
+    - inverted: Whether the display is inverted.
+    - height: Height of the viewer in pixels.
+    - key: Streamlit widget key; the last reported window is stored under it.
+    - on_change: Callback invoked when the user finishes a window change in the browser.
+
+    Returns:
+    The last value reported by the browser (same format as `dicom_viewer`), or None.
+    """
+    port = ensure_tile_server()
+    try:
+        info = image_info(filepath)
+    except (DecodeTimeout, DecodeQueueFull, DecodeBusyError) as e:
+        st.warning(f"{e} Please try again in a moment.")
+        return None
+    tile_id = register_image(filepath)
+
+    return _tile_viewer(
+        image_id=tile_id,
+        port=port,
+        tile_url=TILE_SERVER_URL or None,
+        rows=info["rows"],
+        cols=info["cols"],
+        levels=info["levels"],
+        tile_size=info["tile_size"],
+        vmin=info["vmin"],
+        vmax=info["vmax"],
+        native_center=info["wc"],
+        native_width=info["ww"],
+        center=float(window_center if window_center is not None else info["wc"]),
+        width=float(window_width if window_width is not None else info["ww"]),
+        inverted=bool(inverted),
+        height=height,
+        key=key,
+        default=None,
+        on_change=on_change,
+    )
@@ -0,0 +1,208 @@
+import hashlib
+import json
+import os
+import tempfile
+import threading
+
+import numpy as np
+
+from config import DECODE_DISK_CACHE_DIR, DECODE_DISK_CACHE_BYTES
+
+
+class DiskArrayCache:
+    """
+    Persistent on-disk cache of decoded pixel arrays stored as raw `.npy` files.
+
+    Entries are keyed by the source file's absolute path, size and mtime, so a DICOM that is
+    replaced on the share is decoded again automatically. Reads use `np.load(mmap_mode="r")`,
+    so re-viewing an image after a restart costs a page-cache read instead of a decode.
+    Each array has a small `.json` sidecar with its window parameters. The directory is kept
+    under `max_bytes` by deleting the least recently used entries.
+    """
+    def __init__(self, root=DECODE_DISK_CACHE_DIR, max_bytes=DECODE_DISK_CACHE_BYTES):
+        self.root = root
+        self.max_bytes = int(max_bytes)
+        self._lock = threading.Lock()
+        self._total_bytes = None   # computed lazily from the directory contents
+        self._hits = 0
+        self._misses = 0
+        self._evictions = 0
+        os.makedirs(self.root, exist_ok=True)
+
+    def key_for(self, filepath, frame=0):
+        """
+        Return the cache key for a source file (and frame), or None if it cannot be stat'ed.
+        """
+        try:
+            st = os.stat(filepath)
+        except OSError:
+            return None
+        ident = f"{os.path.abspath(filepath)}|{st.st_size}|{st.st_mtime_ns}"
+        if frame:
+            ident += f"|frame={frame}"
+        return hashlib.sha1(ident.encode("utf-8")).hexdigest()
+
+    def _paths(self, key):
+        base = os.path.join(self.root, key[:2], key)
+        return base + ".npy", base + ".json"
+
+    def get(self, filepath, frame=0):
+        """
+        Look up the decoded array for a source file.
+
+        Parameters:
+        - filepath: Path to the source DICOM file.
+        - frame: Frame index for multi-frame objects.
+
+        Returns:
+        A tuple (array, meta) where `array` is a read-only memory map, or None on a miss.
+        """
+        key = self.key_for(filepath, frame)
+        if key is None:
+            return None
+        npy_path, meta_path = self._paths(key)
+        try:
+            with open(meta_path, "r") as f:
+                meta = json.load(f)
+            arr = np.load(npy_path, mmap_mode="r")
+        except (OSError, ValueError):
+            with self._lock:
+                self._misses += 1
+            return None
+
+        # Refresh the mtime so eviction treats this entry as recently used.
+        try:
+            os.utime(npy_path)
+        except OSError:
+            pass
+        with self._lock:
+            self._hits += 1
+        return arr, meta
+
+    def put(self, filepath, arr, meta, frame=0):
+        """
+        Store a decoded array and its metadata for a source file.
+
+        Files are written to a temporary name and moved into place, so concurrent readers
+        never see a partial entry.
+
+        Parameters:
+        - filepath: Path to the source DICOM file.
+        - arr: Decoded pixel array.
+        - meta: JSON-serializable dict stored alongside the array.
+        - frame: Frame index for multi-frame objects.
+        """
+        key = self.key_for(filepath, frame)
+        if key is None:
+            return
+        npy_path, meta_path = self._paths(key)
+        os.makedirs(os.path.dirname(npy_path), exist_ok=True)
+
+        arr = np.ascontiguousarray(arr)
+        if arr.nbytes > self.max_bytes:
+            return
+        try:
+            replaced_bytes = os.path.getsize(npy_path)
+        except OSError:
+            replaced_bytes = 0
+        tmp_name = None
+        try:
+            with tempfile.NamedTemporaryFile(dir=os.path.dirname(npy_path), suffix=".npy.tmp", delete=False) as tmp:
+                tmp_name = tmp.name
+                np.save(tmp, arr, allow_pickle=False)
+            os.replace(tmp_name, npy_path)
+            with tempfile.NamedTemporaryFile("w", dir=os.path.dirname(meta_path), suffix=".json.tmp", delete=False) as tmp:
+                tmp_name = tmp.name
+                json.dump(meta, tmp)
+            os.replace(tmp_name, meta_path)
+        except OSError:
+            # A full or read-only disk only costs us the cache entry.
+            if tmp_name is not None:
+                try:
+                    os.remove(tmp_name)
+                except OSError:
+                    pass
+            return
+
+        with self._lock:
+            if self._total_bytes is not None:
+                # Overwriting an entry replaces its file rather than adding one
+                self._total_bytes += os.path.getsize(npy_path) - replaced_bytes
+        self._maybe_evict()
+
+    def _scan(self):
+        entries = []
+        for dirpath, _, filenames in os.walk(self.root):
+            for name in filenames:
+                if not name.endswith(".npy"):
+                    continue
+                path = os.path.join(dirpath, name)
+                try:
+                    st = os.stat(path)
+                except OSError:
+                    continue
+                entries.append((st.st_mtime, st.st_size, path))
+        return entries
+
+    def _maybe_evict(self):
+        with self._lock:
+            if self._total_bytes is None:
+                self._total_bytes = sum(size for _, size, _ in self._scan())
+            if self._total_bytes <= self.max_bytes:
+                return
+            # Evict down to 90% of the budget so we do not rescan on every put.
+            target = int(self.max_bytes * 0.9)
+            entries = sorted(self._scan())
+            total = sum(size for _, size, _ in entries)
+            for _, size, path in entries:
+                if total <= target:
+                    break
+                try:
+                    os.remove(path)
+                except OSError:
+                    # Still memory-mapped by a reader (Windows) or already gone.
+                    continue
+                try:
+                    os.remove(path[:-len(".npy")] + ".json")
+                except OSError:
+                    pass
+                total -= size
+                self._evictions += 1
+            self._total_bytes = total
+
+    def stats(self):
+        """
+        Return cache statistics.
+
+        Returns:
+        A dict with hits, misses, evictions, resident_bytes (None until first computed) and max_bytes.
+        """
+        with self._lock:
+            return {
+                "hits": self._hits,
+                "misses": self._misses,
+                "evictions": self._evictions,
+                "resident_bytes": self._total_bytes,
+                "max_bytes": self.max_bytes,
+            }
+
+
+_disk_cache = None
+_disk_cache_lock = threading.Lock()
+
+
+def get_disk_cache():
+    """
+    Return the process-wide DiskArrayCache, or None if the disk cache is disabled.
+    """
+    global _disk_cache
+    if not DECODE_DISK_CACHE_DIR:
+        return None
+    if _disk_cache is None:
+        with _disk_cache_lock:
+            if _disk_cache is None:
+                try:
+                    _disk_cache = DiskArrayCache(DECODE_DISK_CACHE_DIR, DECODE_DISK_CACHE_BYTES)
+                except OSError:
+                    return None
+    return _disk_cache
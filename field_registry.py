@@ -0,0 +1,222 @@
+"""
+Registry of the annotation fields.
+
+Every field is declared once, in CLINICIAN_RADIOS or DATA_SCIENTIST_RADIOS: its radio
+label, the session state key holding the form value, the file column, the options in
+display order and the layout. Each role's list is compiled into a `RoleFields` with the
+key tuples, column maps and per-role column names precomputed. The radios, form loads,
+saves, completeness checks, navigation, resume, the file schema and the agreement
+statistics all read ROLE_FIELDS, so a new field is one more entry in a list here.
+"""
+import pandas as pd
+
+# Radio fields as tuples: (label, session state key, file column, options, horizontal)
+CLINICIAN_RADIOS = [
+    (
+        "Select consistency:",
+        "ards_likelihood",
+        "ARDS_Likelihood_Score",
+        [
+            "1 - Highly inconsistent",
+            "2 - Somewhat inconsistent",
+            "3 - Somewhat consistent",
+            "4 - Highly consistent"
+        ],
+        False
+    ),
+    (
+        "Diffuse alveolar damage:",
+        "diffuse_damage",
+        "DiffuseAlveolarDamage",
+        ["Left", "Right", "Bilateral", "None"],
+        True
+    ),
+    (
+        "Pleural space occupying lesion (e.g., PEFF, PTX):",
+        "pleural_lesion",
+        "PleuralSpaceOccupyingLesion",
+        ["Left", "Right", "Bilateral", "None"],
+        True
+    ),
+    (
+        "Pulmonary edema:",
+        "pulmonary_edema",
+        "PulmonaryEdema",
+        ["Left", "Right", "Bilateral", "None"],
+        True
+    ),
+    (
+        "Consolidation:",
+        "consolidation",
+        "Consolidation",
+        ["Left", "Right", "Bilateral", "None"],
+        True
+    ),
+    (
+        "Atelectasis:",
+        "atelectasis",
+        "Atelectasis",
+        ["Left", "Right", "Bilateral", "None"],
+        True
+    ),
+    (
+        "Normal Appearing Mediastinum?:",
+        "mediastinum_findings",
+        "FindingsMediastinum",
+        ["Yes", "No"],
+        True
+    ),
+    (
+        "Sufficient quality for clinical analysis:",
+        "sufficient_quality",
+        "SufficientQuality",
+        ["Yes", "No"],
+        True
+    ),
+    (
+        "Global ARDS Criteria:",
+        "global_criteria",
+        "GlobalARDSCriteria",
+        ["Yes", "No"],
+        True
+    ),
+]
+
+DATA_SCIENTIST_RADIOS = [
+    (
+        "Intubated (OETT or tracheostomy):",
+        "intubated",
+        "Intubated",
+        ["Yes", "No"],
+        True
+    ),
+    (
+        "External support devices visible (e.g., ECG leads, brace):",
+        "external_support_devices",
+        "ExternalSupportDevices",
+        ["Yes", "No"],
+        True
+    ),
+    (
+        "Implanted medical device visible (e.g., pacemaker, prosthetic):",
+        "implanted_device",
+        "ImplantedDevice",
+        ["Yes", "No"],
+        True
+    ),
+    (
+        "Other foreign bodies present (e.g., shrapnel):",
+        "foreign_bodies",
+        "ForeignBodies",
+        ["Yes", "No"],
+        True
+    ),
+    (
+        "Image artifacts/quality issues present:",
+        "image_artifacts",
+        "ImageArtifacts",
+        ["Yes", "No"],
+        True
+    ),
+    (
+        "Annotations or text present:",
+        "annotations_text_present",
+        "AnnotationsTextPresent",
+        ["No", "Few characters", "Complete words"],
+        True
+    ),
+    (
+        "PHI present?",
+        "phi_present",
+        "PhiPresent",
+        ["Yes", "No"],
+        True
+    ),
+    (
+        "Post-processing image present?",
+        "post_processing",
+        "PostProcessing",
+        ["Yes", "No"],
+        True
+    ),
+    (
+        "View present?",
+        "view_present",
+        "ViewPresent",
+        ["Frontal", "Lateral", 'Other'],
+        True
+    ),
+]
+
+
+# role -> suffix of its per-role columns (Username_cl, Timestamp_ds, ...)
+ROLE_SUFFIX = {"Clinician": "cl", "Data Scientist": "ds"}
+
+
+class RoleFields:
+    """
+    The compiled field list of one role.
+
+    Attributes:
+    - radios: The role's radio tuples (label, session key, column, options, horizontal).
+    - keys: Session state keys of the fields, in display order.
+    - columns: File columns of the fields, in the same order.
+    - column_options: Tuple of (column, options) pairs.
+    - column_of: Dict session key -> column.
+    - username_col, timestamp_col, user_role_col, elapsed_col: The role's record columns.
+    """
+    __slots__ = ("role", "radios", "keys", "columns", "column_options", "column_of",
+                 "username_col", "timestamp_col", "user_role_col", "elapsed_col")
+
+    def __init__(self, role, radios):
+        suffix = ROLE_SUFFIX[role]
+        self.role = role
+        self.radios = tuple(radios)
+        self.keys = tuple(field[1] for field in radios)
+        self.columns = tuple(field[2] for field in radios)
+        self.column_options = tuple((field[2], tuple(field[3])) for field in radios)
+        self.column_of = dict(zip(self.keys, self.columns))
+        self.username_col = f"Username_{suffix}"
+        self.timestamp_col = f"Timestamp_{suffix}"
+        self.user_role_col = f"UserRole_{suffix}"
+        self.elapsed_col = f"AnnotationElapsedTime_sec_{suffix}"
+
+    def form_values(self, session):
+        """
+        Return the form values of the fields as a dict column -> value (None if unanswered).
+        """
+        return dict(zip(self.columns, map(session.get, self.keys)))
+
+    def is_complete(self, session):
+        """
+        True when every field of the form has a value.
+        """
+        return None not in map(session.get, self.keys)
+
+    def any_filled(self, session):
+        """
+        True when at least one field of the form has a value.
+        """
+        return any(value is not None for value in map(session.get, self.keys))
+
+    def reset(self, session):
+        """
+        Clear every field of the form.
+        """
+        for key in self.keys:
+            session[key] = None
+
+    def load(self, session, record):
+        """
+        Fill the form from a stored record (a Series or dict with the file columns).
+        Columns the record lacks and missing values leave the field empty.
+        """
+        for key, column in self.column_of.items():
+            value = record.get(column)
+            session[key] = value if value is not None and not pd.isna(value) else None
+
+
+ROLE_FIELDS = {
+    "Clinician": RoleFields("Clinician", CLINICIAN_RADIOS),
+    "Data Scientist": RoleFields("Data Scientist", DATA_SCIENTIST_RADIOS),
+}
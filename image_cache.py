@@ -0,0 +1,180 @@
+import threading
+from collections import OrderedDict
+
+import numpy as np
+
+from config import DECODE_CACHE_BYTES
+
+
+def _nbytes(value):
+    """
+    Approximate the memory held by a cached value (sum of all NumPy arrays and byte buffers it contains).
+    """
+    if isinstance(value, np.ndarray):
+        return value.nbytes
+    if isinstance(value, (bytes, bytearray)):
+        return len(value)
+    if isinstance(value, (tuple, list)):
+        return sum(_nbytes(v) for v in value)
+    if isinstance(value, dict):
+        return sum(_nbytes(v) for v in value.values())
+    return 0
+
+
+def _freeze(value):
+    """
+    Mark every NumPy array in a cached value read-only so sessions can share it safely.
+    """
+    if isinstance(value, np.ndarray):
+        value.setflags(write=False)
+    elif isinstance(value, (tuple, list)):
+        for v in value:
+            _freeze(v)
+    elif isinstance(value, dict):
+        for v in value.values():
+            _freeze(v)
+    return value
+
+
+class DecodeCache:
+    """
+    Process-global, memory-bounded LRU cache of decoded (and downsampled) images.
+
+    Streamlit runs every user session as a thread of the same server process, so one
+    instance of this cache is shared by all annotators. Cached arrays are read-only.
+    Concurrent requests for the same key are collapsed into a single decode.
+    """
+    def __init__(self, max_bytes=DECODE_CACHE_BYTES):
+        self.max_bytes = int(max_bytes)
+        self._entries = OrderedDict()   # key -> (value, nbytes)
+        self._inflight = {}             # key -> threading.Event
+        self._lock = threading.Lock()
+        self._resident_bytes = 0
+        self._hits = 0
+        self._misses = 0
+        self._evictions = 0
+
+    def get(self, key):
+        """
+        Return the cached value for `key` (marking it most recently used), or None.
+        """
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self._misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self._hits += 1
+            return entry[0]
+
+    def __contains__(self, key):
+        with self._lock:
+            return key in self._entries
+
+    def put(self, key, value):
+        """
+        Insert a value, evicting least recently used entries until the byte budget is met.
+        Values larger than the whole budget are not cached.
+        """
+        value = _freeze(value)
+        nbytes = _nbytes(value)
+        with self._lock:
+            self._put_locked(key, value, nbytes)
+        return value
+
+    def _put_locked(self, key, value, nbytes):
+        if key in self._entries:
+            self._resident_bytes -= self._entries.pop(key)[1]
+        if nbytes > self.max_bytes:
+            return
+        self._entries[key] = (value, nbytes)
+        self._resident_bytes += nbytes
+        while self._resident_bytes > self.max_bytes and self._entries:
+            _, (_, evicted_bytes) = self._entries.popitem(last=False)
+            self._resident_bytes -= evicted_bytes
+            self._evictions += 1
+
+    def get_or_load(self, key, loader):
+        """
+        Return the cached value for `key`, calling `loader()` to produce it on a miss.
+
+        If another session is already loading the same key, wait for it instead of
+        decoding the image a second time.
+        """
+        while True:
+            with self._lock:
+                entry = self._entries.get(key)
+                if entry is not None:
+                    self._entries.move_to_end(key)
+                    self._hits += 1
+                    return entry[0]
+                pending = self._inflight.get(key)
+                if pending is None:
+                    self._misses += 1
+                    pending = self._inflight[key] = threading.Event()
+                    break
+            # Another session is decoding this image. If its loader fails or the value is
+            # too large to cache, the next pass through the loop loads it here instead.
+            pending.wait()
+
+        try:
+            value = _freeze(loader())
+            with self._lock:
+                self._put_locked(key, value, _nbytes(value))
+            return value
+        finally:
+            with self._lock:
+                self._inflight.pop(key, None)
+            pending.set()
+
+    def invalidate(self, key):
+        """
+        Drop a single entry if present.
+        """
+        with self._lock:
+            entry = self._entries.pop(key, None)
+            if entry is not None:
+                self._resident_bytes -= entry[1]
+
+    def clear(self):
+        """
+        Drop every entry (statistics are kept).
+        """
+        with self._lock:
+            self._entries.clear()
+            self._resident_bytes = 0
+
+    def stats(self):
+        """
+        Return cache statistics.
+
+        Returns:
+        A dict with hits, misses, evictions, entries, resident_bytes, max_bytes and hit_rate.
+        """
+        with self._lock:
+            lookups = self._hits + self._misses
+            return {
+                "hits": self._hits,
+                "misses": self._misses,
+                "evictions": self._evictions,
+                "entries": len(self._entries),
+                "resident_bytes": self._resident_bytes,
+                "max_bytes": self.max_bytes,
+                "hit_rate": self._hits / lookups if lookups else 0.0,
+            }
+
+
+_decode_cache = None
+_decode_cache_lock = threading.Lock()
+
+
+def get_decode_cache():
+    """
+    Return the process-wide DecodeCache, creating it on first use.
+    """
+    global _decode_cache
+    if _decode_cache is None:
+        with _decode_cache_lock:
+            if _decode_cache is None:
+                _decode_cache = DecodeCache(DECODE_CACHE_BYTES)
+    return _decode_cache
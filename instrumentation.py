@@ -0,0 +1,138 @@
+"""
+Rerun instrumentation.
+
+Counts script runs per session and for the whole server process, split by scope: "app"
+for full-page runs and the fragment name for fragment runs. Runs from a fragment's polling
+timer are counted separately. Navigation actions are counted too (`record_action`), and
+`last_action_runs` is the number of script runs since the last one, which should be 1.
+Clicks the navigation engine drops as duplicates are counted separately.
+
+Enable the sidebar table with RERUN_STATS=1.
+"""
+import threading
+from collections import Counter
+
+import streamlit as st
+
+from config import RERUN_STATS
+from session_manager import note_activity
+from state import state
+
+_totals = Counter()
+_totals_lock = threading.Lock()
+
+
+def _is_fragment_run():
+    try:
+        from streamlit.runtime.scriptrunner import get_script_run_ctx
+    except ImportError:
+        return False
+    ctx = get_script_run_ctx(suppress_warning=True)
+    return bool(ctx is not None and ctx.fragment_ids_this_run)
+
+
+def record_run(scope="app", polled=False):
+    """
+    Count one script run. Call at the top of the main script and of every fragment; a
+    fragment executed as part of a full-page run is not counted again.
+
+    Parameters:
+    - scope: "app" for a full-page run, or the fragment name.
+    - polled: True for runs triggered by a fragment's run_every timer.
+    """
+    if scope != "app" and not _is_fragment_run():
+        return      # part of a full-page run, already counted as "app"
+    counts = state.get("rerun_counts")
+    if counts is None:
+        counts = state.rerun_counts = Counter()
+    counts[scope] += 1
+    kind = "polled" if polled else "interactions"
+    counts[kind] += 1
+    if not polled:
+        state.last_action_runs = state.get("last_action_runs", 0) + 1
+        if scope != "app":
+            note_activity()     # full runs are recorded by session_manager.track_session
+    with _totals_lock:
+        _totals[scope] += 1
+        _totals[kind] += 1
+
+
+def record_action(name, duplicate=False):
+    """
+    Count one navigation action. Called from the action's on_click callback, which runs
+    just before the script run it causes.
+
+    Parameters:
+    - name: Action name.
+    - duplicate: True for a click the navigation engine dropped as a duplicate.
+    """
+    counts = state.get("rerun_counts")
+    if counts is None:
+        counts = state.rerun_counts = Counter()
+    kind = "duplicates" if duplicate else "actions"
+    counts[kind] += 1
+    state.last_action = name
+    state.last_action_runs = 0
+    with _totals_lock:
+        _totals[kind] += 1
+
+
+def _summary(counts):
+    counts = Counter(counts)
+    kinds = ("interactions", "polled", "actions", "duplicates")
+    runs = sum(v for k, v in counts.items() if k not in kinds)
+    return {
+        "runs": runs,
+        "full_runs": counts["app"],
+        "fragment_runs": runs - counts["app"],
+        "interactions": counts["interactions"],
+        "polled": counts["polled"],
+        "actions": counts["actions"],
+        "duplicates": counts["duplicates"],
+        "by_scope": {k: v for k, v in counts.items() if k not in kinds},
+    }
+
+
+def rerun_counts():
+    """
+    Return the current session's run counters (see `_summary` for the keys), plus the
+    last navigation action and the number of script runs it caused.
+    """
+    stats = _summary(state.get("rerun_counts") or {})
+    stats["last_action"] = state.get("last_action")
+    stats["last_action_runs"] = state.get("last_action_runs", 0)
+    return stats
+
+
+def global_rerun_counts():
+    """
+    Return the run counters of every session in this server process.
+    """
+    with _totals_lock:
+        return _summary(_totals)
+
+
+def reset_rerun_counts():
+    """
+    Clear the current session's counters (e.g. before measuring a single action).
+    """
+    state.rerun_counts = Counter()
+    state.last_action_runs = 0
+
+
+def render_rerun_stats():
+    """
+    Show the session's run counters in an expander when RERUN_STATS is enabled.
+    """
+    if not RERUN_STATS:
+        return
+    stats = rerun_counts()
+    with st.expander("⏱ Reruns", expanded=False):
+        st.caption(
+            f"{stats['runs']} runs ({stats['full_runs']} full, {stats['fragment_runs']} fragment, "
+            f"{stats['polled']} polled) for {stats['actions']} navigation actions "
+            f"({stats['duplicates']} duplicate clicks dropped)"
+        )
+        if stats["last_action"]:
+            st.caption(f"Last action `{stats['last_action']}`: {stats['last_action_runs']} script run(s)")
+        st.table({"scope": list(stats["by_scope"]), "runs": list(stats["by_scope"].values())})
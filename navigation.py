@@ -1,233 +1,274 @@
-import streamlit as st
-from datetime import datetime, timedelta
-import pandas as pd
-import time
-# --- Annotation utilities ---
-from annotation_utils import (
-    reset_annotation_fields,
-    all_annotations_filled,
-    save_all_views_for_patient,
-    refresh_form_complete,
-    load_annotations_for_image
-)
-
-_MIN_NAV_INTERVAL = 1.0          # seconds
-
-def _too_soon(flag_name):
-    now = time.time()
-    last = st.session_state.get(flag_name, 0)
-    if isinstance(last, datetime):
-        last = last.timestamp()  # convert datetime to float
-    st.session_state[flag_name] = now
-    return (now - last) < _MIN_NAV_INTERVAL
-
-def navigate_study(direction):
-    """
-    Save annotations for the current patient and switch to the previous or next patient in the list.
-    
-    direction: int, either -1 for previous patient or 1 for next patient
-    """
-    # Prevent rapid navigation
-    if st.session_state.get("saving_annotation", False) or _too_soon("last_clinician_nav"):
-        return
-
-    # Refuse to move forward if annotations are incomplete
-    if not all_annotations_filled():
-        st.session_state.annotation_warning = True
-        refresh_form_complete()  # Ensure form_complete is updated
-        return
-
-    # Set saving flag
-    st.session_state.saving_annotation = True
-
-    try:
-        patient_df = st.session_state.dicom_df[
-            st.session_state.dicom_df["study_icn"] == st.session_state.current_patient_group
-        ]
-        save_all_views_for_patient(
-            patient_df,
-            username=st.session_state.get("username", "unknown"),
-            role=st.session_state.get("role", "Unknown"),
-        )
-        
-        patients = st.session_state.dicom_df["study_icn"].unique()
-        current_idx = list(patients).index(st.session_state.current_patient_group)
-        new_idx = current_idx + direction
-        
-        if 0 <= new_idx < len(patients):
-            st.session_state.current_patient_group = patients[new_idx]
-            st.session_state.view_idx = 0
-            reset_annotation_fields()
-            
-            # Load annotations for the new patient's first view
-            new_patient_df = st.session_state.dicom_df[
-                st.session_state.dicom_df['study_icn'] == st.session_state.current_patient_group
-            ]
-            if not new_patient_df.empty:
-                first_row = new_patient_df.iloc[0]
-                load_annotations_for_image(first_row["image_path"], "Clinician", st.session_state.get("username"))
-            
-            st.session_state.annotation_start_time = datetime.now()
-            refresh_form_complete()  # Refresh form completion status
-
-    finally:
-        st.session_state.saving_annotation = False
-
-# Example usage:
-def previous_study():
-    navigate_study(direction=-1)
-
-def next_study():
-    navigate_study(direction=1)
-
-def previous_view():
-    """
-    Switch to the previous view of the current patient if it exists.
-    """
-    # Prevent rapid navigation
-    if st.session_state.get("saving_annotation", False):
-        return
-
-    if st.session_state.view_idx > 0:
-        # Save current annotations before switching if any are filled
-        current_patient_df = st.session_state.dicom_df[st.session_state.dicom_df['study_icn'] == st.session_state.current_patient_group]
-        current_row = current_patient_df.iloc[st.session_state.view_idx]
-        
-        # Save partial annotations if any fields are filled
-        if any(st.session_state.get(key) is not None for key in [
-            "ards_likelihood", "diffuse_damage", "pleural_lesion", "pulmonary_edema",
-            "consolidation", "atelectasis", "mediastinum_findings", "sufficient_quality", "global_criteria"
-        ]):
-            save_all_views_for_patient(
-                current_patient_df,
-                username=st.session_state.get("username", "unknown"),
-                role=st.session_state.get("role", "Unknown"),
-            )
-        
-        # Switch to previous view
-        st.session_state.view_idx -= 1
-        
-        # Load annotations for the new view
-        new_patient_df = st.session_state.dicom_df[st.session_state.dicom_df['study_icn'] == st.session_state.current_patient_group]
-        new_row = new_patient_df.iloc[st.session_state.view_idx]
-        load_annotations_for_image(new_row["image_path"], "Clinician", st.session_state.get("username"))
-        
-        refresh_form_complete()
-
-def next_view():
-    """
-    Switch to the next view of the current patient if it exists.
-    """
-    # Prevent rapid navigation
-    if st.session_state.get("saving_annotation", False):
-        return
-        
-    # Get the current patient's data
-    patient_df = st.session_state.dicom_df[st.session_state.dicom_df['study_icn'] == st.session_state.current_patient_group]
-    
-    if st.session_state.view_idx < len(patient_df) - 1:
-        # Save current annotations before switching if any are filled
-        current_row = patient_df.iloc[st.session_state.view_idx]
-        
-        # Save partial annotations if any fields are filled
-        if any(st.session_state.get(key) is not None for key in [
-            "ards_likelihood", "diffuse_damage", "pleural_lesion", "pulmonary_edema",
-            "consolidation", "atelectasis", "mediastinum_findings", "sufficient_quality", "global_criteria"
-        ]):
-            save_all_views_for_patient(
-                patient_df,
-                username=st.session_state.get("username", "unknown"),
-                role=st.session_state.get("role", "Unknown"),
-            )
-        
-        # Switch to next view
-        st.session_state.view_idx += 1
-        
-        # Load annotations for the new view
-        new_row = patient_df.iloc[st.session_state.view_idx]
-        load_annotations_for_image(new_row["image_path"], "Clinician", st.session_state.get("username"))
-        
-        refresh_form_complete()
-
-# Define button click handlers
-def on_prev_click():
-    """Handle previous button click for Data Scientist navigation"""
-    # IMMEDIATELY disable buttons on first click to prevent rapid clicking
-    st.session_state.navigating_annotation = True
-    navigate_ds("prev")
-    
-def on_next_click():
-    """Handle next button click for Data Scientist navigation"""
-    # IMMEDIATELY disable buttons on first click to prevent rapid clicking
-    st.session_state.navigating_annotation = True
-    navigate_ds("next")
-
-def navigate_ds(direction):
-    """
-    Navigate Data Scientist's annotations in the specified direction.
-    Fixed version with immediate button disabling and proper state management.
-    """
-    try:
-        # Prevent rapid navigation with time-based throttling
-        if st.session_state.get("saving_annotation", False) or _too_soon("last_ds_nav"):
-            return
-            
-        # Set flag to indicate navigation is in progress
-        st.session_state.navigation_in_progress = True
-
-        idx = st.session_state.get("ds_idx", 0)
-        total = len(st.session_state.dicom_df)
-
-        # Check bounds
-        if (direction == "prev" and idx == 0) or (direction == "next" and idx == total - 1):
-            return
-
-        # Get current image path before navigation for saving
-        current_selected_row = st.session_state.dicom_df.iloc[idx]
-        current_image_path = current_selected_row["image_path"]
-
-        # Save current annotations if they're all filled
-        if all_annotations_filled():
-            st.session_state.saving_annotation = True
-            try:
-                save_all_views_for_patient(
-                    patient_df=None,
-                    username=st.session_state.get("username"),
-                    role=st.session_state.get("role", "Unknown"),
-                    selected_row=current_selected_row
-                )
-            finally:
-                st.session_state.saving_annotation = False
-
-        # Navigate to new index
-        if direction == "next":
-            st.session_state.ds_idx = min(idx + 1, total - 1)
-        else:  # "prev"
-            st.session_state.ds_idx = max(idx - 1, 0)
-
-        # Load annotations for the new image
-        new_idx = st.session_state.ds_idx
-        new_selected_row = st.session_state.dicom_df.iloc[new_idx]
-        
-        # Reset annotation fields first to prevent contamination
-        reset_annotation_fields()
-        
-        # Load existing annotations for the new image
-        load_annotations_for_image(
-            new_selected_row["image_path"], 
-            "Data Scientist", 
-            st.session_state.get("username")
-        )
-        
-        # Refresh form completion state
-        refresh_form_complete()
-        
-        # Reset annotation start time
-        st.session_state.annotation_start_time = datetime.now()
-
-    finally:
-        # Clear navigation flags to re-enable buttons if conditions are met
-        st.session_state.navigation_in_progress = False
-        # Only clear navigating_annotation if no saving is happening and form is complete
-        if not st.session_state.get("saving_annotation", False) and st.session_state.get("form_complete", False):
-            st.session_state.navigating_annotation = False
\ No newline at end of file
+from datetime import datetime
+import numpy as np
+from state import state
+from instrumentation import record_action
+from dicom_index import get_dicom_index
+# --- Annotation utilities ---
+from annotation_utils import (
+    reset_annotation_fields,
+    all_annotations_filled,
+    save_all_views_for_patient,
+    refresh_form_complete,
+    load_annotations_for_image,
+)
+from field_registry import ROLE_FIELDS
+
+def navigate_study(direction):
+    """
+    Save annotations for the current patient and switch to the previous or next patient in the list.
+    
+    direction: int, either -1 for previous patient or 1 for next patient
+
+    Returns True if the study changed.
+    """
+    # Refuse to move forward if annotations are incomplete
+    if not all_annotations_filled():
+        state.annotation_warning = True
+        refresh_form_complete()  # Ensure form_complete is updated
+        return False
+
+    index = get_dicom_index()
+    patient_df = index.study_frame(state.current_patient_group)
+    # Stay on the study if the save failed or conflicted with another tab
+    if not save_all_views_for_patient(
+        patient_df,
+        username=state.get("username", "unknown"),
+        role=state.get("role", "Unknown"),
+    ):
+        return False
+    
+    new_idx = index.study_position(state.current_patient_group) + direction
+    
+    if 0 <= new_idx < index.num_studies:
+        state.current_patient_group = index.studies[new_idx]
+        state.view_idx = 0
+        reset_annotation_fields()
+        
+        # Load annotations for the new patient's first view
+        new_rows = index.study_rows(state.current_patient_group)
+        if len(new_rows):
+            first_row = index.row(new_rows[0])
+            load_annotations_for_image(first_row["image_path"], "Clinician", state.get("username"))
+        
+        state.annotation_start_time = datetime.now()
+        refresh_form_complete()  # Refresh form completion status
+        return True
+    return False
+
+# Example usage:
+def previous_study():
+    return navigate_study(direction=-1)
+
+def next_study():
+    return navigate_study(direction=1)
+
+def previous_view():
+    """
+    Switch to the previous view of the current patient if it exists.
+    """
+    return select_view(state.view_idx - 1)
+
+def next_view():
+    """
+    Switch to the next view of the current patient if it exists.
+    """
+    return select_view(state.view_idx + 1)
+
+def select_view(view_idx):
+    """
+    Switch to a specific view of the current patient, saving the current view first.
+
+    Parameters:
+    - view_idx: Zero-based index of the target view within the current study.
+
+    Returns:
+    True if the view changed.
+    """
+    # Get the current patient's data
+    patient_df = get_dicom_index().study_frame(state.current_patient_group)
+
+    if not (0 <= view_idx < len(patient_df)) or view_idx == state.view_idx:
+        return False
+
+    # Save partial annotations if any fields are filled
+    if ROLE_FIELDS["Clinician"].any_filled(state):
+        if not save_all_views_for_patient(
+            patient_df,
+            username=state.get("username", "unknown"),
+            role=state.get("role", "Unknown"),
+        ):
+            return False
+
+    # Switch view
+    state.view_idx = view_idx
+
+    # Load annotations for the new view
+    new_row = patient_df.iloc[state.view_idx]
+    load_annotations_for_image(new_row["image_path"], "Clinician", state.get("username"))
+
+    refresh_form_complete()
+    return True
+
+def navigate_ds(direction):
+    """
+    Navigate Data Scientist's annotations in the specified direction.
+
+    Returns True if the image changed; an incomplete form is refused with a warning.
+    """
+    index = get_dicom_index()
+    idx = state.get("ds_idx", 0)
+    total = len(index)
+
+    # Check bounds
+    if (direction == "prev" and idx == 0) or (direction == "next" and idx == total - 1):
+        return False
+
+    # Refuse to leave the image until every field is filled
+    if not all_annotations_filled():
+        state.annotation_warning = True
+        refresh_form_complete()
+        return False
+
+    # Save the current image's annotations before moving; stay if that failed or conflicted
+    if not save_all_views_for_patient(
+        patient_df=None,
+        username=state.get("username"),
+        role=state.get("role", "Unknown"),
+        selected_row=index.row(idx)
+    ):
+        return False
+
+    # Navigate to new index
+    if direction == "next":
+        state.ds_idx = min(idx + 1, total - 1)
+    else:  # "prev"
+        state.ds_idx = max(idx - 1, 0)
+
+    # Load annotations for the new image
+    new_selected_row = index.row(state.ds_idx)
+    
+    # Reset annotation fields first to prevent contamination
+    reset_annotation_fields()
+    
+    # Load existing annotations for the new image
+    load_annotations_for_image(
+        new_selected_row["image_path"], 
+        "Data Scientist", 
+        state.get("username")
+    )
+    
+    # Refresh form completion state
+    refresh_form_complete()
+    
+    # Reset annotation start time
+    state.annotation_start_time = datetime.now()
+    return True
+
+def jump_to(row_pos):
+    """
+    Jump straight to a row of the index (search results), for either role.
+
+    Annotations entered for the current image are saved first, like switching views; an
+    incomplete form does not block the jump, since every radio change is already saved.
+    The target's saved annotations are then loaded exactly as on any other navigation.
+
+    Parameters:
+    - row_pos: Row position in the shared DicomIndex.
+
+    Returns:
+    True if the current image changed.
+    """
+    index = get_dicom_index()
+    if not (0 <= row_pos < len(index)):
+        return False
+    role = state.get("role", "Unknown")
+    username = state.get("username")
+    target = index.row(row_pos)
+    fields = ROLE_FIELDS["Clinician" if role == "Clinician" else "Data Scientist"]
+    filled = fields.any_filled(state)
+
+    if role == "Clinician":
+        study = target["study_icn"]
+        rows = index.study_rows(study)
+        view_idx = int(np.flatnonzero(rows == row_pos)[0])
+        if study == state.get("current_patient_group") and view_idx == state.get("view_idx"):
+            return False
+        if filled and state.get("current_patient_group") is not None:
+            if not save_all_views_for_patient(
+                index.study_frame(state.current_patient_group),
+                username=username,
+                role=role,
+            ):
+                return False
+        state.current_patient_group = study
+        state.view_idx = view_idx
+    elif role == "Data Scientist":
+        if row_pos == state.get("ds_idx"):
+            return False
+        if filled and state.get("ds_idx") is not None:
+            if not save_all_views_for_patient(
+                patient_df=None,
+                username=username,
+                role=role,
+                selected_row=index.row(state.ds_idx),
+            ):
+                return False
+        state.ds_idx = row_pos
+    else:
+        return False
+
+    reset_annotation_fields()
+    load_annotations_for_image(target["image_path"], role, username)
+    refresh_form_complete()
+    state.annotation_start_time = datetime.now()
+    return True
+
+# --- Navigation engine ---
+# Every navigation button uses `dispatch` as its on_click callback. Streamlit runs the
+# callback before the script, so each click costs exactly one script run, which renders
+# the state the action produced; nothing in the navigation path calls st.rerun().
+#
+# Buttons are tagged with the session's navigation sequence number at render time
+# (`nav_seq`), which goes up by one every time an action moves the cursor. A click tagged
+# with an older number was aimed at a cursor position that no longer exists (a double
+# click, or a click on a page rendered before the last move) and is dropped, so no
+# wall-clock throttle is needed and fast deliberate clicks are all applied.
+NAV_ACTIONS = {
+    "previous_study": previous_study,
+    "next_study": next_study,
+    "previous_view": previous_view,
+    "next_view": next_view,
+    "select_view": select_view,
+    "previous_image": lambda: navigate_ds("prev"),
+    "next_image": lambda: navigate_ds("next"),
+    "jump_to": jump_to,
+}
+
+def nav_seq():
+    """
+    Return the session's navigation sequence number, to tag navigation buttons with.
+    """
+    return state.get("nav_seq", 0)
+
+def dispatch(action, seq=None, *args):
+    """
+    Apply a navigation action; the on_click entry point for every navigation button.
+
+    Parameters:
+    - action: Name of an action in NAV_ACTIONS.
+    - seq: `nav_seq()` when the button was rendered. Actions tagged with an older number
+      are duplicates and are ignored; None applies the action unconditionally.
+    - args: Extra arguments for the action (e.g. the view index for "select_view").
+
+    Returns:
+    True if the action changed the current image, False if it was refused (incomplete
+    form, out of bounds) or dropped as a duplicate.
+    """
+    if seq is not None and seq != nav_seq():
+        record_action(action, duplicate=True)
+        return False
+    record_action(action)
+    changed = bool(NAV_ACTIONS[action](*args))
+    if changed:
+        state.nav_seq = nav_seq() + 1
+    return changed
@@ -0,0 +1,207 @@
+import multiprocessing
+import struct
+import threading
+from contextlib import contextmanager
+
+import numpy as np
+import pydicom
+from pydicom.pixels import pixel_array as decode_pixel_array
+
+from config import LARGE_DECODE_BYTES, LARGE_DECODE_SLOTS, LARGE_DECODE_TIMEOUT, MAX_DECODE_BYTES
+
+# Decodes of frames larger than LARGE_DECODE_BYTES take one of these slots, so a handful of
+# huge digitized films cannot exhaust server memory for every session at once. The
+# semaphore is created in the app process and handed to every decode pool worker (see
+# use_large_decode_slots), so the limit covers the app and all its workers together.
+_large_decode_slots = None
+_large_decode_slots_lock = threading.Lock()
+
+_PIXEL_DATA_TAG = (0x7FE0, 0x0010)
+
+
+class DecodeBusyError(RuntimeError):
+    """Raised when no large-decode slot became free within LARGE_DECODE_TIMEOUT seconds."""
+
+
+def large_decode_slots():
+    """
+    Return the process-shared large-decode semaphore, creating it on first use.
+    """
+    global _large_decode_slots
+    if _large_decode_slots is None:
+        with _large_decode_slots_lock:
+            if _large_decode_slots is None:
+                _large_decode_slots = multiprocessing.BoundedSemaphore(max(1, LARGE_DECODE_SLOTS))
+    return _large_decode_slots
+
+
+def use_large_decode_slots(slots):
+    """
+    Decode worker initializer: take the large-decode slots from the app process instead
+    of creating a separate set in the worker.
+
+    Parameters:
+    - slots: Semaphore returned by `large_decode_slots` in the app process.
+    """
+    global _large_decode_slots
+    _large_decode_slots = slots
+
+
+def read_header(filepath):
+    """
+    Read a DICOM header without touching the pixel data.
+
+    Parameters:
+    - filepath: Path to the DICOM file.
+
+    Returns:
+    A pydicom Dataset without PixelData.
+    """
+    return pydicom.dcmread(filepath, stop_before_pixels=True)
+
+
+def num_frames(ds):
+    """
+    Return the number of frames described by a DICOM header (1 for single-frame objects).
+    """
+    try:
+        return max(1, int(ds.get("NumberOfFrames", 1) or 1))
+    except (TypeError, ValueError):
+        return 1
+
+
+def frame_nbytes(ds):
+    """
+    Estimate the decoded size in bytes of a single frame.
+    """
+    rows = int(ds.get("Rows", 0))
+    cols = int(ds.get("Columns", 0))
+    samples = int(ds.get("SamplesPerPixel", 1))
+    bits = int(ds.get("BitsAllocated", 16))
+    return rows * cols * samples * max(bits // 8, 1)
+
+
+def _native_pixel_offset(filepath, ds):
+    """
+    Locate the start of native (uncompressed) pixel data in the file.
+
+    Returns:
+    The byte offset of the first pixel value, or None if the pixel data is encapsulated,
+    of undefined length, or the element cannot be located.
+    """
+    ts = ds.file_meta.TransferSyntaxUID
+    if ts.is_compressed or ts.is_deflated:
+        return None
+    endian = "<" if ts.is_little_endian else ">"
+    with open(filepath, "rb") as fp:
+        pydicom.dcmread(fp, stop_before_pixels=True)
+        # dcmread rewinds to the start of the PixelData element it stopped at
+        start = fp.tell()
+        head = fp.read(12)
+    if len(head) < 8 or struct.unpack(endian + "HH", head[:4]) != _PIXEL_DATA_TAG:
+        return None
+    if ts.is_implicit_VR:
+        length = struct.unpack(endian + "L", head[4:8])[0]
+        value_offset = start + 8
+    else:
+        if len(head) < 12:
+            return None
+        length = struct.unpack(endian + "L", head[8:12])[0]
+        value_offset = start + 12
+    if length == 0xFFFFFFFF:
+        return None
+    return value_offset
+
+
+def _native_frames(filepath, ds):
+    """
+    Memory-map the native pixel data as a (frames, rows, cols) array, or return None if the
+    layout is not one that can be mapped directly.
+    """
+    bits = int(ds.get("BitsAllocated", 0))
+    signed = int(ds.get("PixelRepresentation", 0)) == 1
+    if bits not in (8, 16) or int(ds.get("SamplesPerPixel", 1)) != 1:
+        return None
+    # Signed values with unused high bits need sign extension, which a raw map can't do
+    if signed and int(ds.get("BitsStored", bits)) != bits:
+        return None
+    offset = _native_pixel_offset(filepath, ds)
+    if offset is None:
+        return None
+    endian = "<" if ds.file_meta.TransferSyntaxUID.is_little_endian else ">"
+    dtype = np.dtype(f"{endian}{'i' if signed else 'u'}{bits // 8}")
+    shape = (num_frames(ds), int(ds.Rows), int(ds.Columns))
+    return np.memmap(filepath, dtype=dtype, mode="r", offset=offset, shape=shape)
+
+
+@contextmanager
+def decode_slot(ds):
+    """
+    Context manager bounding concurrent work on large frames.
+
+    Frames up to LARGE_DECODE_BYTES pass straight through. Larger ones wait for one of the
+    LARGE_DECODE_SLOTS slots shared by the app process and every decode worker, and frames
+    over MAX_DECODE_BYTES are refused.
+
+    Parameters:
+    - ds: DICOM header of the image about to be decoded.
+    """
+    nbytes = frame_nbytes(ds)
+    if nbytes > MAX_DECODE_BYTES:
+        raise MemoryError(
+            f"Frame of {nbytes / 1e6:.0f} MB exceeds the {MAX_DECODE_BYTES / 1e6:.0f} MB decode limit"
+        )
+    if nbytes <= LARGE_DECODE_BYTES:
+        yield
+        return
+    slots = large_decode_slots()
+    if not slots.acquire(timeout=LARGE_DECODE_TIMEOUT):
+        raise DecodeBusyError("The server is busy decoding other large images; please retry.")
+    try:
+        yield
+    finally:
+        slots.release()
+
+
+def read_frame(filepath, frame=0, region=None, ds=None, bounded=True):
+    """
+    Decode a single frame of a DICOM file, optionally restricted to a region.
+
+    Native (uncompressed) pixel data is memory-mapped, so only the requested frame and
+    rows are read from disk. Compressed data is decoded one frame at a time by pydicom;
+    JPEG/JPEG 2000 decoders cannot decode a sub-region, so the region is cropped after
+    decoding the frame. Frames larger than LARGE_DECODE_BYTES are decoded through a small
+    pool of slots shared by all sessions and decode workers.
+
+    Parameters:
+    - filepath: Path to the DICOM file.
+    - frame: Zero-based frame index.
+    - region: Optional (row_start, row_stop, col_start, col_stop) crop.
+    - ds: Header from `read_header` (read if not given).
+    - bounded: Take a `decode_slot` for large compressed frames. Pass False when the
+      caller already holds one.
+
+    Returns:
+    A 2D numpy array of stored pixel values (read-only memory map for native data).
+    """
+    if ds is None:
+        ds = read_header(filepath)
+    n = num_frames(ds)
+    if not (0 <= frame < n):
+        raise IndexError(f"Frame {frame} out of range for {n}-frame image")
+
+    rows = slice(None) if region is None else slice(region[0], region[1])
+    cols = slice(None) if region is None else slice(region[2], region[3])
+
+    native = _native_frames(filepath, ds)
+    if native is not None:
+        return native[frame, rows, cols]
+
+    if bounded:
+        with decode_slot(ds):
+            arr = decode_pixel_array(filepath, index=frame)
+    else:
+        arr = decode_pixel_array(filepath, index=frame)
+    if region is not None:
+        arr = np.ascontiguousarray(arr[rows, cols])
+    return arr
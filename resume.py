@@ -0,0 +1,140 @@
+from datetime import datetime
+
+import numpy as np
+import pyarrow as pa
+import pyarrow.compute as pc
+
+from annotation_schema import read_table
+from annotation_store import annotation_files
+from annotation_utils import load_annotations_for_image
+from config import ANNOTATION_DIR
+from field_registry import ROLE_FIELDS
+from state import state
+
+def _read_records(path, columns, role):
+    """
+    Read the given columns of one annotation file as a typed Arrow table (missing columns
+    are filled with nulls), or None if the file cannot be read.
+    """
+    try:
+        return read_table(path, columns, role)
+    except (OSError, pa.ArrowInvalid):
+        return None
+
+
+def completed_images(username, role, annotation_dir=ANNOTATION_DIR):
+    """
+    Return the image paths the user has fully annotated, across all of their annotation files.
+
+    The latest record of each image (by timestamp) decides: an image is complete when that
+    record has a value for every annotation field of the role.
+
+    Parameters:
+    - username: Annotator.
+    - role: "Clinician" or "Data Scientist".
+    - annotation_dir: Directory holding the daily annotation files.
+
+    Returns:
+    A NumPy array of image paths (object dtype, unique).
+    """
+    username_col, timestamp_col = ROLE_FIELDS[role].username_col, ROLE_FIELDS[role].timestamp_col
+    fields = list(ROLE_FIELDS[role].columns)
+    columns = ["image_path", username_col, timestamp_col] + fields
+    files = annotation_files(username, role, annotation_dir)
+    tables = [t for t in (_read_records(p, columns, role) for p in files) if t is not None]
+    if not tables:
+        return np.array([], dtype=object)
+    table = pa.concat_tables(tables)
+    table = table.filter(pc.equal(table[username_col], username))
+    if len(table) == 0:
+        return np.array([], dtype=object)
+
+    # Completeness is evaluated in Arrow, so only three columns are converted to pandas
+    complete = pc.is_valid(table[fields[0]])
+    for field in fields[1:]:
+        complete = pc.and_(complete, pc.is_valid(table[field]))
+    records = pa.table({
+        "image_path": table["image_path"],
+        "timestamp": table[timestamp_col],
+        "complete": complete,
+    }).to_pandas()
+    # Files are concatenated oldest first, so a stable sort keeps the newest file's record
+    # last among equal timestamps.
+    records = records.sort_values("timestamp", kind="stable").drop_duplicates("image_path", keep="last")
+    return records["image_path"].to_numpy(dtype=object)[records["complete"].to_numpy()]
+
+
+def incomplete_mask(dicom_index, username, role, annotation_dir=ANNOTATION_DIR):
+    """
+    Anti-join of the index against the user's completed images.
+
+    Returns:
+    A boolean array with one entry per index row, True where the image still needs work.
+    """
+    done = completed_images(username, role, annotation_dir)
+    paths = dicom_index.frame["image_path"]
+    if len(done) == 0:
+        return np.ones(len(paths), dtype=bool)
+    return ~paths.isin(done).to_numpy()
+
+
+def resume_position(dicom_index, username, role, annotation_dir=ANNOTATION_DIR):
+    """
+    Find where a user should resume: the first item of their queue that is not finished.
+
+    Data scientists work image by image, so this is the first incomplete row. Clinicians
+    annotate whole studies, so this is the first study with an incomplete view, and the
+    first such view within it.
+
+    Parameters:
+    - dicom_index: The shared DicomIndex.
+    - username: Annotator.
+    - role: "Clinician" or "Data Scientist".
+    - annotation_dir: Directory holding the daily annotation files.
+
+    Returns:
+    For data scientists, the row position (ds_idx). For clinicians, a tuple
+    (study_icn, view_idx). None if every item is finished.
+    """
+    todo = incomplete_mask(dicom_index, username, role, annotation_dir)
+    rows = np.flatnonzero(todo)
+    if len(rows) == 0:
+        return None
+    if role == "Data Scientist":
+        return int(rows[0])
+
+    # study_codes number the studies in index order, so the smallest code is the first study
+    codes = dicom_index.study_codes[rows]
+    codes = codes[codes >= 0]       # rows without a study_icn
+    if len(codes) == 0:
+        return None
+    code = int(codes.min())
+    study = dicom_index.studies[code]
+    view_idx = int(np.flatnonzero(todo[dicom_index.study_rows(study)])[0])
+    return study, view_idx
+
+
+def resume_session(dicom_index, username, role, annotation_dir=ANNOTATION_DIR):
+    """
+    Place a freshly logged-in session's cursor on the first unfinished item (see
+    `resume_position`), or on the first item if everything is finished. Sessions that
+    already have a cursor are left alone.
+
+    Returns:
+    True if the cursor was placed.
+    """
+    cursor_key = "current_patient_group" if role == "Clinician" else "ds_idx"
+    if cursor_key in state or role not in ROLE_FIELDS or len(dicom_index) == 0:
+        return False
+    position = resume_position(dicom_index, username, role, annotation_dir)
+    if role == "Clinician":
+        study, view_idx = position if position is not None else (dicom_index.studies[0], 0)
+        state.current_patient_group = study
+        state.view_idx = view_idx
+        # Partially annotated views show their saved values
+        row = dicom_index.row(dicom_index.study_rows(study)[view_idx])
+        load_annotations_for_image(row["image_path"], role, username)
+    else:
+        state.ds_idx = position if position is not None else 0
+    state.annotation_start_time = datetime.now()
+    return True
@@ -1,229 +1,392 @@
-import streamlit as st
-from sidebar_utils import (
-    render_window_controls,
-    render_dicom_metadata,
-    render_clinical_info_placeholder,
-    reinitialize_window_state,
-)
-from dicom_utils import display_dicom
-from annotation_utils import render_radio_fields, CLINICIAN_RADIOS, DATA_SCIENTIST_RADIOS,all_annotations_filled, refresh_form_complete,load_annotations_for_image
-from navigation import previous_view, next_view, previous_study, next_study, on_prev_click, on_next_click, _too_soon
-from datetime import datetime
-
-def render_role_interface(role, dicom_df, selected_row, username):
-    """
-    Render the user interface based on the user's role, DICOM data, and selected row.
-
-    This function:
-    - Displays the DICOM navigator, header, window controls, and metadata.
-    - Provides navigation controls for Clinicians and Data Scientists.
-    - Displays the DICOM image with windowing controls.
-    - Renders annotation fields based on the user's role.
-    
-    Parameters:
-    - role: User's role ("Clinician" or "Data Scientist").
-    - dicom_df: DataFrame containing DICOM information.
-    - selected_row: The currently selected row in the DICOM data.
-    """
-
-    if st.session_state.get("trigger_rerun", False):
-        st.session_state.trigger_rerun = False
-        st.rerun()
-
-    if "form_complete" not in st.session_state:
-        refresh_form_complete()
-    
-    if role == "Data Scientist":
-        if "ds_idx" not in st.session_state:
-            st.session_state.ds_idx = 0
-        ds_idx = st.session_state.ds_idx
-        selected_row = dicom_df.iloc[ds_idx]
-    # Columns layout
-    dicom_navigator, annotations = st.columns([5, 2])
-
-    with dicom_navigator:
-        st.title(f"DICOM Navigator ({role})[{username}]")
-        display_dicom_header(selected_row)
-
-        reinitialize_window_state(selected_row["image_path"])
-
-        with st.sidebar:
-            render_window_controls()
-
-            tabs = st.tabs(["Clinical Info", "DICOM Metadata"])
-            with tabs[0]:
-                render_clinical_info_placeholder()
-
-            with tabs[1]:
-                render_dicom_metadata(selected_row)
-            
-        if role == "Clinician":
-            # Patient navigation (ABOVE image)
-            patients = dicom_df['study_icn'].unique()
-            current_patient_index = list(patients).index(st.session_state.current_patient_group)
-            num_patients = len(patients)
-
-            saving = st.session_state.get("saving_annotation", False)
-            complete = st.session_state.get("form_complete", False)
-            
-            col1, col2, col3 = st.columns([1, 3, 1])
-            with col1:
-                if st.button("⬅️ Previous Study", disabled=saving or not complete, on_click=previous_study):
-                    st.rerun()
-
-            with col2:
-                st.markdown(
-                    f"<div style='text-align:left; font-weight:bold;'>Study {current_patient_index + 1} / {num_patients}</div>",
-                    unsafe_allow_html=True
-                )
-
-            with col3:
-                if st.button("➡️ Next Study",disabled=saving or not complete, on_click=next_study, key="btn_next_study",):
-                    if st.session_state.get("annotation_warning") or all_annotations_filled():
-                        st.rerun()
-                    else:
-                        st.session_state.annotation_warning = True
-
-        if role == "Data Scientist":
-            # initialize and pick the current row
-            if "ds_idx" not in st.session_state:
-                st.session_state.ds_idx = 0
-            ds_idx = st.session_state.ds_idx
-            selected_row = dicom_df.iloc[ds_idx]
-
-            # Load annotations for current image (this was missing!)
-            load_annotations_for_image(
-                selected_row["image_path"], 
-                "Data Scientist", 
-                st.session_state.get("username")
-            )
-
-            # immediately recompute form completeness for the current image
-            refresh_form_complete()
-
-            # navigation state - CRITICAL: buttons must be disabled immediately after click
-            saving = st.session_state.get("saving_annotation", False)
-            navigating = st.session_state.get("navigating_annotation", False)
-            navigation_in_progress = st.session_state.get("navigation_in_progress", False)
-            complete = st.session_state.get("form_complete", False)
-
-            total = len(dicom_df)
-            col1, col2, col3 = st.columns([1, 3, 1])
-
-            with col1:
-                # Disable if ANY of these conditions are true:
-                # - Currently saving annotations
-                # - Navigation flag is set (immediately after button click)
-                # - Navigation is in progress
-                # - Form is incomplete
-                # - At beginning of dataset
-                prev_disabled = (saving or navigating or navigation_in_progress or 
-                               not complete or ds_idx == 0)
-                st.button(
-                    "⬅️ Previous Image",
-                    disabled=prev_disabled,
-                    on_click=on_prev_click,
-                    key="btn_prev_ds"
-                )
-
-            with col2:
-                st.markdown(
-                    f"<div style='text-align:center;'><strong>Record {ds_idx+1} / {total}</strong></div>",
-                    unsafe_allow_html=True
-                )
-
-            with col3:
-                # Disable if ANY of these conditions are true:
-                # - Currently saving annotations
-                # - Navigation flag is set (immediately after button click)
-                # - Navigation is in progress
-                # - Form is incomplete
-                # - At end of dataset
-                next_disabled = (saving or navigating or navigation_in_progress or 
-                               not complete or ds_idx >= total - 1)
-                st.button(
-                    "➡️ Next Image",
-                    disabled=next_disabled,
-                    on_click=on_next_click,
-                    key="btn_next_ds"
-                )
-
-        # Display DICOM (shared)
-        display_dicom(
-            selected_row["image_path"],
-            downsample_factor=4,
-            window_center=st.session_state.wc_val,
-            window_width=st.session_state.ww_val,
-        )
-
-        if "form_complete" not in st.session_state:
-            refresh_form_complete()
-            
-        if role == "Clinician":
-            # View navigation (BELOW image)
-            num_views = len(dicom_df[dicom_df['study_icn'] == st.session_state.current_patient_group])
-            view_idx = st.session_state.get("view_idx", 0)
-            col5, col6, col7 = st.columns([1, 3, 1])
-            with col5:
-                if st.button("⬅️ Previous View"):
-                    previous_view()
-                    st.rerun()
-
-            with col6:
-                st.markdown(
-                    f"<div style='text-align:center; font-weight:bold;'>View {view_idx + 1} / {num_views}</div>",
-                    unsafe_allow_html=True
-                )
-
-            with col7:
-                if st.button("➡️ Next View"):
-                    next_view()
-                    st.rerun()
-
-    with annotations:
-        st.title("Annotations")
-
-        if role == "Clinician":
-            render_radio_fields(CLINICIAN_RADIOS, selected_row["image_path"], role, username)
-        elif role == "Data Scientist":
-            render_radio_fields(DATA_SCIENTIST_RADIOS, selected_row["image_path"], role, username)
-
-        # ✅ Trigger rerun if form just became complete
-        if st.session_state.get("form_complete", False) and not st.session_state.get("trigger_rerun", False):
-            st.session_state.trigger_rerun = True
-
-        render_annotation_feedback()
-
-def display_dicom_header(row):
-    """
-    Display the header information of the currently selected DICOM file.
-
-    This function shows the patient information, view folder, and file information in a centered format.
-
-    Parameters:
-    - row: The currently selected row in the DICOM data containing header information.
-    """
-    st.markdown(
-        f"""
-        <div style='text-align:center; font-size:14px;'>
-            <strong>Study:</strong> {row.get('study_icn')} &nbsp; | &nbsp;
-            <strong>View folder:</strong> {row.get('study_icn')} &nbsp; | &nbsp;
-            <strong>File:</strong> {row.get('dicom_id')}
-        </div>
-        """,
-        unsafe_allow_html=True
-    )
-
-def render_annotation_feedback():
-    """
-    Render feedback messages based on the current annotation status.
-
-    This function displays warnings if not all annotation fields are filled and 
-    shows success messages if annotations are saved.
-    """
-    if st.session_state.get("annotation_warning"):
-        st.warning("⚠️ Please complete **all annotation fields** before navigating to another patient.")
-    if st.session_state.get("annotation_saved"):
-        st.success("✅ Annotation Saved!")
-        st.session_state.annotation_saved = False
+import streamlit as st
+from sidebar_utils import (
+    render_window_controls,
+    render_dicom_metadata,
+    render_clinical_info_placeholder,
+    reinitialize_window_state,
+    finalize_window_state,
+)
+from dicom_utils import display_dicom, DEFAULT_DOWNSAMPLE
+from dicom_viewer import dicom_viewer, deep_zoom_viewer, viewer_image_id
+from tile_server import register_image
+from callbacks import apply_client_window
+from config import CLIENT_WINDOWING, PROGRESSIVE_IMAGE_PANEL, PROGRESSIVE_POLL_SECONDS
+from decode_pool import get_decode_pool
+from annotation_utils import render_radio_fields, refresh_form_complete,load_annotations_for_image
+from field_registry import ROLE_FIELDS
+from navigation import dispatch, nav_seq
+from study_loader import prefetch_study, wait_for_study, get_thumbnail, ensure_decoding
+from datetime import datetime
+from functools import partial
+from instrumentation import record_run, render_rerun_stats
+
+def render_role_interface(role, dicom_index, selected_row, username):
+    """
+    Render the user interface based on the user's role, DICOM data, and selected row.
+
+    This function:
+    - Displays the DICOM navigator, header, window controls, and metadata.
+    - Provides navigation controls for Clinicians and Data Scientists.
+    - Displays the DICOM image with windowing controls.
+    - Renders annotation fields based on the user's role.
+    
+    Parameters:
+    - role: User's role ("Clinician" or "Data Scientist").
+    - dicom_index: The shared DicomIndex (read-only).
+    - selected_row: The currently selected row in the DICOM data.
+    """
+
+    if "form_complete" not in st.session_state:
+        refresh_form_complete()
+    
+    if role == "Data Scientist":
+        if "ds_idx" not in st.session_state:
+            st.session_state.ds_idx = 0
+        ds_idx = st.session_state.ds_idx
+        selected_row = dicom_index.row(ds_idx)
+    # Columns layout
+    dicom_navigator, annotations = st.columns([5, 2])
+
+    with dicom_navigator:
+        st.title(f"DICOM Navigator ({role})[{username}]")
+        display_dicom_header(selected_row)
+
+        reinitialize_window_state(selected_row["image_path"], wait=not progressive_panel_enabled())
+
+        with st.sidebar:
+            render_jump_search(dicom_index)
+            render_sidebar_tabs(selected_row)
+            render_rerun_stats()
+
+        # Navigation stays in the full-page run: changing the image changes what every
+        # fragment shows, so a navigation fragment would have to rerun the whole page anyway.
+        # Buttons carry the navigation sequence number they were rendered with, so a
+        # double click is applied once (see navigation.dispatch).
+        seq = nav_seq()
+        if role == "Clinician":
+            # Patient navigation (ABOVE image)
+            current_patient_index = dicom_index.study_position(st.session_state.current_patient_group)
+            num_patients = dicom_index.num_studies
+
+            # Navigation runs in on_click callbacks only, so a click is exactly one script run.
+            # Incomplete forms are refused by the engine with a warning, not by disabling.
+            col1, col2, col3 = st.columns([1, 3, 1])
+            with col1:
+                st.button("⬅️ Previous Study", on_click=dispatch, args=("previous_study", seq), key="btn_prev_study")
+
+            with col2:
+                st.markdown(
+                    f"<div style='text-align:left; font-weight:bold;'>Study {current_patient_index + 1} / {num_patients}</div>",
+                    unsafe_allow_html=True
+                )
+
+            with col3:
+                st.button("➡️ Next Study", on_click=dispatch, args=("next_study", seq), key="btn_next_study")
+
+        if role == "Data Scientist":
+            # initialize and pick the current row
+            if "ds_idx" not in st.session_state:
+                st.session_state.ds_idx = 0
+            ds_idx = st.session_state.ds_idx
+            selected_row = dicom_index.row(ds_idx)
+
+            # Load annotations for current image (this was missing!)
+            load_annotations_for_image(
+                selected_row["image_path"], 
+                "Data Scientist", 
+                st.session_state.get("username")
+            )
+
+            # immediately recompute form completeness for the current image
+            refresh_form_complete()
+
+            total = len(dicom_index)
+            col1, col2, col3 = st.columns([1, 3, 1])
+
+            with col1:
+                st.button(
+                    "⬅️ Previous Image",
+                    disabled=ds_idx == 0,
+                    on_click=dispatch,
+                    args=("previous_image", seq),
+                    key="btn_prev_ds"
+                )
+
+            with col2:
+                st.markdown(
+                    f"<div style='text-align:center;'><strong>Record {ds_idx+1} / {total}</strong></div>",
+                    unsafe_allow_html=True
+                )
+
+            with col3:
+                st.button(
+                    "➡️ Next Image",
+                    disabled=ds_idx >= total - 1,
+                    on_click=dispatch,
+                    args=("next_image", seq),
+                    key="btn_next_ds"
+                )
+
+        if role == "Clinician":
+            # Decode every view of the study in parallel; only wait for the one on screen
+            study_paths = dicom_index.study_paths(st.session_state.current_patient_group)
+        else:
+            study_paths = [selected_row["image_path"]]
+        prefetch_study(study_paths)
+        if not progressive_panel_enabled():
+            wait_for_study([selected_row["image_path"]])
+
+        # Display DICOM (shared)
+        render_image_panel(selected_row["image_path"])
+
+        if "form_complete" not in st.session_state:
+            refresh_form_complete()
+            
+        if role == "Clinician":
+            # View navigation (BELOW image)
+            num_views = len(study_paths)
+            view_idx = st.session_state.get("view_idx", 0)
+            col5, col6, col7 = st.columns([1, 3, 1])
+            with col5:
+                st.button("⬅️ Previous View", on_click=dispatch, args=("previous_view", seq), key="btn_prev_view")
+
+            with col6:
+                st.markdown(
+                    f"<div style='text-align:center; font-weight:bold;'>View {view_idx + 1} / {num_views}</div>",
+                    unsafe_allow_html=True
+                )
+
+            with col7:
+                st.button("➡️ Next View", on_click=dispatch, args=("next_view", seq), key="btn_next_view")
+
+            render_view_thumbnails(study_paths, view_idx)
+
+    with annotations:
+        st.title("Annotations")
+        render_annotation_form(role, selected_row["image_path"], username)
+
+def render_jump_search(dicom_index, limit=8):
+    """
+    Render the jump-to search box: exact and prefix matches on dicom_id, study_icn and
+    subject_icn, each a button that jumps to the match's first image.
+
+    Parameters:
+    - dicom_index: The shared DicomIndex.
+    - limit: Maximum number of matches shown.
+    """
+    query = st.text_input(
+        "Jump to",
+        key="jump_query",
+        placeholder="dicom_id, study_icn or subject_icn",
+    )
+    if not query:
+        return
+    matches = dicom_index.search(query, limit=limit)
+    if not matches:
+        st.caption("No matching image.")
+        return
+    seq = nav_seq()
+    for column, key, row, count in matches:
+        label = f"{column}: {key}" + (f" ({count} images)" if count > 1 else "")
+        st.button(
+            label,
+            on_click=dispatch,
+            args=("jump_to", seq, row),
+            key=f"jump_{column}_{key}",
+            use_container_width=True,
+        )
+
+@st.fragment
+def render_sidebar_tabs(row):
+    """
+    Render the clinical info and DICOM metadata tabs in the sidebar as a fragment.
+
+    Parameters:
+    - row: The currently selected row in the DICOM data.
+    """
+    record_run("sidebar_tabs")
+    tabs = st.tabs(["Clinical Info", "DICOM Metadata"])
+    with tabs[0]:
+        render_clinical_info_placeholder()
+
+    with tabs[1]:
+        render_dicom_metadata(row)
+
+@st.fragment
+def render_annotation_form(role, image_path, username):
+    """
+    Render the annotation radios as a fragment, so a click only reruns the form.
+
+    Parameters:
+    - role: User's role ("Clinician" or "Data Scientist").
+    - image_path: Path of the image being annotated.
+    - username: Annotator's username.
+    """
+    record_run("annotation_form")
+
+    if role in ROLE_FIELDS:
+        render_radio_fields(ROLE_FIELDS[role].radios, image_path, role, username)
+
+    render_annotation_feedback()
+
+def progressive_panel_enabled():
+    """
+    Return True if the image panel loads progressively (needs the decode process pool).
+    """
+    return PROGRESSIVE_IMAGE_PANEL and get_decode_pool() is not None
+
+def render_image_panel(image_path):
+    """
+    Render the image panel as a fragment, so its widgets only rerun the panel.
+
+    While the image is still being decoded, the panel shows the study thumbnail and polls
+    every PROGRESSIVE_POLL_SECONDS; when the decode finishes, the full image is swapped in
+    by a fragment run and the annotation column stays interactive throughout. Polling
+    stops at the next full-page run.
+
+    Parameters:
+    - image_path: Path of the image on screen.
+    """
+    frame = st.session_state.get("frame_idx", 0) if st.session_state.get("num_frames", 1) > 1 else 0
+    if progressive_panel_enabled() and not ensure_decoding(image_path, *_panel_decode(st.session_state.get("deep_zoom"), frame)):
+        _loading_image_panel(image_path)
+    else:
+        _image_panel(image_path)
+
+def _panel_decode(deep_zoom, frame):
+    """
+    Return the (downsample_factor, frame) the image panel displays: the full-resolution
+    first frame the tile server cuts tiles from in deep zoom, else the downsampled frame.
+    """
+    return (1, 0) if deep_zoom else (DEFAULT_DOWNSAMPLE, frame)
+
+@st.fragment
+def _image_panel(image_path):
+    record_run("image_panel")
+    _render_image_panel_body(image_path, progressive=False)
+
+@st.fragment(run_every=PROGRESSIVE_POLL_SECONDS)
+def _loading_image_panel(image_path):
+    record_run("image_panel", polled=True)
+    _render_image_panel_body(image_path, progressive=True)
+
+def _render_image_panel_body(image_path, progressive):
+    # Multi-frame objects: only the selected frame is decoded
+    frame = 0
+    if st.session_state.get("num_frames", 1) > 1:
+        frame = st.slider("Frame", 0, st.session_state.num_frames - 1, key="frame_idx")
+
+    deep_zoom = st.toggle("🔍 Full resolution", key="deep_zoom", help="Tiled viewer for inspecting fine details at full resolution")
+
+    # Window controls live in this fragment (fragments cannot draw into the sidebar), so a
+    # window change reruns only the panel. The decoded window replaces a provisional one
+    # here, before the slider is drawn.
+    finalize_window_state(image_path, sync_slider=True)
+    render_window_controls()
+
+    # Only the polling variant can show a placeholder; the other one waits for the decode
+    if progressive and not ensure_decoding(image_path, *_panel_decode(deep_zoom, frame)):
+        thumb = get_thumbnail(image_path)
+        if thumb is not None:
+            st.image(thumb, caption="Loading full resolution...", use_container_width=True)
+        else:
+            st.info("⏳ Loading image...")
+        return
+
+    if deep_zoom:
+        tile_id = register_image(image_path)
+        deep_zoom_viewer(
+            image_path,
+            window_center=st.session_state.wc_val,
+            window_width=st.session_state.ww_val,
+            inverted=st.session_state.get("invert_display", False),
+            on_change=partial(apply_client_window, "deep_zoom_viewer", tile_id),
+        )
+    elif CLIENT_WINDOWING:
+        # Window/level, inversion and zoom run in the browser; only finished changes come back
+        dicom_viewer(
+            image_path,
+            window_center=st.session_state.wc_val,
+            window_width=st.session_state.ww_val,
+            frame=frame,
+            inverted=st.session_state.get("invert_display", False),
+            on_change=partial(apply_client_window, "dicom_viewer", viewer_image_id(image_path, frame)),
+        )
+    else:
+        display_dicom(
+            image_path,
+            downsample_factor=DEFAULT_DOWNSAMPLE,
+            window_center=st.session_state.wc_val,
+            window_width=st.session_state.ww_val,
+            frame=frame,
+        )
+
+def render_view_thumbnails(image_paths, view_idx):
+    """
+    Render a thumbnail strip with every view of the current study.
+
+    Thumbnails come from the study prefetch; views still being decoded show a placeholder.
+    Clicking a thumbnail's button switches to that view.
+
+    Parameters:
+    - image_paths: DICOM paths of the study's views, in view order.
+    - view_idx: Index of the view currently on screen.
+    """
+    seq = nav_seq()
+    cols = st.columns(max(len(image_paths), 1))
+    for i, (col, image_path) in enumerate(zip(cols, image_paths)):
+        with col:
+            thumb = get_thumbnail(image_path)
+            if thumb is not None:
+                st.image(thumb, use_container_width=True)
+            else:
+                st.caption("Decoding...")
+            st.button(
+                f"View {i + 1}",
+                key=f"btn_thumb_view_{i}",
+                disabled=(i == view_idx),
+                on_click=dispatch,
+                args=("select_view", seq, i),
+                use_container_width=True,
+            )
+
+def display_dicom_header(row):
+    """
+    Display the header information of the currently selected DICOM file.
+
+    This function shows the patient information, view folder, and file information in a centered format.
+
+    Parameters:
+    - row: The currently selected row in the DICOM data containing header information.
+    """
+    st.markdown(
+        f"""
+        <div style='text-align:center; font-size:14px;'>
+            <strong>Study:</strong> {row.get('study_icn')} &nbsp; | &nbsp;
+            <strong>View folder:</strong> {row.get('study_icn')} &nbsp; | &nbsp;
+            <strong>File:</strong> {row.get('dicom_id')}
+        </div>
+        """,
+        unsafe_allow_html=True
+    )
+
+def render_annotation_feedback():
+    """
+    Render feedback messages based on the current annotation status.
+
+    This function displays warnings if not all annotation fields are filled or a save
+    conflicted with another tab, and shows success messages if annotations are saved.
+    """
+    if st.session_state.get("annotation_warning"):
+        st.warning("⚠️ Please complete **all annotation fields** before navigating to another patient.")
+    conflicts = st.session_state.get("annotation_conflict")
+    if conflicts:
+        st.warning(
+            "⚠️ This annotation was changed in another tab or window since you opened it, so your "
+            "last change was **not saved**. The form now shows the saved values; please review and re-enter."
+        )
+        st.session_state.annotation_conflict = None
+    if st.session_state.get("annotation_saved"):
+        st.success("✅ Annotation Saved!")
+        st.session_state.annotation_saved = False
     st.session_state.annotation_warning = False
\ No newline at end of file
@@ -0,0 +1,298 @@
+"""
+Per-session memory accounting and idle-session eviction.
+
+Every full script run records the session's user, role, last activity and the approximate
+bytes held by each of its session state keys. Sessions idle for longer than
+SESSION_IDLE_TTL have their rebuildable caches (EVICTABLE_KEYS) dropped and their pending
+decodes released; the next run of the session reloads what it needs. Sweeps piggyback on
+other sessions' runs, at most once every SESSION_SWEEP_SECONDS, so no background thread is
+needed.
+
+Users listed in OPERATORS see a per-session memory table in the sidebar.
+"""
+import sys
+import threading
+import time
+
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import streamlit as st
+
+from config import OPERATORS, SESSION_IDLE_TTL, SESSION_SWEEP_SECONDS
+from decode_pool import current_session_id, get_decode_pool
+from state import state
+
+# Session state keys that hold data the app reloads on demand (see annotation_frame and
+# the main script, which only load the annotation files when they are missing).
+EVICTABLE_KEYS = ("df_cl", "df_ds")
+
+
+def approx_nbytes(value, _depth=0):
+    """
+    Approximate the memory held by a session state value.
+
+    DataFrames and Series are measured with pandas (deep, including strings), NumPy arrays
+    and Arrow tables by their buffers, containers recursively; anything else by `sys.getsizeof`.
+    """
+    if isinstance(value, (pd.DataFrame, pd.Series)):
+        try:
+            usage = value.memory_usage(index=True, deep=True)
+        except ValueError:      # object columns over read-only buffers
+            usage = value.memory_usage(index=True, deep=False)
+        return int(usage.sum()) if isinstance(value, pd.DataFrame) else int(usage)
+    if isinstance(value, (np.ndarray, pa.Table)):
+        return int(value.nbytes)
+    if _depth < 4:
+        if isinstance(value, dict):
+            return sys.getsizeof(value) + sum(approx_nbytes(v, _depth + 1) for v in value.values())
+        if isinstance(value, (list, tuple, set, frozenset)):
+            return sys.getsizeof(value) + sum(approx_nbytes(v, _depth + 1) for v in value)
+    return sys.getsizeof(value)
+
+
+class _Session:
+    __slots__ = ("handle", "username", "role", "last_active", "key_bytes", "evicted_bytes", "evictions")
+
+    def __init__(self):
+        self.handle = None          # the session's state object, used to evict while it is idle
+        self.username = None
+        self.role = None
+        self.last_active = 0.0
+        self.key_bytes = {}
+        self.evicted_bytes = 0
+        self.evictions = 0
+
+    @property
+    def nbytes(self):
+        return sum(self.key_bytes.values())
+
+
+class SessionManager:
+    """
+    Process-wide registry of live sessions and the memory they hold.
+
+    - `touch` records a full run: activity time and per-key sizes of the session state.
+    - `note_activity` records an interaction that did not run the full script (fragment).
+    - `sweep` evicts EVICTABLE_KEYS from sessions idle for longer than `idle_ttl` and
+      forgets sessions the server no longer knows about.
+    """
+    def __init__(self, idle_ttl=SESSION_IDLE_TTL, sweep_seconds=SESSION_SWEEP_SECONDS):
+        self.idle_ttl = float(idle_ttl)
+        self.sweep_seconds = float(sweep_seconds)
+        self._sessions = {}
+        self._lock = threading.Lock()
+        self._last_sweep = 0.0
+
+    def touch(self, session_id, session_state, handle=None, username=None, role=None, now=None):
+        """
+        Record a full run of a session and measure its session state.
+
+        Parameters:
+        - session_id: Session identifier.
+        - session_state: Mapping to measure (st.session_state or a DictSessionState).
+        - handle: Object to evict from later (default is `session_state`); must support
+          `in` and `del`.
+        - username: Logged-in user.
+        - role: User's role.
+        - now: Current time (default time.time()).
+        """
+        now = time.time() if now is None else now
+        key_bytes = {}
+        for key in list(session_state.keys()):
+            try:
+                key_bytes[str(key)] = approx_nbytes(session_state[key])
+            except KeyError:
+                continue
+        with self._lock:
+            session = self._sessions.get(session_id)
+            if session is None:
+                session = self._sessions[session_id] = _Session()
+            session.handle = session_state if handle is None else handle
+            session.username = username
+            session.role = role
+            session.last_active = now
+            session.key_bytes = key_bytes
+
+    def note_activity(self, session_id, now=None):
+        """
+        Record an interaction of a known session without measuring it.
+        """
+        with self._lock:
+            session = self._sessions.get(session_id)
+            if session is not None:
+                session.last_active = time.time() if now is None else now
+
+    def evict(self, session_id):
+        """
+        Drop a session's rebuildable caches and release its pending decodes.
+
+        Returns:
+        The approximate number of bytes released.
+        """
+        with self._lock:
+            session = self._sessions.get(session_id)
+            if session is None:
+                return 0
+            handle = session.handle
+            freed = 0
+            for key in EVICTABLE_KEYS:
+                if handle is not None and key in handle:
+                    try:
+                        del handle[key]
+                    except KeyError:
+                        continue
+                    freed += session.key_bytes.pop(key, 0)
+            session.evicted_bytes += freed
+            session.evictions += 1
+        pool = get_decode_pool()
+        if pool is not None:
+            pool.cancel_stale(session_id)
+        return freed
+
+    def forget(self, session_id):
+        """
+        Stop tracking a session (e.g. after it disconnected).
+        """
+        with self._lock:
+            self._sessions.pop(session_id, None)
+
+    def sweep(self, now=None, is_alive=None, force=False):
+        """
+        Evict idle sessions, at most once every `sweep_seconds` unless forced.
+
+        Parameters:
+        - now: Current time (default time.time()).
+        - is_alive: Optional callable(session_id) -> bool; sessions it rejects are forgotten.
+        - force: Sweep even if the last sweep was recent.
+
+        Returns:
+        A list of (session_id, bytes released) for the sessions evicted.
+        """
+        now = time.time() if now is None else now
+        with self._lock:
+            if not force and now - self._last_sweep < self.sweep_seconds:
+                return []
+            self._last_sweep = now
+            sessions = list(self._sessions.items())
+        evicted = []
+        for session_id, session in sessions:
+            if is_alive is not None and not is_alive(session_id):
+                self.forget(session_id)
+                continue
+            idle = now - session.last_active
+            if idle > self.idle_ttl and any(key in session.key_bytes for key in EVICTABLE_KEYS):
+                evicted.append((session_id, self.evict(session_id)))
+        return evicted
+
+    def table(self, now=None):
+        """
+        Return one row per tracked session, largest first.
+
+        Returns:
+        A list of dicts with session, username, role, idle_s, bytes, largest keys,
+        evictions and evicted_bytes.
+        """
+        now = time.time() if now is None else now
+        with self._lock:
+            rows = []
+            for session_id, session in self._sessions.items():
+                largest = sorted(session.key_bytes.items(), key=lambda kv: kv[1], reverse=True)[:3]
+                rows.append({
+                    "session": session_id[:8],
+                    "username": session.username,
+                    "role": session.role,
+                    "idle_s": round(now - session.last_active, 1),
+                    "bytes": session.nbytes,
+                    "largest": ", ".join(f"{k} {v / 1e6:.2f} MB" for k, v in largest),
+                    "evictions": session.evictions,
+                    "evicted_bytes": session.evicted_bytes,
+                })
+        rows.sort(key=lambda row: row["bytes"], reverse=True)
+        return rows
+
+    def stats(self):
+        """
+        Return the number of tracked sessions and the total bytes they hold.
+        """
+        with self._lock:
+            return {
+                "sessions": len(self._sessions),
+                "bytes": sum(s.nbytes for s in self._sessions.values()),
+                "evicted_bytes": sum(s.evicted_bytes for s in self._sessions.values()),
+            }
+
+
+_manager = None
+_manager_lock = threading.Lock()
+
+
+def get_session_manager():
+    """
+    Return the process-wide SessionManager, creating it on first use.
+    """
+    global _manager
+    if _manager is None:
+        with _manager_lock:
+            if _manager is None:
+                _manager = SessionManager(SESSION_IDLE_TTL, SESSION_SWEEP_SECONDS)
+    return _manager
+
+
+def _session_handle():
+    try:
+        from streamlit.runtime.scriptrunner import get_script_run_ctx
+    except ImportError:
+        return None
+    ctx = get_script_run_ctx(suppress_warning=True)
+    return ctx.session_state if ctx is not None else None
+
+
+def _is_alive(session_id):
+    try:
+        from streamlit.runtime import Runtime
+    except ImportError:
+        return True
+    if not Runtime.exists():
+        return True
+    return Runtime.instance().is_active_session(session_id)
+
+
+def track_session(username, role):
+    """
+    Record the current full run of this session, then sweep idle sessions if one is due.
+    Call once per full run of the main script, after login.
+    """
+    session_id = current_session_id()
+    if session_id is None:
+        return
+    manager = get_session_manager()
+    manager.touch(session_id, state, handle=_session_handle(), username=username, role=role)
+    manager.sweep(is_alive=_is_alive)
+
+
+def note_activity():
+    """
+    Record an interaction of the current session that did not run the full script.
+    """
+    session_id = current_session_id()
+    if session_id is not None:
+        get_session_manager().note_activity(session_id)
+
+
+def render_session_table(username):
+    """
+    Show the per-session memory table in an expander, for users listed in OPERATORS.
+    """
+    if username not in OPERATORS:
+        return
+    manager = get_session_manager()
+    stats = manager.stats()
+    with st.expander("🧠 Sessions", expanded=False):
+        st.caption(
+            f"{stats['sessions']} sessions holding {stats['bytes'] / 1e6:.1f} MB; "
+            f"{stats['evicted_bytes'] / 1e6:.1f} MB evicted after {manager.idle_ttl / 60:.0f} min idle"
+        )
+        rows = manager.table()
+        if rows:
+            st.dataframe(pd.DataFrame(rows), hide_index=True, use_container_width=True)
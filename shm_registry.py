@@ -0,0 +1,268 @@
+import atexit
+import threading
+from collections import OrderedDict
+from contextlib import contextmanager
+from multiprocessing import shared_memory
+
+import numpy as np
+
+from config import SHARED_IMAGE_BYTES
+
+
+def image_key(image_path, level, frame=0):
+    """
+    Registry key of a decoded image: its path and pyramid level (downsample factor), plus the
+    frame for frames other than the first.
+    """
+    return (image_path, level) if frame == 0 else (image_path, level, frame)
+
+
+class _Entry:
+    __slots__ = ("shm", "shape", "dtype", "meta", "refs", "ready")
+
+    def __init__(self, shm, shape, dtype):
+        self.shm = shm
+        self.shape = shape
+        self.dtype = dtype
+        self.meta = ()
+        self.refs = 1           # held by the writer until publish()
+        self.ready = False
+
+    @property
+    def nbytes(self):
+        return self.shm.size
+
+    def view(self):
+        # np.frombuffer keeps a buffer export on the block for as long as the view lives, so
+        # closing the block under a live view fails with BufferError instead of unmapping it
+        # (np.ndarray(buffer=...) does not hold the export).
+        count = int(np.prod(self.shape))
+        arr = np.frombuffer(self.shm.buf, dtype=self.dtype, count=count).reshape(self.shape)
+        arr.setflags(write=False)
+        return arr
+
+
+class SharedImageRegistry:
+    """
+    Memory-bounded registry of decoded images held in `multiprocessing.shared_memory` blocks.
+
+    The app process creates a block per image; a decode worker attaches to it by name and
+    writes the pixels in place, so nothing is pickled back. Readers get read-only NumPy
+    views over the block with no copy.
+
+    - Entries being written, or pinned by a reader (`acquire` / `pin`), are never evicted.
+    - Other entries are evicted least recently used first when the budget is exceeded.
+    - A block whose views are still alive cannot be closed (BufferError); it is unlinked
+      straight away and closed on a later sweep, once the last view is gone.
+    """
+    def __init__(self, max_bytes=SHARED_IMAGE_BYTES):
+        self.max_bytes = int(max_bytes)
+        self._entries = OrderedDict()   # key -> _Entry
+        self._closing = []              # unlinked blocks still referenced by live views
+        self._lock = threading.Lock()
+        self._resident_bytes = 0
+        self._hits = 0
+        self._misses = 0
+        self._evictions = 0
+
+    def create(self, key, shape, dtype=np.float32):
+        """
+        Allocate a block for an image about to be written, replacing any existing entry.
+
+        Parameters:
+        - key: Registry key (see `image_key`).
+        - shape: Array shape.
+        - dtype: NumPy dtype.
+
+        Returns:
+        The shared memory block name, to hand to the writer and to `publish` / `discard`.
+        """
+        dtype = np.dtype(dtype)
+        size = max(1, int(np.prod(shape)) * dtype.itemsize)
+        with self._lock:
+            old = self._entries.pop(key, None)
+            if old is not None:
+                self._drop_locked(old)
+            self._evict_locked(size)
+            entry = _Entry(shared_memory.SharedMemory(create=True, size=size), tuple(shape), dtype)
+            self._entries[key] = entry
+            self._resident_bytes += entry.nbytes
+            return entry.shm.name
+
+    def publish(self, key, name, meta=()):
+        """
+        Mark a written block as ready and release the writer's reference.
+
+        Parameters:
+        - key: Registry key.
+        - name: Block name returned by `create`.
+        - meta: Tuple of values returned alongside the array (e.g. window parameters).
+
+        Returns:
+        The value (view, *meta), or None if the entry was replaced or discarded meanwhile.
+        """
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None or entry.shm.name != name:
+                return None
+            entry.meta = tuple(meta)
+            entry.ready = True
+            entry.refs -= 1
+            return (entry.view(),) + entry.meta
+
+    def discard(self, key, name):
+        """
+        Drop a block whose write failed or was cancelled.
+        """
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry.shm.name == name:
+                del self._entries[key]
+                self._drop_locked(entry)
+
+    def get(self, key):
+        """
+        Return (view, *meta) for a ready image (marking it most recently used), or None.
+        """
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None or not entry.ready:
+                self._misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self._hits += 1
+            return (entry.view(),) + entry.meta
+
+    def __contains__(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            return entry is not None and entry.ready
+
+    def acquire(self, key):
+        """
+        Like `get`, but also pin the entry until the matching `release`.
+        """
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None or not entry.ready:
+                self._misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self._hits += 1
+            entry.refs += 1
+            return (entry.view(),) + entry.meta
+
+    def release(self, key):
+        """
+        Drop a reference taken with `acquire`.
+        """
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry.refs > 0:
+                entry.refs -= 1
+            self._evict_locked(0)
+
+    @contextmanager
+    def pin(self, key):
+        """
+        Context manager keeping an image resident while it is in use.
+
+        Yields:
+        (view, *meta), or None if the image is not in the registry.
+        """
+        value = self.acquire(key)
+        try:
+            yield value
+        finally:
+            if value is not None:
+                self.release(key)
+
+    def _drop_locked(self, entry):
+        self._resident_bytes -= entry.nbytes
+        try:
+            entry.shm.unlink()
+        except FileNotFoundError:
+            pass
+        try:
+            entry.shm.close()
+        except BufferError:
+            # A reader still holds a view; the mapping stays valid until it is released.
+            self._closing.append(entry.shm)
+
+    def _evict_locked(self, incoming):
+        if self._closing:
+            still_open = []
+            for shm in self._closing:
+                try:
+                    shm.close()
+                except BufferError:
+                    still_open.append(shm)
+            self._closing = still_open
+        for key in list(self._entries):
+            if self._resident_bytes + incoming <= self.max_bytes:
+                break
+            entry = self._entries[key]
+            if entry.refs > 0 or not entry.ready:
+                continue
+            del self._entries[key]
+            self._drop_locked(entry)
+            self._evictions += 1
+
+    def clear(self):
+        """
+        Drop every entry that is not being written or pinned.
+        """
+        with self._lock:
+            for key in list(self._entries):
+                entry = self._entries[key]
+                if entry.refs == 0 and entry.ready:
+                    del self._entries[key]
+                    self._drop_locked(entry)
+
+    def shutdown(self):
+        """
+        Unlink every block, including those still being written or pinned (at process exit).
+        """
+        with self._lock:
+            for entry in self._entries.values():
+                self._drop_locked(entry)
+            self._entries.clear()
+
+    def stats(self):
+        """
+        Return registry statistics.
+
+        Returns:
+        A dict with hits, misses, evictions, entries, pinned, closing, resident_bytes,
+        max_bytes and hit_rate.
+        """
+        with self._lock:
+            lookups = self._hits + self._misses
+            return {
+                "hits": self._hits,
+                "misses": self._misses,
+                "evictions": self._evictions,
+                "entries": len(self._entries),
+                "pinned": sum(1 for e in self._entries.values() if e.refs > 0),
+                "closing": len(self._closing),
+                "resident_bytes": self._resident_bytes,
+                "max_bytes": self.max_bytes,
+                "hit_rate": self._hits / lookups if lookups else 0.0,
+            }
+
+
+_registry = None
+_registry_lock = threading.Lock()
+
+
+def get_image_registry():
+    """
+    Return the process-wide SharedImageRegistry, creating it on first use.
+    """
+    global _registry
+    if _registry is None:
+        with _registry_lock:
+            if _registry is None:
+                _registry = SharedImageRegistry(SHARED_IMAGE_BYTES)
+                atexit.register(_registry.shutdown)
+    return _registry
@@ -1,113 +1,190 @@
-import streamlit as st
-import pandas as pd
-from dicom_utils import safe_float, digital_xray_from_dicom
-from callbacks import update_window_range, reset_windowing
-import pydicom
-from pydicom.valuerep import PersonName
-
-def reinitialize_window_state(image_path):
-    if (
-        "native_center" not in st.session_state
-        or "native_width" not in st.session_state
-        or st.session_state.get("last_loaded_image") != image_path
-    ):
-        ds = pydicom.dcmread(image_path)
-        _, ww, wc, lower, upper = digital_xray_from_dicom(ds)
-
-        # Calculate theoretical min/max
-        bits_stored = ds.get("BitsStored", 12)
-        is_signed = ds.get("PixelRepresentation", 0) == 1
-        if is_signed:
-            intensity_min = -2 ** (bits_stored - 1)
-            intensity_max = 2 ** (bits_stored - 1) - 1
-        else:
-            intensity_min = 0
-            intensity_max = 2 ** bits_stored - 1
-
-        st.session_state.native_center = int(wc)
-        st.session_state.native_width = int(ww)
-        st.session_state.wc_val = int(wc)
-        st.session_state.ww_val = int(ww)
-        st.session_state.intensity_min = intensity_min
-        st.session_state.intensity_max = intensity_max
-        st.session_state.window_range_slider = (int(wc - ww // 2), int(wc + ww // 2))
-        st.session_state.last_loaded_image = image_path
-
-def render_window_controls():
-    st.markdown("### 🖼 Windowing Controls")
-
-    min_possible = int(st.session_state.get("intensity_min", 0))  # fallback to 0
-    max_possible = int(st.session_state.get("intensity_max", 4095))  # fallback to 12-bit
-
-    col1, col2 = st.columns([3, 1.3])
-    with col1:
-        st.slider(
-            "Windowing Range (min/max)",
-            min_value=min_possible,
-            max_value=max_possible,
-            value=st.session_state.get("window_range_slider", (
-                st.session_state.wc_val - st.session_state.ww_val // 2,
-                st.session_state.wc_val + st.session_state.ww_val // 2
-            )),
-            step=1,
-            key="window_range_slider",
-            on_change=update_window_range
-        )
-    with col2:
-        st.button("🔄 Reset", on_click=reset_windowing)
-
-def render_dicom_metadata(row):
-    """
-    Render the DICOM metadata by reading the DICOM header.
-
-    Parameters:
-    - row: A dictionary or pandas Series containing at least the 'image_path'.
-    """
-    st.markdown("### 📋 DICOM Metadata")
-
-    metadata_fields = [
-        "PatientName", "PatientID", "PatientSex", "PatientAge",
-        "PatientBirthDate", "StudyDate", "StudyTime",
-        "BodyPartExamined", "PatientPosition"
-    ]
-
-    try:
-        ds = pydicom.dcmread(row["image_path"], stop_before_pixels=True)
-
-        def normalize(val):
-            if isinstance(val, PersonName):
-                return str(val).replace("^", " ")
-            return str(val) if val is not None else None
-
-        metadata_values = [normalize(getattr(ds, field, None)) for field in metadata_fields]
-
-    except Exception as e:
-        st.error(f"Error reading DICOM metadata: {e}")
-        metadata_values = [None] * len(metadata_fields)
-
-    metadata_df = pd.DataFrame({
-        "Field": metadata_fields,
-        "Value": metadata_values
-    })
-
-    st.markdown(
-                """
-                <style>
-                [data-testid="stElementToolbar"] {
-                    display: none;
-                }
-                </style>
-                """,
-                unsafe_allow_html=True
-            )
-    
-    st.dataframe(metadata_df, use_container_width=True)
-
-def render_clinical_info_placeholder():
-    """
-    Render a placeholder for clinical values.
-
-    This function displays a title and an "info" message indicating that clinical values are coming soon.
-    """
-    st.title("Clinical Values")
-    st.info("Coming soon...")
+import streamlit as st
+import pandas as pd
+from dicom_utils import safe_float, load_xray, peek_xray, header_window
+from callbacks import update_window_range, reset_windowing, apply_window_preset
+from window_presets import WINDOW_PRESETS
+from decode_pool import DecodeTimeout, DecodeQueueFull
+from pixel_access import DecodeBusyError, num_frames
+import pydicom
+from pydicom.valuerep import PersonName
+
+def reinitialize_window_state(image_path, wait=True):
+    """
+    Reset the window/level state when a new image is selected.
+
+    Parameters:
+    - image_path: Path of the image on screen.
+    - wait: Block until the image is decoded. With False (progressive image panel), an
+      image still being decoded gets a provisional window from its header, refined by
+      `finalize_window_state` once the decode finishes. The same happens with True if
+      the decode times out or the decoder is busy.
+    """
+    if (
+        "native_center" not in st.session_state
+        or "native_width" not in st.session_state
+        or st.session_state.get("last_loaded_image") != image_path
+    ):
+        # Window parameters come from the shared decode cache; only the header is read here
+        ds = pydicom.dcmread(image_path, stop_before_pixels=True)
+        try:
+            decoded = load_xray(image_path) if wait else peek_xray(image_path)
+            failed = False
+        except (DecodeTimeout, DecodeQueueFull, DecodeBusyError):
+            decoded = None
+            failed = True
+        if decoded is not None:
+            _, ww, wc, lower, upper = decoded
+            pending = False
+        else:
+            wc, ww, exact = header_window(ds)
+            pending = failed or not exact
+
+        # Calculate theoretical min/max
+        bits_stored = ds.get("BitsStored", 12)
+        is_signed = ds.get("PixelRepresentation", 0) == 1
+        if is_signed:
+            intensity_min = -2 ** (bits_stored - 1)
+            intensity_max = 2 ** (bits_stored - 1) - 1
+        else:
+            intensity_min = 0
+            intensity_max = 2 ** bits_stored - 1
+
+        st.session_state.native_center = int(wc)
+        st.session_state.native_width = int(ww)
+        st.session_state.wc_val = int(wc)
+        st.session_state.ww_val = int(ww)
+        st.session_state.intensity_min = intensity_min
+        st.session_state.intensity_max = intensity_max
+        st.session_state.window_range_slider = (int(wc - ww // 2), int(wc + ww // 2))
+        st.session_state.last_loaded_image = image_path
+        st.session_state.num_frames = num_frames(ds)
+        st.session_state.frame_idx = 0
+        st.session_state.window_pending = pending
+        st.session_state.window_slider_stale = False
+    elif st.session_state.get("window_pending") or st.session_state.get("window_slider_stale"):
+        finalize_window_state(image_path, sync_slider=True)
+
+def finalize_window_state(image_path, sync_slider=False):
+    """
+    Replace a provisional header-based window with the decoded image's window.
+
+    The window is only replaced if the user has not changed it meanwhile. The window
+    slider can only be moved before it is drawn in the current run, so the image panel
+    fragment calls this with sync_slider=True just ahead of `render_window_controls`, and
+    `reinitialize_window_state` does the same in full-page runs.
+
+    Parameters:
+    - image_path: Path of the image on screen.
+    - sync_slider: Also move the window range slider to the new window.
+
+    Returns:
+    True if the image is decoded and the window is final.
+    """
+    if st.session_state.get("last_loaded_image") != image_path:
+        return False
+    if st.session_state.get("window_pending"):
+        decoded = peek_xray(image_path)
+        if decoded is None:
+            return False
+        _, ww, wc, lower, upper = decoded
+        untouched = (
+            st.session_state.get("wc_val") == st.session_state.get("native_center")
+            and st.session_state.get("ww_val") == st.session_state.get("native_width")
+        )
+        st.session_state.native_center = int(wc)
+        st.session_state.native_width = int(ww)
+        if untouched:
+            st.session_state.wc_val = int(wc)
+            st.session_state.ww_val = int(ww)
+            st.session_state.window_slider_stale = True
+        st.session_state.window_pending = False
+    if sync_slider and st.session_state.get("window_slider_stale"):
+        wc, ww = st.session_state.wc_val, st.session_state.ww_val
+        st.session_state.window_range_slider = (int(wc - ww // 2), int(wc + ww // 2))
+        st.session_state.window_slider_stale = False
+    return True
+
+def render_window_controls():
+    st.markdown("### 🖼 Windowing Controls")
+
+    min_possible = int(st.session_state.get("intensity_min", 0))  # fallback to 0
+    max_possible = int(st.session_state.get("intensity_max", 4095))  # fallback to 12-bit
+
+    col1, col2 = st.columns([3, 1.3])
+    with col1:
+        st.slider(
+            "Windowing Range (min/max)",
+            min_value=min_possible,
+            max_value=max_possible,
+            value=st.session_state.get("window_range_slider", (
+                st.session_state.wc_val - st.session_state.ww_val // 2,
+                st.session_state.wc_val + st.session_state.ww_val // 2
+            )),
+            step=1,
+            key="window_range_slider",
+            on_change=update_window_range
+        )
+    with col2:
+        st.button("🔄 Reset", on_click=reset_windowing)
+
+    # One-click presets computed from the image's cached histogram
+    preset_cols = st.columns(len(WINDOW_PRESETS))
+    for col, preset in zip(preset_cols, WINDOW_PRESETS):
+        with col:
+            st.button(preset, key=f"btn_preset_{preset}", on_click=apply_window_preset, args=(preset,), use_container_width=True)
+
+def render_dicom_metadata(row):
+    """
+    Render the DICOM metadata by reading the DICOM header.
+
+    Parameters:
+    - row: A dictionary or pandas Series containing at least the 'image_path'.
+    """
+    st.markdown("### 📋 DICOM Metadata")
+
+    metadata_fields = [
+        "PatientName", "PatientID", "PatientSex", "PatientAge",
+        "PatientBirthDate", "StudyDate", "StudyTime",
+        "BodyPartExamined", "PatientPosition"
+    ]
+
+    try:
+        ds = pydicom.dcmread(row["image_path"], stop_before_pixels=True)
+
+        def normalize(val):
+            if isinstance(val, PersonName):
+                return str(val).replace("^", " ")
+            return str(val) if val is not None else None
+
+        metadata_values = [normalize(getattr(ds, field, None)) for field in metadata_fields]
+
+    except Exception as e:
+        st.error(f"Error reading DICOM metadata: {e}")
+        metadata_values = [None] * len(metadata_fields)
+
+    metadata_df = pd.DataFrame({
+        "Field": metadata_fields,
+        "Value": metadata_values
+    })
+
+    st.markdown(
+                """
+                <style>
+                [data-testid="stElementToolbar"] {
+                    display: none;
+                }
+                </style>
+                """,
+                unsafe_allow_html=True
+            )
+    
+    st.dataframe(metadata_df, use_container_width=True)
+
+def render_clinical_info_placeholder():
+    """
+    Render a placeholder for clinical values.
+
+    This function displays a title and an "info" message indicating that clinical values are coming soon.
+    """
+    st.title("Clinical Values")
+    st.info("Coming soon...")
@@ -0,0 +1,144 @@
+import contextvars
+from contextlib import contextmanager
+
+import streamlit as st
+
+
+class DictSessionState(dict):
+    """
+    Plain-dict session state for running annotation, navigation and windowing logic
+    outside of Streamlit (tests, benchmarks, background workers).
+
+    Supports both item access (state["ds_idx"]) and attribute access (state.ds_idx),
+    mirroring st.session_state.
+    """
+    def __getattr__(self, name):
+        try:
+            return self[name]
+        except KeyError:
+            raise AttributeError(f"DictSessionState has no key '{name}'")
+
+    def __setattr__(self, name, value):
+        self[name] = value
+
+    def __delattr__(self, name):
+        try:
+            del self[name]
+        except KeyError:
+            raise AttributeError(f"DictSessionState has no key '{name}'")
+
+
+# Backend bound to the current thread/context. None means "use st.session_state".
+_backend = contextvars.ContextVar("session_state_backend", default=None)
+
+
+def get_state():
+    """
+    Return the session state backend active in the current context.
+
+    Returns:
+    The bound backend (e.g. a DictSessionState) if one was set with `use_state` or
+    `bound_state`, otherwise Streamlit's st.session_state.
+    """
+    backend = _backend.get()
+    return st.session_state if backend is None else backend
+
+
+def use_state(backend):
+    """
+    Bind a session state backend to the current context.
+
+    Parameters:
+    - backend: A mapping with attribute access (e.g. DictSessionState), or None to
+      fall back to st.session_state.
+
+    Returns:
+    A token that can be passed to `reset_state` to restore the previous backend.
+    """
+    return _backend.set(backend)
+
+
+def reset_state(token):
+    """
+    Restore the backend that was active before the matching `use_state` call.
+    """
+    _backend.reset(token)
+
+
+@contextmanager
+def bound_state(backend=None):
+    """
+    Context manager that binds a session state backend for the duration of the block.
+
+    Parameters:
+    - backend: The backend to bind (default is a fresh DictSessionState).
+
+    Yields:
+    The bound backend.
+    """
+    backend = DictSessionState() if backend is None else backend
+    token = _backend.set(backend)
+    try:
+        yield backend
+    finally:
+        _backend.reset(token)
+
+
+class _StateProxy:
+    """
+    Module-level proxy forwarding attribute and item access to `get_state()`, so call sites
+    can write `state.ds_idx` exactly like `st.session_state.ds_idx`.
+    """
+    def __getattr__(self, name):
+        return getattr(get_state(), name)
+
+    def __setattr__(self, name, value):
+        setattr(get_state(), name, value)
+
+    def __delattr__(self, name):
+        delattr(get_state(), name)
+
+    def __getitem__(self, key):
+        return get_state()[key]
+
+    def __setitem__(self, key, value):
+        get_state()[key] = value
+
+    def __delitem__(self, key):
+        del get_state()[key]
+
+    def __contains__(self, key):
+        return key in get_state()
+
+    def __iter__(self):
+        return iter(get_state())
+
+    def __len__(self):
+        return len(get_state())
+
+    def get(self, key, default=None):
+        return get_state().get(key, default)
+
+    def keys(self):
+        return get_state().keys()
+
+    def pop(self, key, *default):
+        backend = get_state()
+        if isinstance(backend, dict):
+            return backend.pop(key, *default)
+        if key in backend:
+            value = backend[key]
+            del backend[key]
+            return value
+        if default:
+            return default[0]
+        raise KeyError(key)
+
+    def setdefault(self, key, default=None):
+        backend = get_state()
+        if key not in backend:
+            backend[key] = default
+        return backend[key]
+
+
+state = _StateProxy()
@@ -0,0 +1,137 @@
+from concurrent.futures import CancelledError
+
+import numpy as np
+
+from config import DECODE_TIMEOUT
+from decode_pool import DecodeQueueFull, current_session_id, get_decode_pool
+from dicom_utils import DEFAULT_DOWNSAMPLE, peek_xray
+from image_cache import get_decode_cache
+
+THUMBNAIL_HEIGHT = 128
+
+
+def make_thumbnail(arr, lower, upper, height=THUMBNAIL_HEIGHT):
+    """
+    Build a small 8-bit thumbnail from a decoded image.
+
+    Parameters:
+    - arr: Decoded image (any resolution).
+    - lower: Lower bound of the display window.
+    - upper: Upper bound of the display window.
+    - height: Approximate thumbnail height in pixels.
+
+    Returns:
+    A uint8 numpy array.
+    """
+    step = max(1, arr.shape[0] // height)
+    small = np.asarray(arr[::step, ::step], dtype=np.float32)
+    span = float(upper - lower) or 1.0
+    small = np.clip((small - lower) * (255.0 / span), 0, 255)
+    return small.astype(np.uint8)
+
+
+def _on_done(request):
+    if request.cancelled or request.future.cancelled() or request.future.exception() is not None:
+        return
+    # The display image itself stays in the shared image registry; only the thumbnail is
+    # kept in the decode cache.
+    try:
+        display, ww, wc, lower, upper = request.result()
+    except CancelledError:
+        return
+    get_decode_cache().put((request.key[0], "thumb"), make_thumbnail(display, lower, upper))
+
+
+def prefetch_study(image_paths, downsample_factor=DEFAULT_DOWNSAMPLE):
+    """
+    Start decoding every view of a study in parallel across the decode process pool.
+
+    Views already in the shared decode cache, or already being decoded for another
+    session, are skipped, so calling this on every rerun is cheap. Decodes this session
+    requested for views outside `image_paths` are cancelled.
+
+    Parameters:
+    - image_paths: Iterable of DICOM paths for the study's views.
+    - downsample_factor: Downsampling used by the image panel.
+    """
+    pool = get_decode_pool()
+    if pool is None:
+        return
+    image_paths = list(image_paths)
+    session_id = current_session_id()
+    if session_id is not None:
+        # The user has moved on: stop decoding views from the study they left behind.
+        pool.cancel_stale(session_id, keep=image_paths)
+    cache = get_decode_cache()
+    for image_path in image_paths:
+        if (image_path, "thumb") in cache:
+            continue
+        cached = peek_xray(image_path, downsample_factor)
+        if cached is not None:
+            # Decoded on demand earlier; derive the thumbnail from the cached image.
+            cache.put((image_path, "thumb"), make_thumbnail(cached[0], cached[3], cached[4]))
+            continue
+        if pool.pending(image_path, downsample_factor) is not None:
+            continue
+        try:
+            request = pool.submit(image_path, downsample_factor, block=False)
+        except DecodeQueueFull:
+            # Prefetching is best effort; the view is decoded on demand when opened.
+            break
+        request.future.add_done_callback(lambda f, request=request: _on_done(request))
+
+
+def ensure_decoding(image_path, downsample_factor=DEFAULT_DOWNSAMPLE, frame=0):
+    """
+    Start decoding a view in the background unless it is resident or already being decoded.
+
+    Never blocks on the decode (or on a full decode queue, which is retried on the next call).
+
+    Parameters:
+    - image_path: DICOM path of the view.
+    - downsample_factor: Downsampling used by the image panel.
+    - frame: Frame index.
+
+    Returns:
+    True if the decoded image is already available.
+    """
+    if peek_xray(image_path, downsample_factor, frame) is not None:
+        return True
+    pool = get_decode_pool()
+    if pool is None:
+        return False
+    if pool.pending(image_path, downsample_factor, frame) is None:
+        try:
+            request = pool.submit(image_path, downsample_factor, frame, block=False)
+        except DecodeQueueFull:
+            return False
+        if frame == 0:
+            request.future.add_done_callback(lambda f, request=request: _on_done(request))
+    return False
+
+
+def get_thumbnail(image_path):
+    """
+    Return the cached thumbnail for a view, or None if it has not been decoded yet.
+    """
+    cache = get_decode_cache()
+    if (image_path, "thumb") not in cache:
+        return None
+    return cache.get((image_path, "thumb"))
+
+
+def wait_for_study(image_paths, downsample_factor=DEFAULT_DOWNSAMPLE, timeout=DECODE_TIMEOUT):
+    """
+    Block until every pending decode for the given views has finished (or `timeout` expires).
+    """
+    pool = get_decode_pool()
+    if pool is None:
+        return
+    requests = [pool.pending(p, downsample_factor) for p in image_paths]
+    for request in requests:
+        if request is None:
+            continue
+        try:
+            request.future.result(timeout=timeout)
+        except Exception:
+            pass
@@ -0,0 +1,252 @@
+import hashlib
+import hmac
+import json
+import math
+import os
+import re
+import threading
+import time
+from collections import OrderedDict
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlsplit
+
+import numpy as np
+
+from config import (
+    TILE_SERVER_HOST, TILE_SERVER_PORT, TILE_CACHE_BYTES,
+    TILE_ID_TTL, TILE_MAX_IMAGES, TILE_ALLOWED_ORIGINS,
+)
+from decode_pool import current_session_id
+from dicom_utils import load_xray
+from image_cache import DecodeCache
+from shm_registry import get_image_registry, image_key
+
+TILE_SIZE = 256
+
+# Only images registered by a session can be served. Ids are keyed to the session that
+# registered them, so they cannot be guessed or reused by another session, and they
+# expire TILE_ID_TTL seconds after the session last showed the image.
+_SECRET = os.urandom(32)
+_registered = OrderedDict()    # image_id -> (filepath, expires_at), least recently registered first
+_registered_lock = threading.Lock()
+_tile_cache = DecodeCache(TILE_CACHE_BYTES)
+_info_cache = DecodeCache(64 * 1024 * 1024)
+
+_server = None
+_server_lock = threading.Lock()
+
+
+def register_image(filepath):
+    """
+    Make an image available to the tile endpoint for the calling session.
+
+    The id is stable for the same session and file, so calling this on every rerun only
+    refreshes its expiry. At most TILE_MAX_IMAGES ids are kept; the least recently
+    registered are dropped first.
+
+    Parameters:
+    - filepath: Path to the DICOM file.
+
+    Returns:
+    The opaque image id used in tile URLs.
+    """
+    ident = f"{current_session_id() or ''}\0{os.path.abspath(filepath)}"
+    image_id = hmac.new(_SECRET, ident.encode("utf-8"), hashlib.sha256).hexdigest()[:32]
+    now = time.monotonic()
+    with _registered_lock:
+        _registered[image_id] = (filepath, now + TILE_ID_TTL)
+        _registered.move_to_end(image_id)
+        while _registered:
+            _, expires_at = next(iter(_registered.values()))
+            if len(_registered) <= TILE_MAX_IMAGES and expires_at > now:
+                break
+            _registered.popitem(last=False)
+    return image_id
+
+
+def _lookup(image_id):
+    """
+    Return the file registered under `image_id`, or None if it is unknown or expired.
+    """
+    with _registered_lock:
+        entry = _registered.get(image_id)
+        if entry is None:
+            return None
+        if entry[1] <= time.monotonic():
+            del _registered[image_id]
+            return None
+        return entry[0]
+
+
+def num_levels(rows, cols, tile_size=TILE_SIZE):
+    """
+    Number of pyramid levels: level 0 is full resolution and each level halves the size,
+    down to the first level that fits in a single tile.
+    """
+    return max(1, int(math.ceil(math.log2(max(rows, cols, 1) / tile_size))) + 1)
+
+
+def _full_resolution(filepath):
+    """
+    Return (array, ww, wc) for an image at full resolution. Every tile of the image is
+    cut from this array.
+
+    The image comes from `load_xray`, so it is decoded in the decode pool (within its
+    large-decode slots) into the shared image registry, or through the decode cache when
+    DECODE_WORKERS is 0, and counts against the same memory bound as the image panel. A
+    decode slower than DECODE_TIMEOUT raises DecodeTimeout.
+    """
+    arr, ww, wc, lower, upper = load_xray(filepath, 1)
+    return arr, ww, wc
+
+
+def image_info(filepath):
+    """
+    Return pyramid metadata for an image (decoding it on first use, see `_full_resolution`).
+
+    Returns:
+    A dict with rows, cols, levels, tile_size, vmin, vmax and the DICOM window (ww, wc).
+    """
+    def _load():
+        with get_image_registry().pin(image_key(filepath, 1)):
+            arr, ww, wc = _full_resolution(filepath)
+            rows, cols = arr.shape[:2]
+            vmin, vmax = float(np.min(arr)), float(np.max(arr))
+        return {
+            "rows": int(rows),
+            "cols": int(cols),
+            "levels": num_levels(rows, cols),
+            "tile_size": TILE_SIZE,
+            "vmin": vmin,
+            "vmax": vmax,
+            "ww": float(ww),
+            "wc": float(wc),
+        }
+    return _info_cache.get_or_load(filepath, _load)
+
+
+def render_tile(filepath, level, tx, ty):
+    """
+    Cut one tile out of the image pyramid, generating and caching it on first request.
+
+    Tiles are packed as little-endian uint16 over the image's [vmin, vmax] range, so the
+    browser can apply any window without asking for new tiles.
+
+    Parameters:
+    - filepath: Path to the DICOM file.
+    - level: Pyramid level (0 = full resolution).
+    - tx, ty: Tile column and row at that level.
+
+    Returns:
+    A tuple (payload bytes, tile rows, tile cols), or None if the tile is out of range.
+    """
+    def _render():
+        info = image_info(filepath)
+        if not (0 <= level < info["levels"]):
+            return None
+        step = 2 ** level
+        span = TILE_SIZE * step
+        y0, x0 = ty * span, tx * span
+        if y0 >= info["rows"] or x0 >= info["cols"] or tx < 0 or ty < 0:
+            return None
+        # The shared image is read in place while it is pinned against eviction
+        with get_image_registry().pin(image_key(filepath, 1)):
+            arr = _full_resolution(filepath)[0]
+            tile = np.array(arr[y0:y0 + span:step, x0:x0 + span:step], dtype=np.float32)
+        del arr
+        vmin, vmax = info["vmin"], info["vmax"]
+        scale = 65535.0 / (vmax - vmin) if vmax > vmin else 0.0
+        packed = np.empty(tile.shape, dtype="<u2")
+        np.multiply(tile - vmin, scale, out=packed, casting="unsafe")
+        return packed.tobytes(), int(tile.shape[0]), int(tile.shape[1])
+    return _tile_cache.get_or_load((filepath, level, tx, ty), _render)
+
+
+class _TileHandler(BaseHTTPRequestHandler):
+    _TILE_RE = re.compile(r"^/tiles/([0-9a-f]+)/(\d+)/(\d+)/(\d+)$")
+    _INFO_RE = re.compile(r"^/info/([0-9a-f]+)$")
+
+    def _allowed_origin(self):
+        """
+        Return the request's Origin if it may read tiles: the app on this server's own
+        host (the viewer iframe) or one listed in TILE_ALLOWED_ORIGINS. Otherwise None.
+        """
+        origin = self.headers.get("Origin")
+        if not origin:
+            return None
+        if origin in TILE_ALLOWED_ORIGINS:
+            return origin
+        host = urlsplit("//" + self.headers.get("Host", "")).hostname
+        if host and urlsplit(origin).hostname == host:
+            return origin
+        return None
+
+    def _send(self, status, body=b"", content_type="application/octet-stream", headers=None):
+        self.send_response(status)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(body)))
+        origin = self._allowed_origin()
+        if origin is not None:
+            self.send_header("Access-Control-Allow-Origin", origin)
+            self.send_header("Access-Control-Expose-Headers", "X-Tile-Rows, X-Tile-Cols")
+        self.send_header("Vary", "Origin")
+        self.send_header("Cache-Control", "private, max-age=3600")
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_GET(self):
+        match = self._TILE_RE.match(self.path)
+        if match:
+            image_id, level, tx, ty = match.group(1), *map(int, match.groups()[1:])
+            filepath = _lookup(image_id)
+            if filepath is None:
+                return self._send(404)
+            try:
+                tile = render_tile(filepath, level, tx, ty)
+            except Exception:
+                return self._send(500)
+            if tile is None:
+                return self._send(404)
+            payload, rows, cols = tile
+            return self._send(200, payload, headers={"X-Tile-Rows": str(rows), "X-Tile-Cols": str(cols)})
+
+        match = self._INFO_RE.match(self.path)
+        if match:
+            filepath = _lookup(match.group(1))
+            if filepath is None:
+                return self._send(404)
+            try:
+                body = json.dumps(image_info(filepath)).encode("utf-8")
+            except Exception:
+                return self._send(500)
+            return self._send(200, body, content_type="application/json")
+
+        self._send(404)
+
+    def log_message(self, format, *args):
+        # Tile requests are far too frequent for the default stderr access log.
+        pass
+
+
+def ensure_tile_server():
+    """
+    Start the tile HTTP server in a daemon thread (once per process).
+
+    Returns:
+    The port the server listens on.
+    """
+    global _server
+    if _server is None:
+        with _server_lock:
+            if _server is None:
+                try:
+                    _server = ThreadingHTTPServer((TILE_SERVER_HOST, TILE_SERVER_PORT), _TileHandler)
+                except OSError:
+                    # Port taken (e.g. by a copy of this module from before a Streamlit
+                    # source reload): fall back to an ephemeral port.
+                    _server = ThreadingHTTPServer((TILE_SERVER_HOST, 0), _TileHandler)
+                _server.daemon_threads = True
+                threading.Thread(target=_server.serve_forever, name="tile-server", daemon=True).start()
+    return _server.server_address[1]
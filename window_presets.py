@@ -0,0 +1,127 @@
+import numpy as np
+
+from disk_cache import get_disk_cache
+from image_cache import get_decode_cache
+
+HISTOGRAM_BINS = 2048
+HISTOGRAM_STEP = 4      # pixel sampling stride for the counts; min/max use every pixel
+
+# Preset name -> (lower percentile, upper percentile) of the image's intensity histogram.
+# The histogram is computed when the image is decoded (see dicom_utils.decode_xray), over
+# its full rescaled range, not just the header window, and in display orientation (after
+# MONOCHROME1 inversion): air/lung is dark, bone and the mediastinum are bright.
+WINDOW_PRESETS = {
+    "Auto": (0.5, 99.5),
+    "Lung": (1.0, 75.0),
+    "Mediastinum": (40.0, 99.8),
+    "Full range": (0.0, 100.0),
+}
+
+
+def compute_histogram(arr, bins=HISTOGRAM_BINS, step=HISTOGRAM_STEP):
+    """
+    Compute an intensity histogram of an image.
+
+    Parameters:
+    - arr: Image array.
+    - bins: Number of equally spaced bins between the image minimum and maximum.
+    - step: Sampling stride along both axes for the counts.
+
+    Returns:
+    A dict with the cumulative counts (int64), the bin edges, the total pixel count and
+    the image minimum and maximum.
+    """
+    lo = float(np.min(arr))
+    hi = float(np.max(arr))
+    data_min, data_max = lo, hi
+    if hi <= lo:
+        hi = lo + 1.0
+    counts, edges = np.histogram(arr[::step, ::step], bins=bins, range=(lo, hi))
+    cumulative = np.cumsum(counts)
+    return {"cumulative": cumulative, "edges": edges, "total": int(cumulative[-1]), "min": data_min, "max": data_max}
+
+
+def histogram_to_meta(hist):
+    """
+    Convert a histogram to the JSON form stored in the disk cache sidecar.
+    """
+    return {
+        "counts": np.diff(hist["cumulative"], prepend=0).tolist(),
+        "range": [float(hist["edges"][0]), float(hist["edges"][-1])],
+        "min": hist["min"],
+        "max": hist["max"],
+    }
+
+
+def histogram_from_meta(meta):
+    """
+    Rebuild a histogram from its disk cache form (see `histogram_to_meta`).
+    """
+    cumulative = np.cumsum(np.asarray(meta["counts"], dtype=np.int64))
+    edges = np.linspace(meta["range"][0], meta["range"][1], len(cumulative) + 1)
+    return {"cumulative": cumulative, "edges": edges, "total": int(cumulative[-1]), "min": meta["min"], "max": meta["max"]}
+
+
+def histogram_key(image_path, frame=0):
+    """
+    Decode cache key of an image's histogram.
+    """
+    return (image_path, "hist") if frame == 0 else (image_path, "hist", frame)
+
+
+def get_histogram(image_path, frame=0):
+    """
+    Return the histogram computed when the image was decoded, or None if it has not been
+    decoded yet. Never decodes: the histogram is taken from the decode cache, or from the
+    disk cache sidecar after a restart.
+    """
+    cache = get_decode_cache()
+    hist = cache.get(histogram_key(image_path, frame))
+    if hist is not None:
+        return hist
+    disk = get_disk_cache()
+    hit = disk.get(image_path, frame=frame) if disk is not None else None
+    if hit is None or "hist" not in hit[1]:
+        return None
+    return cache.put(histogram_key(image_path, frame), histogram_from_meta(hit[1]["hist"]))
+
+
+def percentile_window(hist, lower_pct, upper_pct):
+    """
+    Derive a window from two percentiles of a precomputed cumulative histogram.
+
+    Parameters:
+    - hist: Histogram dict from `compute_histogram`.
+    - lower_pct: Percentile mapped to the bottom of the window.
+    - upper_pct: Percentile mapped to the top of the window.
+
+    Returns:
+    A tuple (center, width).
+    """
+    cumulative, edges, total = hist["cumulative"], hist["edges"], hist["total"]
+    targets = np.array([lower_pct, upper_pct]) / 100.0 * total
+    idx = np.searchsorted(cumulative, targets, side="left")
+    idx = np.clip(idx, 0, len(edges) - 2)
+    lower = hist["min"] if lower_pct <= 0 else float(edges[idx[0]])
+    upper = hist["max"] if upper_pct >= 100 else float(edges[idx[1] + 1])
+    width = max(upper - lower, 1.0)
+    return lower + width / 2.0, width
+
+
+def preset_window(image_path, preset, frame=0):
+    """
+    Compute a preset window for an image.
+
+    Parameters:
+    - image_path: Path to the DICOM file.
+    - preset: Name of a preset in WINDOW_PRESETS.
+    - frame: Frame on screen for multi-frame objects.
+
+    Returns:
+    A tuple (center, width), or None while the image is still being decoded.
+    """
+    hist = get_histogram(image_path, frame)
+    if hist is None:
+        return None
+    lower_pct, upper_pct = WINDOW_PRESETS[preset]
+    return percentile_window(hist, lower_pct, upper_pct)